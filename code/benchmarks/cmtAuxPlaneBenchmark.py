@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+# Micro-benchmark of the auxiliary plane computation of focal mechanisms
+# This module is part of the Smart Center Control (SSC) solution
+
+# Author:  Juan Esteban Rodríguez, Josep de la Puente
+# Contact: juan.rodriguez@bsc.es, josep.delapuente@bsc.es
+
+# ###############################################################################
+#       BSD 3-CLAUSE, aka BSD NEW, aka BSD REVISED, aka MODIFIED BSD LICENSE
+
+# Copyright 2023,2024 Josep de la Puente, Juan Esteban Rodriguez
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name(s) of the copyright holder(s) nor the name(s) of its
+# contributor(s) may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDER(S) AND CONTRIBUTOR(S) “AS
+# IS” AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER(S) OR CONTRIBUTOR(S) BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# ###############################################################################
+import sys
+import time
+import argparse
+import traceback
+
+# Third parties
+import numpy as np
+from obspy.imaging.beachball import aux_plane
+
+# Internal
+from ucis4eq.scc.CMTCalculation import aux_plane_batch
+
+
+def parser():
+
+    # Parse the arguments
+    parser = argparse.ArgumentParser(
+        prog='cmtAuxPlaneBenchmark',
+        description='Compare obspy aux_plane (one call per mechanism) with aux_plane_batch')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 1000, 100000],
+                        help='Number of focal mechanisms of each run')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Repetitions per run (best time is reported)')
+    args = parser.parse_args()
+
+    # Return them
+    return args
+
+def best(fn, repeat):
+    """
+    Best wall time of several executions of fn
+    """
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+
+    return min(times), result
+
+def main():
+    try:
+        # Call the parser
+        args = parser()
+
+        rng = np.random.default_rng(0)
+        print("%10s %14s %14s %10s %14s" % ("size", "obspy (s)", "batch (s)", "speedup", "max error"))
+        for size in args.sizes:
+            strike = rng.uniform(0, 360, size)
+            dip = rng.uniform(0, 90, size)
+            rake = rng.uniform(-180, 180, size)
+
+            tObspy, reference = best(lambda: [aux_plane(s, d, r) for s, d, r in zip(strike, dip, rake)],
+                                     args.repeat)
+            tBatch, planes = best(lambda: aux_plane_batch(strike, dip, rake), args.repeat)
+
+            error = np.abs(np.column_stack(planes) - np.array(reference, dtype=float)).max()
+            print("%10d %14.6f %14.6f %10.1f %14.3e" % (size, tObspy, tBatch, tObspy / tBatch, error),
+                  flush=True)
+
+    except Exception as error:
+        print("Exception in code:")
+        print('-'*80)
+        traceback.print_exc(file=sys.stdout)
+        print('-'*80)
+
+# ###############################################################################
+
+if __name__ == "__main__":
+    main()
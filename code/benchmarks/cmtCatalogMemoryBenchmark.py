@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+# Peak memory of the CMT catalog representations
+# This module is part of the Smart Center Control (SSC) solution
+
+# Author:  Juan Esteban Rodríguez, Josep de la Puente
+# Contact: juan.rodriguez@bsc.es, josep.delapuente@bsc.es
+
+# ###############################################################################
+#       BSD 3-CLAUSE, aka BSD NEW, aka BSD REVISED, aka MODIFIED BSD LICENSE
+
+# Copyright 2023,2024 Josep de la Puente, Juan Esteban Rodriguez
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name(s) of the copyright holder(s) nor the name(s) of its
+# contributor(s) may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDER(S) AND CONTRIBUTOR(S) “AS
+# IS” AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER(S) OR CONTRIBUTOR(S) BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# ###############################################################################
+import os
+import sys
+import time
+import resource
+import argparse
+import traceback
+import subprocess
+
+# Third parties
+import obspy
+import numpy as np
+
+# Internal
+from ucis4eq.scc import CMTCatalog
+from ucis4eq.scc.CMTCalculation import Event
+
+
+class LegacyEvent():
+    "Event as it was stored per catalog entry (per-instance dict, UTCDateTime)"
+
+    def __init__(self, lat, lon, depth, mag, strike=0., dip=0., rake=0., datetime=None):
+        self.lat = lat
+        self.lon = lon
+        self.depth = depth
+        self.mag = mag
+        self.strike = strike
+        self.dip = dip
+        self.rake = rake
+        self.datetime = obspy.UTCDateTime(datetime) if datetime is not None else None
+
+
+def parser():
+
+    # Parse the arguments
+    parser = argparse.ArgumentParser(
+        prog='cmtCatalogMemoryBenchmark',
+        description='Peak RSS of the CMT catalog: obspy objects vs record array')
+    parser.add_argument('catalog', help='QuakeML catalog (e.g. 50k events)')
+    parser.add_argument('--magnitude', type=float, default=0.,
+                        help='Magnitude threshold of the catalog')
+    parser.add_argument('--mode', choices=['legacy', 'records'], default=None,
+                        help='Run a single representation (internal use)')
+    args = parser.parse_args()
+
+    # Check the arguments
+    if not os.path.isfile(args.catalog):
+        raise Exception("The catalog file '" + args.catalog + "' doesn't exist")
+
+    # Return them
+    return args
+
+def peakRSS():
+    """
+    Peak resident set size of the current process (MB). VmHWM is used when
+    available since ru_maxrss may be inherited from the parent process.
+    """
+    try:
+        with open("/proc/self/status", 'r') as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run(args):
+    """
+    Load the catalog with a given representation and report the memory
+    """
+    initial = peakRSS()
+    start = time.perf_counter()
+
+    if args.mode == 'legacy':
+        # One obspy catalog and one event object per entry (former path)
+        cat = obspy.read_events(args.catalog)
+        events = []
+        for e in cat:
+            if e.magnitudes[0]['mag'] >= args.magnitude:
+                fm = e.focal_mechanisms[0]['nodal_planes'].nodal_plane_1
+                events.append(LegacyEvent(e.origins[1]['latitude'], e.origins[1]['longitude'],
+                                          e.origins[1]['depth'], e.magnitudes[0]['mag'],
+                                          fm.strike, fm.dip, fm.rake, e.origins[1]['time']))
+        size = len(events)
+    else:
+        # Filtered record array and its spatial index
+        index = CMTCatalog.loadIndex(args.catalog, args.magnitude)
+        events = [Event(r.latitude, r.longitude, r.depth, r.magnitude,
+                        r.strike, r.dip, r.rake) for r in index.catalog[0:10]]
+        size = len(index.catalog)
+
+    print("%-8s %8d events %10.1f s %12.1f MB %12.1f MB" %
+          (args.mode, size, time.perf_counter() - start, initial, peakRSS()), flush=True)
+
+def main():
+    try:
+        # Call the parser
+        args = parser()
+
+        if args.mode:
+            run(args)
+            return
+
+        # Build the columnar cache beforehand (parsed once per catalog)
+        CMTCatalog.FocalMechanismCatalog.load(args.catalog)
+
+        # Each representation runs in a fresh process
+        print("%-8s %15s %12s %15s %15s" % ("mode", "size", "time", "RSS (imports)", "peak RSS"))
+        for mode in ['legacy', 'records']:
+            subprocess.run([sys.executable, os.path.abspath(__file__), args.catalog,
+                            '--magnitude', str(args.magnitude), '--mode', mode], check=True)
+
+    except Exception as error:
+        print("Exception in code:")
+        print('-'*80)
+        traceback.print_exc(file=sys.stdout)
+        print('-'*80)
+
+# ###############################################################################
+
+if __name__ == "__main__":
+    main()
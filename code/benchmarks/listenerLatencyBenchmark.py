@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+
+# Detection latency of the FDSN listener with one slow agency
+# This module is part of the Automatic Alert System (AAS) solution
+
+# Author:  Juan Esteban Rodríguez, Josep de la Puente
+# Contact: juan.rodriguez@bsc.es, josep.delapuente@bsc.es
+
+# ###############################################################################
+#       BSD 3-CLAUSE, aka BSD NEW, aka BSD REVISED, aka MODIFIED BSD LICENSE
+
+# Copyright 2023,2024 Josep de la Puente, Juan Esteban Rodriguez
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name(s) of the copyright holder(s) nor the name(s) of its
+# contributor(s) may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDER(S) AND CONTRIBUTOR(S) “AS
+# IS” AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER(S) OR CONTRIBUTOR(S) BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# ###############################################################################
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+import threading
+import traceback
+import socketserver
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+# Third parties
+import obspy
+
+# Internal
+from ucis4eq.aas import FSDNClient
+
+# Answer of the stand-in FDSN event service
+QUAKEML = """<?xml version="1.0" encoding="UTF-8"?>
+<q:quakeml xmlns:q="http://quakeml.org/xmlns/quakeml/1.2" xmlns="http://quakeml.org/xmlns/bed/1.2">
+  <eventParameters publicID="smi:local/benchmark">
+    <event publicID="smi:local/event/1">
+      <description><text>Benchmark region</text></description>
+      <origin publicID="smi:local/origin/1">
+        <time><value>%s</value></time>
+        <latitude><value>40.0</value></latitude>
+        <longitude><value>15.0</value></longitude>
+        <depth><value>10000.0</value></depth>
+      </origin>
+      <magnitude publicID="smi:local/magnitude/1"><mag><value>6.0</value></mag></magnitude>
+    </event>
+  </eventParameters>
+</q:quakeml>
+"""
+
+
+class FDSNServer(socketserver.ThreadingMixIn, HTTPServer):
+    "Stand-in FDSN event service answering each agency with a given delay"
+
+    daemon_threads = True
+
+    def __init__(self, delays, eventTime):
+        self.delays = delays
+        self.eventTime = eventTime
+        HTTPServer.__init__(self, ("127.0.0.1", 0), FDSNHandler)
+
+
+class FDSNHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        agency = self.path.strip("/").split("/")[0]
+        time.sleep(self.server.delays.get(agency, 0))
+
+        body = (QUAKEML % str(self.server.eventTime)).encode('utf-8')
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class BenchmarkListener(FSDNClient.WSEvents):
+    "Listener without DAL and static data (the configuration is given)"
+
+    def __init__(self, config, outdir):
+        self.results = {}
+        self.association = None
+        self.currenttime = None
+        self.config = config
+        self.outdir = outdir + "/"
+        self.tmpdata = self.outdir + "temporary_data/"
+        self.query = self._buildQuery()
+        self.watermarksFile = None
+        self.dispatcher = None
+        self.detections = {}
+        self.alerts = {}
+        self.start = time.time()
+        os.makedirs(self.tmpdata, exist_ok=True)
+
+    def _trigger(self, output):
+        # Record when each event was triggered (and its alerts) instead of
+        # running the action
+        if output:
+            for e in output['events']:
+                self.detections.setdefault(e, time.time() - self.start)
+                self.alerts[e] = len(output['events'][e])
+
+
+def parser():
+
+    # Parse the arguments
+    parser = argparse.ArgumentParser(
+        prog='listenerLatencyBenchmark',
+        description='Detection latency of the listener (pool vs asyncio) with one slow agency')
+    parser.add_argument('--agencies', type=int, default=4, help='Number of agencies')
+    parser.add_argument('--slow', type=float, default=5.0,
+                        help='Delay (s) of the slow agency')
+    parser.add_argument('--timeout', type=float, default=30.0,
+                        help='Timeout (s) of each agency')
+    parser.add_argument('--window', type=float, default=0.0,
+                        help='Association window (s) of the asyncio mode')
+    args = parser.parse_args()
+
+    # Return them
+    return args
+
+def configuration(args, port):
+    """
+    Listener configuration pointing to the stand-in server
+    """
+    repositories = {"agency" + str(i): "http://127.0.0.1:" + str(port) + "/agency" + str(i) + "/"
+                    for i in range(args.agencies)}
+
+    return {"listener": {"interval": 0, "deadline": 3600, "timethreshold": 60,
+                         "timeout": args.timeout, "data_ext": ".xml",
+                         "associationwindow": args.window,
+                         "results_name": "event.json", "trigger": "true %s"},
+            "webservice": {"interface": "fdsnws", "majorversion": "1",
+                           "application": "event", "parameters": {"format": "xml"}},
+            "repositories": repositories}
+
+def run(mode, config, outdir):
+    """
+    One polling round of every agency (the event is detected by all of them)
+    """
+    listener = BenchmarkListener(config, outdir)
+    if mode == "asyncio":
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(listener._exploreRepositoriesAsync(loop))
+    else:
+        listener._exploreRepositories()
+    total = time.time() - listener.start
+
+    latency = min(listener.detections.values()) if listener.detections else float('nan')
+    alerts = max(listener.alerts.values()) if listener.alerts else 0
+    print("%-8s %18.3f s %18.3f s %8d" % (mode, latency, total, alerts), flush=True)
+
+def main():
+    try:
+        # Call the parser
+        args = parser()
+
+        # Stand-in FDSN service (the last agency is slow)
+        delays = {"agency" + str(args.agencies - 1): args.slow}
+        server = FDSNServer(delays, obspy.UTCDateTime() - 10)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        config = configuration(args, server.server_address[1])
+
+        print("%-8s %20s %20s %8s" % ("mode", "detection latency", "round time", "alerts"))
+        with tempfile.TemporaryDirectory() as outdir:
+            for mode in ["pool", "asyncio"]:
+                run(mode, config, outdir)
+
+        server.shutdown()
+
+    except Exception as error:
+        print("Exception in code:")
+        print('-'*80)
+        traceback.print_exc(file=sys.stdout)
+        print('-'*80)
+
+# ###############################################################################
+
+if __name__ == "__main__":
+    main()
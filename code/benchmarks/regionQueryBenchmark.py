@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+
+# Cost of the region and service run queries with and without indexes
+# This module is part of the Smart Center Control (SSC) solution
+
+# Author:  Juan Esteban Rodríguez, Josep de la Puente
+# Contact: juan.rodriguez@bsc.es, josep.delapuente@bsc.es
+
+# ###############################################################################
+#       BSD 3-CLAUSE, aka BSD NEW, aka BSD REVISED, aka MODIFIED BSD LICENSE
+
+# Copyright 2023,2024 Josep de la Puente, Juan Esteban Rodriguez
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name(s) of the copyright holder(s) nor the name(s) of its
+# contributor(s) may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDER(S) AND CONTRIBUTOR(S) “AS
+# IS” AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER(S) OR CONTRIBUTOR(S) BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# ###############################################################################
+import sys
+import time
+import argparse
+import datetime
+import traceback
+
+# Third parties
+import numpy as np
+from pymongo import MongoClient, InsertOne
+
+# Internal
+import ucis4eq.dal as dal
+from ucis4eq.dal.dynamicDataAccess import DAL
+from ucis4eq.scc import regionIndex
+
+
+def parser():
+
+    # Parse the arguments
+    parser = argparse.ArgumentParser(
+        prog='regionQueryBenchmark',
+        description='Region and service run queries with and without the DAL indexes')
+    parser.add_argument('--host', default='localhost', help='MongoDB host')
+    parser.add_argument('--port', type=int, default=27017, help='MongoDB port')
+    parser.add_argument('--database', default='UCIS4EQBenchmark',
+                        help='Scratch database (it is removed)')
+    parser.add_argument('--regions', type=int, default=10000, help='Number of regions')
+    parser.add_argument('--runs', type=int, default=1000000, help='Number of service runs')
+    parser.add_argument('--requests', type=int, default=100000, help='Number of requests')
+    parser.add_argument('--queries', type=int, default=200, help='Queries per test')
+    args = parser.parse_args()
+
+    # Return them
+    return args
+
+def populate(db, args, rng):
+    """
+    Fill the scratch database with random regions, requests and service runs
+    """
+    regions = []
+    for i in range(args.regions):
+        lat = rng.uniform(-80, 75)
+        lon = rng.uniform(-180, 170)
+        height, width = rng.uniform(0.5, 10, 2)
+        regions.append({"id": "region" + str(i), "file_structure": "benchmark",
+                        "min_latitude": lat, "max_latitude": lat + height,
+                        "min_longitude": lon, "max_longitude": lon + width})
+    db['Regions'].insert_many(regions)
+
+    states = ["SUCCESS", "FAILED", "RUNNING", "CANCELLED"]
+    db['Requests'].insert_many([{"state": states[s]}
+                                for s in rng.integers(0, len(states), args.requests)])
+
+    services = ["EventRegion", "EventSetup", "IndexPriority", "CMTCalculation"]
+    start = datetime.datetime(2023, 1, 1)
+    batch = []
+    for i in range(args.runs):
+        batch.append(InsertOne({
+            "serviceName": services[i % len(services)],
+            "requestId": "request" + str(i // 10),
+            "status": "SUCCESS",
+            "initTime": (start + datetime.timedelta(seconds=i)).strftime("%Y-%m-%d %H:%M:%S"),
+            "inputs": {"trial": "trial" + str(i // 50)}}))
+        if len(batch) == 10000:
+            db['ServiceRuns'].bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        db['ServiceRuns'].bulk_write(batch, ordered=False)
+
+def measure(name, queries, run):
+    """
+    Average time (ms) of a set of queries
+    """
+    start = time.perf_counter()
+    found = sum(run(q) for q in queries)
+    elapsed = (time.perf_counter() - start) / len(queries) * 1000
+    print("%-40s %12.3f ms %10d results" % (name, elapsed, found), flush=True)
+
+def bboxPipeline(db, latitude, longitude):
+    """
+    Former region query (aggregation over the bounding boxes)
+    """
+    return len(list(db['Regions'].aggregate([
+        {"$project": {"_id": {"$toString": "$_id"}, "id": 1,
+                      "min_latitude": 1, "max_latitude": 1,
+                      "min_longitude": 1, "max_longitude": 1}},
+        {"$match": {"$and": [
+            {"min_latitude": {"$lte": latitude}},
+            {"max_latitude": {"$gte": latitude}},
+            {"min_longitude": {"$lte": longitude}},
+            {"max_longitude": {"$gte": longitude}}]}}])))
+
+def benchmark(db, args, rng, indexed):
+    """
+    Run every query type
+    """
+    suffix = " (indexed)" if indexed else ""
+    points = list(zip(rng.uniform(-80, 80, args.queries), rng.uniform(-180, 180, args.queries)))
+    requestIds = ["request" + str(i) for i in rng.integers(0, args.runs // 10, args.queries)]
+    trials = ["trial" + str(i) for i in rng.integers(0, args.runs // 50, args.queries)]
+
+    measure("Regions bbox pipeline" + suffix, points,
+            lambda p: bboxPipeline(db, *p))
+    if indexed:
+        measure("Regions $geoIntersects" + suffix, points,
+                lambda p: len(regionIndex.regions.query(*p)))
+        regionIndex.regions.update(force=True)
+        measure("Regions in-memory R-tree", points,
+                lambda p: len(regionIndex.regions.lookup(*p)))
+    measure("ServiceRuns by requestId/initTime" + suffix, requestIds,
+            lambda r: len(list(db['ServiceRuns'].find({"requestId": r}).sort("initTime", 1))))
+    measure("ServiceRuns by inputs.trial" + suffix, trials,
+            lambda t: len(list(db['ServiceRuns'].find({"inputs.trial": t}))))
+    measure("Requests by state" + suffix, ["RUNNING"] * min(args.queries, 20),
+            lambda s: db['Requests'].count_documents({"state": s}))
+
+def main():
+    try:
+        # Call the parser
+        args = parser()
+        rng = np.random.default_rng(0)
+
+        # Scratch database
+        client = MongoClient(args.host, args.port)
+        client.drop_database(args.database)
+        db = client[args.database]
+        dal.database = db
+
+        print("Populating " + str(args.regions) + " regions and " +
+              str(args.runs) + " service runs", flush=True)
+        populate(db, args, rng)
+
+        benchmark(db, args, np.random.default_rng(1), False)
+
+        start = time.perf_counter()
+        DAL()._createIndexes(db)
+        print("Index creation: %.1f s" % (time.perf_counter() - start), flush=True)
+
+        # Running it again must be cheap (nothing to update)
+        start = time.perf_counter()
+        DAL()._createIndexes(db)
+        print("Index creation (again): %.1f s" % (time.perf_counter() - start), flush=True)
+
+        benchmark(db, args, np.random.default_rng(1), True)
+
+        client.drop_database(args.database)
+
+    except Exception as error:
+        print("Exception in code:")
+        print('-'*80)
+        traceback.print_exc(file=sys.stdout)
+        print('-'*80)
+
+# ###############################################################################
+
+if __name__ == "__main__":
+    main()
@@ -40,17 +40,176 @@ import sys
 import json
 import requests
 import sched, time
+import math
+import heapq
 import multiprocessing
+import asyncio
+import traceback
+import concurrent.futures
 import obspy
 import datetime
 import psutil
+import xml.etree.ElementTree as ET
 
 from ucis4eq.dal import staticDataMap
+from ucis4eq.aas import eventDispatcher
 from ucis4eq.misc import config
 
 # ###############################################################################
 # Methods and classes
 
+def _localName(tag):
+    """
+    Tag name without its XML namespace
+    """
+    return tag.rsplit('}', 1)[-1]
+
+def _child(element, *path):
+    """
+    First descendant following a path of tag names (without namespaces)
+    """
+    for name in path:
+        for child in element:
+            if _localName(child.tag) == name:
+                element = child
+                break
+        else:
+            return None
+    return element
+
+def _float(element, *path):
+    value = _child(element, *path)
+    return float(value.text) if value is not None and value.text else None
+
+def iterQuakeML(source):
+    """
+    Stream the events of a QuakeML document (file name or file-like object)
+    without building the whole catalog. Only the fields used by the
+    listener are obtained: time, latitude, longitude and depth of the first
+    origin, the first magnitude and the first description.
+    """
+    root = None
+    for action, element in ET.iterparse(source, events=('start', 'end')):
+        if action == 'start':
+            if root is None:
+                root = element
+            continue
+
+        if _localName(element.tag) != 'event':
+            continue
+
+        time = _child(element, 'origin', 'time', 'value')
+        description = _child(element, 'description', 'text')
+        if time is not None:
+            yield {'time': obspy.UTCDateTime(time.text.strip()).timestamp,
+                   'latitude': _float(element, 'origin', 'latitude', 'value'),
+                   'longitude': _float(element, 'origin', 'longitude', 'value'),
+                   'depth': _float(element, 'origin', 'depth', 'value'),
+                   'magnitude': _float(element, 'magnitude', 'mag', 'value'),
+                   'description': description.text if description is not None else ""}
+
+        # Free the parsed events
+        element.clear()
+        root.clear()
+
+
+class EventAssociation:
+    """
+    Index of the events already received, used to associate the alerts of
+    different agencies with the same event. Events are stored in buckets of
+    'threshold' seconds, so an alert is only compared with the events of its
+    bucket and the neighbour ones. Two alerts are the same event when they
+    are close in time, distance (km) and magnitude. Events older than 'ttl'
+    seconds are evicted.
+    """
+
+    # Initialization method
+    def __init__(self, threshold, distance=250.0, magnitude=1.5, ttl=86400.0):
+        self.threshold = float(threshold)
+        self.distance = distance
+        self.magnitude = magnitude
+        self.ttl = ttl
+
+        # Events of each bucket and heap of the bucket keys
+        self._buckets = {}
+        self._keys = []
+        self.size = 0
+        self.evicted = 0
+
+    def _key(self, t):
+        return int(math.floor(t / max(self.threshold, 1e-6)))
+
+    @staticmethod
+    def _haversine(lat1, lon1, lat2, lon2):
+        lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+        d = math.sin((lat2 - lat1) * 0.5) ** 2 + \
+            math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) * 0.5) ** 2
+        return 6371.0088 * 2 * math.asin(math.sqrt(d))
+
+    def _close(self, e, he):
+        """
+        Check the distance and magnitude between two events (when known)
+        """
+        if self.distance is not None and None not in (e.get('latitude'), e.get('longitude'),
+                                                      he['latitude'], he['longitude']):
+            if self._haversine(e['latitude'], e['longitude'],
+                               he['latitude'], he['longitude']) > self.distance:
+                return False
+
+        if self.magnitude is not None and None not in (e.get('magnitude'), he['magnitude']):
+            if abs(e['magnitude'] - he['magnitude']) > self.magnitude:
+                return False
+
+        return True
+
+    def find(self, e):
+        """
+        Identifier of the closest (in time) event associated with an alert
+        ("" if there is none)
+        """
+        key = self._key(e['time'])
+        best = None
+        for k in (key - 1, key, key + 1):
+            for he in self._buckets.get(k, []):
+                delay = abs(e['time'] - he['time'])
+                if delay <= self.threshold and self._close(e, he) and \
+                   (best is None or delay <= best[0]):
+                    best = (delay, he['event'])
+
+        return best[1] if best else ""
+
+    def add(self, e, id):
+        """
+        Register an alert of the event 'id'
+        """
+        key = self._key(e['time'])
+        if key not in self._buckets:
+            self._buckets[key] = []
+            heapq.heappush(self._keys, key)
+
+        self._buckets[key].append({'time': e['time'], 'event': id,
+                                   'latitude': e.get('latitude'),
+                                   'longitude': e.get('longitude'),
+                                   'magnitude': e.get('magnitude')})
+        self.size += 1
+
+    def evict(self, now=None):
+        """
+        Forget the events older than the TTL
+        """
+        if now is None:
+            now = time.time()
+        limit = self._key(now - self.ttl)
+
+        while self._keys and self._keys[0] < limit:
+            bucket = self._buckets.pop(heapq.heappop(self._keys))
+            self.size -= len(bucket)
+            self.evicted += len(bucket)
+
+    def stats(self):
+        return {'events': self.size, 'buckets': len(self._buckets),
+                'evicted': self.evicted}
+
 
 # Interface class
 class WSGeneral:
@@ -70,6 +229,9 @@ class WSGeneral:
         self.outdir = "./"
         self.tmpdata = ""
         self.query = ""
+        self.watermarksFile = None
+        self.dispatcher = None
+        self.held = None
 
         # Object UUID
         #self.uuid = uuid.uuid1()
@@ -81,8 +243,15 @@ class WSGeneral:
         # Index documents with regard this component
         self.fileMapping = staticDataMap.StaticDataMap(self.__class__.__name__)
 
-    # Start client
-    def start(self, file):
+    # Runtime objects (scheduler, dispatcher) are not sent to the pool workers
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for name in ('s', 'dispatcher'):
+            state.pop(name, None)
+        return state
+
+    # Start client ("pool" or "asyncio" mode)
+    def start(self, file, mode=None):
 
         # Read the configuration file
         with open(self.fileMapping[file], 'r') as f:
@@ -99,6 +268,20 @@ class WSGeneral:
         # Create data directories
         os.makedirs(self.tmpdata, exist_ok=True)
 
+        # Query of the web service
+        self.query = self._buildQuery()
+
+        # Continue from the last events received by each agency
+        self.watermarksFile = self.config["listener"].get("watermarks",
+                                                          self.outdir + "watermarks.json")
+        self._loadWatermarks()
+
+        # Each agency is polled on its own
+        if (mode or self.config["listener"].get("mode", "pool")) == "asyncio":
+            loop = asyncio.get_event_loop()
+            loop.run_until_complete(self._exploreRepositoriesAsync(loop))
+            return
+
         # Create the recursive scheduler
         self.s = sched.scheduler(time.time, time.sleep)
 
@@ -116,18 +299,12 @@ class WSGeneral:
 
         # Prepare the pool of processes
         np = len(self.config['repositories'])
-        ws = self.config['webservice']
 
         # Create the processes pool just one
         if not pool:
             pool = multiprocessing.Pool(np)
 
-        query = ws['interface'] + "/" + ws['majorversion'] + "/"
-        query = query + ws["application"] + "?"
-        for p in ws["parameters"]:
-            query = query + p + "=" + ws["parameters"][p] + "&"
-
-        self.query = query.strip('&')
+        self.query = self._buildQuery()
 
         # For each provided repository
         tasks = [(self._requestRepository,
@@ -147,16 +324,129 @@ class WSGeneral:
         output = self._postprocess_actions()
 
         # If there are elements, write them and trigger the set action
+        self._trigger(output)
+        self._saveWatermarks()
+
+        # Queue the following job
+        interval = self.config['listener']['interval']
+        if( interval > 0 ):
+            #print("Next report in ", interval, "seconds")
+            self.s.enter(interval, 1, self._exploreRepositories, kwargs={'pool': pool})
+
+    # Poll every repository independently (asyncio mode)
+    async def _exploreRepositoriesAsync(self, loop):
+        # Events waiting for the alerts of the other agencies
+        self.held = {'sources': {}, 'events': {}, 'due': {}}
+
+        tasks = [asyncio.ensure_future(self._pollRepository(loop, r))
+                 for r in self.config['repositories'].keys()]
+        release = asyncio.ensure_future(self._releaseEvents(loop))
+        await asyncio.gather(*tasks)
+
+        # No more alerts will be received
+        release.cancel()
+        self._trigger(self._releaseHeld())
+
+    # Trigger the held events once their association window finishes
+    async def _releaseEvents(self, loop):
+        window = self.config['listener'].get('associationwindow', 5)
+        while True:
+            await asyncio.sleep(min(max(window / 10.0, 0.05), 1.0))
+            self._trigger(self._releaseHeld(loop.time()))
+
+    # Hold the new events during the association window
+    def _holdEvents(self, now):
+        window = self.config['listener'].get('associationwindow', 5)
+        for id in self.held['events']:
+            if id not in self.held['due']:
+                self.held['due'][id] = now + window
+
+    # Held events whose association window finished (all of them by default)
+    def _releaseHeld(self, now=None):
+        ids = [id for id, due in self.held['due'].items() if now is None or due <= now]
+        if not ids:
+            return None
+
+        output = {'sources': dict(self.held['sources']), 'events': {}}
+        for id in ids:
+            output['events'][id] = self.held['events'].pop(id)
+            del self.held['due'][id]
+        return output
+
+    # Poll a repository with its own cadence, timeout and HTTP session
+    async def _pollRepository(self, loop, name):
+        listener = self.config['listener']
+        interval = listener.get('intervals', {}).get(name, listener['interval'])
+        timeout = listener.get('timeouts', {}).get(name, listener.get('timeout', 30))
+        url = self.config['repositories'][name] + self.query
+
+        # Keep-alive connections, one thread per agency (a hung agency only
+        # delays itself)
+        session = requests.Session()
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+
+        while True:
+            start = loop.time()
+            try:
+                request = loop.run_in_executor(executor, self._requestRepository,
+                                               name, url, session, timeout)
+                agency, nelems, result = await asyncio.wait_for(request, timeout)
+                self.results[name] = result
+
+                # Associate the alerts of this agency with the held events
+                # and trigger the ones whose association window finished
+                self._postprocess_actions([name], self.held)
+                self._holdEvents(loop.time())
+                self._trigger(self._releaseHeld(loop.time()))
+                self._saveWatermarks()
+
+            except asyncio.TimeoutError:
+                print("WARNING: Agency '" + name + "' did not answer in " +
+                      str(timeout) + " seconds", flush=True)
+            except Exception as error:
+                print("WARNING: Polling agency '" + name + "' failed", flush=True)
+                traceback.print_exc(file=sys.stdout)
+
+            if( interval <= 0 ):
+                break
+            await asyncio.sleep(max(interval - (loop.time() - start), 0))
+
+        executor.shutdown(wait=False)
+        session.close()
+
+    # Build the query of the web service
+    def _buildQuery(self):
+        ws = self.config['webservice']
+
+        query = ws['interface'] + "/" + ws['majorversion'] + "/"
+        query = query + ws["application"] + "?"
+        for p in ws["parameters"]:
+            query = query + p + "=" + ws["parameters"][p] + "&"
+
+        return query.strip('&')
+
+    # Dispatcher of the events to the workflow manager (when configured)
+    def _dispatcher(self):
+        settings = self.config['listener'].get('dispatch')
+        if settings and self.dispatcher is None:
+            self.dispatcher = eventDispatcher.EventDispatcher(settings['url'],
+                settings.get('batch', 16), settings.get('queue', 256),
+                settings.get('timeout', 30), settings.get('retry', 5))
+        return self.dispatcher
+
+    # Write the events found and trigger the set action
+    def _trigger(self, output):
         if (output):
             #time2 = datetime.datetime.now(datetime.timezone.utc).strftime('%d%m%Y_%H%M%S')+"_"
             #file = self.outdir + time2 + self.config['listener']['results_name']
 
             #print(json.dumps(output), flush=True)
+            dispatcher = self._dispatcher()
 
             # Do a trigger for each event received
-            event = {}
             for e in output['events']:
 
+                event = {}
                 event['alerts'] = output['events'][e]
                 event['uuid'] = e
                 event['sources'] = {}
@@ -166,26 +456,105 @@ class WSGeneral:
                     event['sources'][agency] = output['sources'][agency]
                 #print(json.dumps(event), flush=True)
 
-                file = self.outdir + e + "." + self.config['listener']['results_name']
-                with open(file, "w") as f:
-                    json.dump(event, f, indent=4)
+                # Submit the event straight to the workflow manager
+                if dispatcher:
+                    if dispatcher.dispatch(event):
+                        if self.config['listener'].get('debug', False):
+                            self._writeEvent(e, event)
+                        continue
+                    print("WARNING: The dispatch queue is full, event " + e +
+                          " is notified through the trigger", flush=True)
+
+                file = self._writeEvent(e, event)
 
                 # Start running the triggering system
-                os.system((self.config['listener']['trigger'] + "&").replace("%s", file))
+                if 'trigger' in self.config['listener']:
+                    os.system((self.config['listener']['trigger'] + "&").replace("%s", file))
+
+    # Write an event to the output directory
+    def _writeEvent(self, id, event):
+        file = self.outdir + id + "." + self.config['listener']['results_name']
+        with open(file, "w") as f:
+            json.dump(event, f, indent=4)
+        return file
 
-        # Queue the following job
-        interval = self.config['listener']['interval']
-        if( interval > 0 ):
-            #print("Next report in ", interval, "seconds")
-            self.s.enter(interval, 1, self._exploreRepositories, kwargs={'pool': pool})
 
+    # Last state received from an agency (without events)
+    def _watermark(self, name):
+        previous = self.results.get(name)
+        if not previous:
+            return {}
+        watermark = {k: previous[k] for k in ('timestamp', 'etag', 'lastModified')
+                     if previous.get(k) is not None}
+        watermark['events'] = []
+        return watermark
+
+    # Read the watermarks stored by a previous run
+    def _loadWatermarks(self):
+        try:
+            with open(self.watermarksFile, 'r') as f:
+                watermarks = json.load(f)
+        except (OSError, ValueError):
+            return
+
+        for name in self.config['repositories']:
+            if name in watermarks and not self.results.get(name):
+                self.results[name] = dict(watermarks[name], events=[])
+        self._savedWatermarks = watermarks
+
+    # Store the watermarks so a restart does not download everything again
+    def _saveWatermarks(self):
+        if not self.watermarksFile:
+            return
+
+        watermarks = {}
+        for name in self.results:
+            watermark = self._watermark(name)
+            if watermark:
+                del watermark['events']
+                watermarks[name] = watermark
+        if watermarks == getattr(self, '_savedWatermarks', None):
+            return
+
+        tmp = self.watermarksFile + ".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(watermarks, f, indent=4)
+        os.replace(tmp, self.watermarksFile)
+        self._savedWatermarks = watermarks
+
+    # Query parameters restricting the answer to the new data of an agency
+    def _incrementalQuery(self, name):
+        return ""
+
+    # Conditional request headers (ETag and Last-Modified of the last answer)
+    def _conditionalHeaders(self, name):
+        watermark = self._watermark(name)
+        headers = {}
+        if 'etag' in watermark:
+            headers['If-None-Match'] = watermark['etag']
+        if 'lastModified' in watermark:
+            headers['If-Modified-Since'] = watermark['lastModified']
+        return headers
 
     # Do the REST-GET petition
-    def _requestRepository(self, name, url):
+    def _requestRepository(self, name, url, session=None, timeout=None):
+        # Request only the new data
+        incremental = self._incrementalQuery(name)
+        if incremental:
+            url = url + ("" if url.endswith("?") else "&") + incremental
+
         # Request data
         #print("Requesting info from '" + url + "'")
-        self.r = requests.get(url, stream=True)
-        nelems, result = self._process_data(self.r, name)
+        r = (session or requests).get(url, stream=True, timeout=timeout,
+                                      headers=self._conditionalHeaders(name))
+        nelems, result = self._process_data(r, name)
+
+        # Validators of the answer for the next conditional request
+        if result:
+            for key, header in (('etag', 'ETag'), ('lastModified', 'Last-Modified')):
+                if r.headers.get(header):
+                    result[key] = r.headers[header]
+
         # Process data
         return (name, nelems, result)
 
@@ -201,8 +570,9 @@ class WSGeneral:
         return file
 
 
-    # Post-process actions
-    def _postprocess_actions(self):
+    # Post-process actions (for all the agencies or the given ones), adding
+    # the events to a given output
+    def _postprocess_actions(self, names=None, output=None):
         pass
 
 
@@ -220,20 +590,49 @@ class WSEvents(WSGeneral):
     def __init__(self):
         # Attributes
         self.currenttime = None
-        self.events = []
+        self.association = None
         #WSGeneral.__init__(self,config)
         super(WSEvents, self).__init__()
         #self.uuid = uuid.uuid1()
 
+    # Origin time (or update time) of the last event received by an agency
+    def _incrementalQuery(self, name):
+        listener = self.config['listener']
+        parameter = listener.get('incremental', 'starttime')
+        if not parameter or parameter in self.config['webservice']['parameters']:
+            return ""
+
+        # Events older than the deadline are never triggered
+        start = time.time() - listener['deadline']
+        watermark = self._watermark(name).get('timestamp')
+        if watermark is not None:
+            start = max(start, watermark)
+
+        start = datetime.datetime.utcfromtimestamp(math.floor(start))
+        return parameter + "=" + start.strftime('%Y-%m-%dT%H:%M:%S')
+
     def _process_data(self, results, name):
         # Variables
         params = self.config['webservice']['parameters']
 
-        # Write the original file to disk
-        file = super(WSEvents, self)._process_data(results, name)
+        # Nothing new since the last request (keep the watermark)
+        if results.status_code in (204, 304):
+            results.close()
+            return 0, self._watermark(name)
+
+        # Write the original file to disk (only for debugging) or stream it
+        if self.config['listener'].get('debug', False):
+            file = super(WSEvents, self)._process_data(results, name)
+        else:
+            results.raw.decode_content = True
+            file = results.raw
+
         # Check the requested format
-        if( 'format' in params.keys() and params['format'] == "xml"):
-            return self._process_xml_data(results, file, name)
+        try:
+            if( 'format' in params.keys() and params['format'] == "xml"):
+                return self._process_xml_data(results, file, name)
+        finally:
+            results.close()
         return 0
 
     # Process a QuakeML data
@@ -241,9 +640,13 @@ class WSEvents(WSGeneral):
         # Variables
         now = None
         delay = None
-        cat = None
+        latest = None
         events = []
 
+        # FDSN services sort the events from the newest by default
+        params = self.config['webservice']['parameters']
+        ordered = params.get('orderby', 'time') == 'time'
+
         # Set the time threshold
         if( name in self.results.keys() and self.results[name] ):
             currenttime = self.results[name]['timestamp']
@@ -251,8 +654,14 @@ class WSEvents(WSGeneral):
             currenttime = 0.0
 
         try:
-            # Read the set of events
-            cat = obspy.read_events(file, "QUAKEML")
+            # Read the set of events (stop at the first already processed)
+            cat = []
+            for e in iterQuakeML(file):
+                if latest is None:
+                    latest = e['time']
+                if currenttime >= e['time'] and ordered:
+                    break
+                cat.append(e)
         except Exception as error:
             # MPC printing information for debugging
             # MPC the listener pings the FDSN services every 60s and updates the files in
@@ -260,15 +669,19 @@ class WSEvents(WSGeneral):
             # If one of the agencies does not give a response, the file AGENCY_NAME.response
             # in the tmp directory is going to be empty, which is what this exception catches.
             # print("WARNING: reading the events from file %s failed." %file)
-            return False, {}
+            return False, self._watermark(name)
 
         #print("[", name, "] --> ", cat.count(),"events found")
 
+        # Nothing was received
+        if latest is None:
+            return False, self._watermark(name)
+
         for e in cat:
-            if(currenttime < e.origins[0]['time'].timestamp):
+            if(currenttime < e['time']):
                 # Calculate the elapsed time from last event occurred
                 now = datetime.datetime.now(datetime.timezone.utc)
-                delay = now.timestamp() - e.origins[0]['time'].timestamp
+                delay = now.timestamp() - e['time']
 
                 # DEBUG pursoses message
                 #print("[", name, "] --> ",  e.origins[0]['time'].datetime,
@@ -280,22 +693,22 @@ class WSEvents(WSGeneral):
                 # Don't add the event if a deadline time was reached
                 # SPRUCE [P.Beckman 2006]
                 if(delay > self.config['listener']['deadline']):
-                    print("WARNING: The event occurred at " +  str(e.origins[0]['time'].datetime) +
-                    " in (" + str(e.origins[0]['latitude']) + ", " + str(e.origins[0]['longitude'])
-                    + ") and magnitude " + str(e.magnitudes[0]['mag'])
+                    print("WARNING: The event occurred at " +  str(obspy.UTCDateTime(e['time']).datetime) +
+                    " in (" + str(e['latitude']) + ", " + str(e['longitude'])
+                    + ") and magnitude " + str(e['magnitude'])
                     + " overpassed the set deadline and will be not triggered", flush=True)
                     continue
 
                 # Obtain information about the event
                 event = {}
                 #event['time'] = e.origins[0]['time'].datetime.strftime("%d/%m/%Y, %H:%M:%S")
-                event['time'] = e.origins[0]['time'].timestamp
-                event['latitude'] = e.origins[0]['latitude']
-                event['longitude'] = e.origins[0]['longitude']
-                event['depth'] =  e.origins[0]['depth']
-                event['magnitude'] = e.magnitudes[0]['mag']
+                event['time'] = e['time']
+                event['latitude'] = e['latitude']
+                event['longitude'] = e['longitude']
+                event['depth'] =  e['depth']
+                event['magnitude'] = e['magnitude']
                 event['elapsedtime'] = int(delay)
-                event['description'] = e.event_descriptions[0].text if e.event_descriptions else ""
+                event['description'] = e['description']
                 events.append(event)
 
         #print(name, ":", self.a)
@@ -304,20 +717,32 @@ class WSEvents(WSGeneral):
         #    cat[0].origins[0]['latitude'], cat[0].origins[0]['longitude'],
         #    cat[0].origins[0]['depth'], cat[0].magnitudes[0]['mag'])
             #self.currenttime = cat[1]['creation_info']['creation_time']
-        return len(events), {'timestamp': cat[0].origins[0]['time'].timestamp,
+        return len(events), {'timestamp': latest,
                              'events' : events}
 
-    # Post-process actions
-    def _postprocess_actions(self):
+    # Post-process actions (for all the agencies or the given ones), adding
+    # the events to a given output
+    def _postprocess_actions(self, names=None, output=None):
         # Variables
         tth = self.config['listener']['timethreshold']
-        output = {'sources':{}, 'events':{}}
+        if output is None:
+            output = {'sources':{}, 'events':{}}
+
+        # Index of the events already received
+        if self.association is None:
+            listener = self.config['listener']
+            self.association = EventAssociation(tth,
+                listener.get('associationdistance', 250.0),
+                listener.get('associationmagnitude', 1.5),
+                listener.get('associationttl', max(2 * listener['deadline'], float(tth))))
+        self.association.evict()
         source = {}
-        events = {}
+        events = output['events']
+        created = False
         id = ""
 
         # Generate the set of events
-        for r in self.results.keys():
+        for r in (names or list(self.results.keys())):
             # Check if the current agency didn't registered events
             if( not self.results[r] ):
                 continue
@@ -325,27 +750,27 @@ class WSEvents(WSGeneral):
             # Define sources
             source = {}
             source['query'] = self.config['repositories'][r]+self.query
-            source['data'] = self.tmpdata+r+self.config['listener']['data_ext']
+            if self.config['listener'].get('debug', False):
+                source['data'] = self.tmpdata+r+self.config['listener']['data_ext']
+            else:
+                source['data'] = None
             source['timestamp'] = self.results[r]['timestamp']
             output['sources'][r] = source
 
             # Obtain the events found for each source
             for e in self.results[r]['events']:
                 # Check if the event was already registered
-                id = ""
-                for he in self.events:
-                    # TODO: Try to do something more 'smart'
-                    if( abs(e['time'] - he['time']) <= float(tth) ):
-                        id = he['event']
+                id = self.association.find(e)
 
                 # Create event
                 if( id == "" ):
                     id = str(uuid.uuid1())
                     #print("Creating ID:", id)
                     events[id] = []
+                    created = True
 
-                # Insert the event on the sorted list
-                self.events.append({'time': e['time'], 'event': id})
+                # Insert the event on the association index
+                self.association.add(e, id)
 
                 # Convert event timestamp in a readable format
                 #['time'] = datetime.datetime.utcfromtimestamp(e['time']).strftime('%d/%m/%Y, %H:%M:%S')
@@ -360,9 +785,9 @@ class WSEvents(WSGeneral):
                     events[id].append(e)
 
         # Just check if some event was registered by any agency
-        if( events.keys() ):
-            output['events'] = events
-        else:
+        if( created ):
+            print("INFO: Association index " + json.dumps(self.association.stats()), flush=True)
+        if( not events.keys() ):
             output = None
 
         # Return the set of events found
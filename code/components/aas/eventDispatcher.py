@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+
+# Dispatcher of the detected events to the workflow manager
+# This module is part of the Automatic Alert System (AAS) solution
+
+# Author:  Juan Esteban Rodríguez, Josep de la Puente
+# Contact: juan.rodriguez@bsc.es, josep.delapuente@bsc.es
+
+# ###############################################################################
+#       BSD 3-CLAUSE, aka BSD NEW, aka BSD REVISED, aka MODIFIED BSD LICENSE
+
+# Copyright 2023,2024 Josep de la Puente, Juan Esteban Rodriguez
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name(s) of the copyright holder(s) nor the name(s) of its
+# contributor(s) may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDER(S) AND CONTRIBUTOR(S) “AS
+# IS” AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER(S) OR CONTRIBUTOR(S) BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# ###############################################################################
+# Module imports
+import sys
+import time
+import queue
+import threading
+import traceback
+
+# Third parties
+import requests
+
+# ###############################################################################
+# Methods and classes
+
+class EventDispatcher:
+    """
+    Submit the detected events to the workflow manager through a persistent
+    HTTP session. Events wait in a bounded queue and a background thread
+    posts them in batches; when the workflow manager is saturated (HTTP 503
+    or 429) the batch is kept and posted again after 'Retry-After' seconds.
+    """
+
+    # Initialization method
+    def __init__(self, url, batch=16, size=256, timeout=30, retry=5):
+        self.url = url
+        self.batch = batch
+        self.timeout = timeout
+        self.retry = retry
+
+        # Statistics
+        self.sent = 0
+        self.dropped = 0
+        self.rejected = 0
+
+        self.session = requests.Session()
+        self.queue = queue.Queue(maxsize=size)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def dispatch(self, event):
+        """
+        Queue an event (False when the queue is full)
+        """
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except queue.Full:
+            self.rejected += 1
+            return False
+
+    def flush(self):
+        """
+        Wait until every queued event was accepted by the workflow manager
+        """
+        self.queue.join()
+
+    def _next(self, pending):
+        # Wait for an event and then take the queued ones (up to a batch)
+        if not pending:
+            pending.append(self.queue.get())
+        while len(pending) < self.batch:
+            try:
+                pending.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return pending
+
+    def _retryAfter(self, r):
+        try:
+            return float(r.headers.get('Retry-After', self.retry))
+        except ValueError:
+            return self.retry
+
+    def _submit(self, events):
+        """
+        Post a batch of events. Return how many of them were processed and
+        the seconds to wait before the next request.
+        """
+        r = self.session.post(self.url, json={'events': events}, timeout=self.timeout)
+
+        # Saturated workflow manager (back-pressure)
+        if r.status_code in (429, 503):
+            return 0, self._retryAfter(r)
+
+        # Malformed events will never be accepted
+        if 400 <= r.status_code < 500:
+            print("ERROR: The workflow manager rejected " + str(len(events)) +
+                  " events: " + r.text, flush=True)
+            self.dropped += len(events)
+            return len(events), 0
+
+        r.raise_for_status()
+        accepted = int(r.json().get('accepted', len(events)))
+        self.sent += accepted
+
+        # Only part of the batch fitted, wait before sending the rest
+        return accepted, (self._retryAfter(r) if accepted < len(events) else 0)
+
+    def _run(self):
+        pending = []
+        while True:
+            pending = self._next(pending)
+            try:
+                done, wait = self._submit(pending)
+            except Exception as error:
+                print("WARNING: The workflow manager is not available at '" +
+                      self.url + "'", flush=True)
+                traceback.print_exc(file=sys.stdout)
+                done, wait = 0, self.retry
+
+            for e in pending[:done]:
+                self.queue.task_done()
+            pending = pending[done:]
+
+            if wait:
+                time.sleep(wait)
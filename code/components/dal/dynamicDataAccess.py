@@ -36,7 +36,7 @@
 # ###############################################################################
 # Module imports
 
-from pymongo import MongoClient
+from pymongo import MongoClient, UpdateOne, ASCENDING, GEOSPHERE
 import os
 import json
 
@@ -44,7 +44,7 @@ from flask import jsonify
 
 import ucis4eq
 import ucis4eq.dal as dal
-from ucis4eq.dal import staticDataAccess
+from ucis4eq.dal import staticDataAccess, staticDataMap
 from ucis4eq.misc import config, microServiceABC
 
 # ###############################################################################
@@ -103,9 +103,56 @@ class DAL(microServiceABC.MicroServiceABC):
             # Create collection
             col = self._createCollection(db, lpath)
 
+        # Indexes used by the services
+        self._createIndexes(db)
+
+        # Binary version of the PGA database used by IndexPriority
+        self._preparePGA()
+
         # Return success
         return jsonify(result = {}, response = 201)
 
+    def _createIndexes(self, db):
+        """
+        Create the indexes used by the services. Regions get a GeoJSON
+        geometry (and its area) for geospatial queries. It can run on every
+        start (only new or outdated regions are updated and existing indexes
+        are kept).
+        """
+        from ucis4eq.scc import regionIndex
+
+        # Geometry and area of the new regions (or the ones built before
+        # splitting the boxes at the antimeridian)
+        updates = []
+        for region in db['Regions'].find({}, {field: 1 for field in
+                                              regionIndex.FIELDS[-4:] + ("geometry", "area")}):
+            limits = regionIndex.bounds(region)
+            if limits:
+                geometry = regionIndex.boxGeometry(*limits)
+                area = float(regionIndex.boxArea(*limits))
+                if region.get("geometry") != geometry or region.get("area") != area:
+                    updates.append(UpdateOne({"_id": region["_id"]},
+                        {"$set": {"geometry": geometry, "area": area}}))
+        if updates:
+            db['Regions'].bulk_write(updates)
+
+        db['Regions'].create_index([("geometry", GEOSPHERE)])
+        db['Regions'].create_index([("area", ASCENDING)])
+        db['ServiceRuns'].create_index([("requestId", ASCENDING), ("initTime", ASCENDING)])
+        db['ServiceRuns'].create_index([("inputs.trial", ASCENDING)])
+        db['Requests'].create_index([("state", ASCENDING)])
+
+    def _preparePGA(self):
+        """
+        Download the PGA database and convert it (only the first time) into
+        the memory-mapped store read by IndexPriority
+        """
+        from ucis4eq.scc import pgaIndex
+
+        fileMapping = staticDataMap.StaticDataMap("IndexPriority")
+        if "dataPGA" in fileMapping.keys():
+            pgaIndex.prepare(fileMapping["dataPGA"])
+
     def _createCollection( self, db, documentsPath, collectionName=None):
         """
         This method will create a collection of documents in the given MongoDB
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+
+# Cache of parsed static data files
+# This module is part of the Smart Center Control (SSC) solution
+
+# Author:  Juan Esteban Rodríguez, Josep de la Puente
+# Contact: juan.rodriguez@bsc.es, josep.delapuente@bsc.es
+
+# ###############################################################################
+#       BSD 3-CLAUSE, aka BSD NEW, aka BSD REVISED, aka MODIFIED BSD LICENSE
+
+# Copyright 2023,2024 Josep de la Puente, Juan Esteban Rodriguez
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name(s) of the copyright holder(s) nor the name(s) of its
+# contributor(s) may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDER(S) AND CONTRIBUTOR(S) “AS
+# IS” AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER(S) OR CONTRIBUTOR(S) BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# ###############################################################################
+# Module imports
+import os
+import json
+import copy
+import shutil
+import hashlib
+import threading
+
+# Third parties
+import numpy as np
+
+import ucis4eq
+
+# ###############################################################################
+# Methods and classes
+
+class StaticDataCache():
+    "Cache of static data files already parsed (columnar files and documents)"
+
+    # Increase it if the layout of the stored columns changes
+    version = 1
+
+    # Initialization method
+    def __init__(self, workSpace=None):
+        """
+        Initialize the cache
+        """
+        # Base path for the columnar files
+        if not workSpace:
+            workSpace = ucis4eq.workSpace + "DAL/cache/"
+        self.workSpace = workSpace
+
+        # In-memory entries indexed by the original file path
+        self._columns = {}
+        self._documents = {}
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def stamp(path):
+        """
+        Modification time and size of a file
+        """
+        st = os.stat(path)
+        return [st.st_mtime_ns, st.st_size]
+
+    @staticmethod
+    def _hash(path):
+        """
+        SHA-1 of the contents of a file
+        """
+        sha = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def _location(self, path):
+        """
+        Folder storing the columnar version of a given file
+        """
+        key = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+        return self.workSpace + key + "/"
+
+    def _readMetadata(self, location):
+        try:
+            with open(location + "meta.json", 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _build(self, path, location, stamp, builder):
+        """
+        Parse the original file and store each column as a .npy file
+        """
+        print("INFO: Building columnar cache for '" + path + "'", flush=True)
+        columns = builder(path)
+
+        # Write in a temporary folder and then replace the old one
+        tmp = location.rstrip("/") + ".tmp/"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+        for name, values in columns.items():
+            np.save(tmp + name + ".npy", np.ascontiguousarray(values))
+
+        meta = {"version": self.version,
+                "path": os.path.abspath(path),
+                "stamp": stamp,
+                "sha1": self._hash(path),
+                "columns": {name: len(values) for name, values in columns.items()}}
+        with open(tmp + "meta.json", 'w') as f:
+            json.dump(meta, f)
+
+        shutil.rmtree(location, ignore_errors=True)
+        os.replace(tmp.rstrip("/"), location.rstrip("/"))
+
+        return meta
+
+    def _validate(self, path, location, stamp, builder):
+        """
+        Obtain the metadata of a valid columnar file, (re)building it when the
+        original file changed
+        """
+        meta = self._readMetadata(location)
+
+        if meta and meta['version'] == self.version and \
+           meta['path'] == os.path.abspath(path):
+
+            # Same file
+            if meta['stamp'] == stamp:
+                return meta
+
+            # Touched (e.g. downloaded again) but with the same contents
+            if meta['stamp'][1] == stamp[1] and meta['sha1'] == self._hash(path):
+                meta['stamp'] = stamp
+                with open(location + "meta.json", 'w') as f:
+                    json.dump(meta, f)
+                return meta
+
+        return self._build(path, location, stamp, builder)
+
+    def columns(self, path, builder, fields=None):
+        """
+        Obtain the columns of a parsed file as read-only memory-mapped arrays.
+        'builder' receives the file path and returns a dict of arrays; it is
+        only called when there is no valid columnar version of the file. Only
+        the requested 'fields' are loaded (all of them by default).
+        """
+        stamp = self.stamp(path)
+
+        with self._lock:
+            entry = self._columns.get(path)
+            if not entry or entry['stamp'] != stamp:
+                location = self._location(path)
+                meta = self._validate(path, location, stamp, builder)
+                entry = {'stamp': stamp, 'location': location,
+                         'meta': meta, 'arrays': {}}
+                self._columns[path] = entry
+
+            if fields is None:
+                fields = list(entry['meta']['columns'])
+
+            # Load only the missing columns
+            for field in fields:
+                if field not in entry['arrays']:
+                    mmap = 'r' if entry['meta']['columns'][field] else None
+                    entry['arrays'][field] = np.load(entry['location'] + field + ".npy",
+                                                     mmap_mode=mmap)
+
+            return {field: entry['arrays'][field] for field in fields}
+
+    def document(self, path):
+        """
+        Obtain a (private) copy of a parsed JSON document
+        """
+        stamp = self.stamp(path)
+
+        with self._lock:
+            entry = self._documents.get(path)
+            if not entry or entry[0] != stamp:
+                with open(path, 'r') as f:
+                    entry = (stamp, json.load(f))
+                self._documents[path] = entry
+
+        return copy.deepcopy(entry[1])
+
+    def digest(self, path):
+        """
+        SHA-1 of the contents of a file (only recalculated when it changes)
+        """
+        stamp = self.stamp(path)
+
+        with self._lock:
+            entry = self._digests.get(path)
+            if not entry or entry[0] != stamp:
+                entry = (stamp, self._hash(path))
+                self._digests[path] = entry
+
+        return entry[1]
+
+    def invalidate(self, path):
+        """
+        Forget every entry under a path (file or folder), so the next access
+        validates the files on disk again
+        """
+        with self._lock:
+            for entries in (self._columns, self._documents, self._digests):
+                for key in [k for k in entries if k.startswith(path)]:
+                    del entries[key]
+
+# Cache shared by all the services of the process
+cache = StaticDataCache()
@@ -42,7 +42,7 @@ from abc import ABC, abstractmethod
 
 import ucis4eq
 import ucis4eq.dal as dal
-from ucis4eq.dal import staticDataAccess
+from ucis4eq.dal import staticDataAccess, staticDataCache
 from ucis4eq.misc import config, microServiceABC
 
 # ###############################################################################
@@ -112,6 +112,9 @@ class StaticDataMap():
 #        if not os.path.exists(lpath):            
         if not self.quiet:
             self.repos[repo].downloadFile(rpath, lpath)
+
+            # Parsed versions of the downloaded data must be validated again
+            staticDataCache.cache.invalidate(lpath)
             
             # Return the file path
             return lpath
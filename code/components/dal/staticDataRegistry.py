@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+# Registry of artifacts loaded from static data files
+# This module is part of the Data Access Layer (DAL) solution
+
+# Author:  Juan Esteban Rodríguez, Josep de la Puente
+# Contact: juan.rodriguez@bsc.es, josep.delapuente@bsc.es
+
+# ###############################################################################
+#       BSD 3-CLAUSE, aka BSD NEW, aka BSD REVISED, aka MODIFIED BSD LICENSE
+
+# Copyright 2023,2024 Josep de la Puente, Juan Esteban Rodriguez
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name(s) of the copyright holder(s) nor the name(s) of its
+# contributor(s) may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDER(S) AND CONTRIBUTOR(S) “AS
+# IS” AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER(S) OR CONTRIBUTOR(S) BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# ###############################################################################
+# Module imports
+import os
+import json
+import time
+import hashlib
+import threading
+
+# Internal
+from ucis4eq.dal import staticDataCache
+
+# ###############################################################################
+# Methods and classes
+
+class StaticDataRegistry():
+    """
+    Process-wide registry of the objects (models, tables, ...) loaded from
+    the files of a StaticDataMap. Each object is loaded once and shared by
+    all the requests. It is loaded again only when its file changes:
+    the local file is checked on every access, while the StaticDataMap
+    document and the remote file are checked every 'refresh' seconds.
+    """
+
+    # Initialization method
+    def __init__(self, refresh=300):
+        """
+        Initialize the registry
+        """
+        self.refresh = refresh
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _fingerprint(path):
+        """
+        Digest of a file or of all the files of a folder
+        """
+        if not os.path.isdir(path):
+            return staticDataCache.cache.digest(path)
+
+        sha = hashlib.sha1()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                fileName = os.path.join(root, name)
+                sha.update(os.path.relpath(fileName, path).encode('utf-8'))
+                sha.update(staticDataCache.cache.digest(fileName).encode('utf-8'))
+        return sha.hexdigest()
+
+    @staticmethod
+    def _stamp(path):
+        st = os.stat(path)
+        return [st.st_mtime_ns, st.st_size]
+
+    def get(self, fileMapping, name, loader):
+        """
+        Obtain the object built by 'loader(localPath)' for the file 'name' of
+        a StaticDataMap
+        """
+        key = (fileMapping.workSpace, name, loader)
+        document = json.dumps(fileMapping._values.get(name), sort_keys=True, default=str)
+
+        # One lock per entry, so slow loads do not block other objects
+        with self._lock:
+            entry = self._entries.setdefault(key, {'lock': threading.Lock()})
+
+        with entry['lock']:
+            now = time.monotonic()
+            expired = 'value' not in entry or entry['document'] != document or \
+                      now - entry['checked'] > self.refresh
+
+            if expired:
+                # Obtain the current version of the file
+                path = fileMapping[name]
+            else:
+                path = entry['path']
+                try:
+                    if self._stamp(path) == entry['stamp']:
+                        return entry['value']
+                except OSError:
+                    path = fileMapping[name]
+
+            fingerprint = self._fingerprint(path)
+            if 'value' not in entry or entry['fingerprint'] != fingerprint:
+                print("INFO: Loading static data '" + name + "' from '" + path + "'", flush=True)
+                entry['value'] = loader(path)
+                entry['fingerprint'] = fingerprint
+
+            entry.update({'path': path, 'stamp': self._stamp(path),
+                          'document': document, 'checked': now})
+
+            return entry['value']
+
+    def invalidate(self):
+        """
+        Forget all the loaded objects
+        """
+        with self._lock:
+            self._entries.clear()
+
+# Registry shared by all the services of the process
+registry = StaticDataRegistry()
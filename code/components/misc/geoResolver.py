@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+# Point-in-polygon resolver for GeoJSON files
+# This module is part of the Smart Center Control (SSC) solution
+
+# Author:  Juan Esteban Rodríguez, Josep de la Puente
+# Contact: juan.rodriguez@bsc.es, josep.delapuente@bsc.es
+
+# ###############################################################################
+#       BSD 3-CLAUSE, aka BSD NEW, aka BSD REVISED, aka MODIFIED BSD LICENSE
+
+# Copyright 2023,2024 Josep de la Puente, Juan Esteban Rodriguez
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name(s) of the copyright holder(s) nor the name(s) of its
+# contributor(s) may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDER(S) AND CONTRIBUTOR(S) “AS
+# IS” AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER(S) OR CONTRIBUTOR(S) BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# ###############################################################################
+# Module imports
+import json
+
+# Third parties
+import numpy as np
+import shapely
+from shapely.geometry import shape
+from shapely.strtree import STRtree
+
+# ###############################################################################
+# Methods and classes
+
+class GeoResolver():
+    """
+    Point-in-polygon resolver for the features of a GeoJSON file. The file is
+    parsed once, the geometries are indexed in an STRtree (bounding boxes)
+    and only the candidates of a point are tested (prepared geometries).
+
+    The result for a given property is the one of the former linear scan:
+    features are grouped by the property value (the last geometry of each
+    value is kept) and the values are tested in order of appearance.
+    """
+
+    # Initialization method
+    def __init__(self, fileName):
+        """
+        Load a GeoJSON file
+        """
+        with open(fileName, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+
+        self.properties = [feature["properties"] for feature in data["features"]]
+        self.geometries = np.array([shape(feature["geometry"])
+                                    for feature in data["features"]], dtype=object)
+        self.tree = STRtree(self.geometries)
+
+        # Geometries are prepared when they are tested for the first time
+        self._prepared = np.zeros(len(self.geometries), dtype=bool)
+
+        # Rank of each feature for a property (-1 if it is not used)
+        self._ranks = {}
+
+    def _rank(self, name):
+        """
+        Rank of each feature for a property (order of appearance of its value
+        or -1 if a later feature has the same value)
+        """
+        if name not in self._ranks:
+            values = {}
+            for i, properties in enumerate(self.properties):
+                value = properties[name]
+                values[value] = (values[value][0] if value in values else len(values), i)
+
+            rank = np.full(len(self.properties), -1)
+            for order, i in values.values():
+                rank[i] = order
+            self._ranks[name] = (rank, list(values))
+
+        return self._ranks[name]
+
+    def locateMany(self, longitudes, latitudes, name):
+        """
+        Value of the property 'name' of the feature containing each of the
+        points (None when there is no feature)
+        """
+        longitudes = np.atleast_1d(np.asarray(longitudes, dtype=np.float64))
+        latitudes = np.atleast_1d(np.asarray(latitudes, dtype=np.float64))
+        rank, values = self._rank(name)
+
+        # Candidates by bounding box
+        points, features = self.tree.query(shapely.points(longitudes, latitudes))
+        used = rank[features] >= 0
+        points, features = points[used], features[used]
+
+        # Test the candidates of each feature at once
+        best = np.full(len(longitudes), len(values))
+        for feature in np.unique(features):
+            selected = points[features == feature]
+            geometry = self.geometries[feature]
+            if not self._prepared[feature]:
+                shapely.prepare(geometry)
+                self._prepared[feature] = True
+            inside = selected[shapely.contains_xy(geometry, longitudes[selected],
+                                                  latitudes[selected])]
+            best[inside] = np.minimum(best[inside], rank[feature])
+
+        return [values[b] if b < len(values) else None for b in best]
+
+    def locate(self, longitude, latitude, name):
+        """
+        Value of the property 'name' of the feature containing a point
+        """
+        return self.locateMany([longitude], [latitude], name)[0]
@@ -37,9 +37,15 @@
 # OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 # ###############################################################################
 
+import os
 import sys
 import traceback
 import json
+import hashlib
+import threading
+import multiprocessing
+import concurrent.futures
+from collections import OrderedDict
 from bson import ObjectId
 
 # Third parties
@@ -50,19 +56,61 @@ from haversine import haversine
 from sklearn.cluster import DBSCAN
 from sklearn.neighbors import NearestNeighbors
 from kneed import KneeLocator
-from obspy.imaging.beachball import aux_plane
 
 # Internal
 import ucis4eq
 from ucis4eq.misc import config, microServiceABC
-from ucis4eq.dal import staticDataMap, dataStructure
+from ucis4eq.dal import staticDataMap, staticDataCache, dataStructure
+from ucis4eq.scc import CMTCatalog, CMTGrid
 
 
 # ###############################################################################
 # Methods and classes
 
+def aux_plane_batch(strike, dip, rake):
+    """
+    Vectorized version of obspy.imaging.beachball.aux_plane. Obtain the
+    strike, dip and rake (degrees) of the auxiliary planes of a set of
+    nodal planes given as arrays (or scalars) of the same shape.
+    """
+    r2d = 180 / np.pi
+    z = (np.asarray(strike, dtype=float) + 90) / r2d
+    z2 = np.asarray(dip, dtype=float) / r2d
+    z3 = np.asarray(rake, dtype=float) / r2d
+
+    # Slick vector in plane 1
+    sl1 = -np.cos(z3) * np.cos(z) - np.sin(z3) * np.sin(z) * np.cos(z2)
+    sl2 = np.cos(z3) * np.sin(z) - np.sin(z3) * np.cos(z) * np.cos(z2)
+    sl3 = np.sin(z3) * np.sin(z2)
+
+    # Strike and dip of the plane normal to the slick vector
+    sign = np.where(sl3 < 0, -1., 1.)
+    n, e, u = sl2 * sign, sl1 * sign, sl3 * sign
+    strike2 = np.arctan2(e, n) * r2d - 90
+    strike2 = np.where(strike2 < 0, strike2 + 360, strike2)
+    dip2 = np.arctan2(np.sqrt(np.power(n, 2) + np.power(e, 2)), u) * r2d
+
+    # Normal vector to plane 1 and strike vector of plane 2 (h3 = 0)
+    n1 = np.sin(z) * np.sin(z2)
+    n2 = np.cos(z) * np.sin(z2)
+    h1 = -sl2
+    h2 = sl1
+    z = h1 * n1 + h2 * n2
+    z = z / np.sqrt(h1 * h1 + h2 * h2)
+
+    # Values above 1.0 only come from the floating point precision
+    float64epsilon = 2.2204460492503131e-16
+    z = np.where((np.abs(z) > 1.0) & (np.abs(z) < 1.0 + 100 * float64epsilon),
+                 np.copysign(1.0, z), z)
+    z = np.arccos(z)
+    rake2 = np.where(sl3 > 0, z * r2d, np.where(sl3 <= 0, -z * r2d, 0.))
+
+    return (strike2[()], dip2[()], rake2[()])
+
 
 class Event():
+    # Attributes (no per-instance dictionary)
+    __slots__ = ("lat", "lon", "depth", "mag", "strike", "dip", "rake", "time")
 
     # Initialization method
     def __init__(self, lat, lon, depth, mag, strike=0., dip=0., rake=0., datetime=None):
@@ -77,9 +125,18 @@ class Event():
         self.dip = dip
         self.rake = rake
         if datetime is not None:
-            self.datetime = obspy.UTCDateTime(datetime)
+            self.time = obspy.UTCDateTime(datetime).timestamp
         else:
-            self.datetime = None
+            self.time = None
+
+    @property
+    def datetime(self):
+        """
+        Origin time of the event (obtained from the stored timestamp)
+        """
+        if self.time is None:
+            return None
+        return obspy.UTCDateTime(self.time)
 
     def __repr__(self):
         return "Event()"
@@ -135,8 +192,7 @@ class CMTSeisEnsMan(microServiceABC.MicroServiceABC):
                              ".json"
 
         # Read the input from file
-        with open(parametersFileName, 'r') as f:
-            inputSeisEnsMan = json.load(f)
+        inputSeisEnsMan = staticDataCache.cache.document(parametersFileName)
 
         print('inputseisEnsMan', inputSeisEnsMan)
         # Retrieve the event's complete information
@@ -192,8 +248,7 @@ class CMTInputs(microServiceABC.MicroServiceABC):
                              ".json"
 
         # Read the input from file
-        with open(parametersFileName, 'r') as f:
-            inputParameters = json.load(f)
+        inputParameters = staticDataCache.cache.document(parametersFileName)
 
         # TODO: This part should be done by the workflow manager
 
@@ -232,6 +287,70 @@ class CMTCalculation(microServiceABC.MicroServiceABC):
         """
         Calculate a CMT approximation from historical earthquake events
         """
+        # Configure the component
+        self._prepare(body)
+
+        # Set an input event with an unknown CMT
+        self._setEvent(body['event'])
+
+        # Obtain Focal Mechanisms (precomputed ones if available)
+        cmts = self._getGridMechanism()
+        if cmts is None:
+            cmts = self._getFocalMechanism()
+
+        # Append input CMT's to the list of calculated ones
+        # MPC commenting this because we don't necessarily want to simulate that every time.
+        # if "cmt" in body['event'].keys():
+        #     cmts.update(body['event']["cmt"])
+
+        return jsonify(result = cmts, response = 201)
+
+    # Service's entry point definition (several alerts at once)
+    @microServiceABC.MicroServiceABC.runRegistration
+    def entryPointBatch(self, body):
+        """
+        Calculate a CMT approximation for each of the alerts in body['events']
+        sharing the same catalog and spatial index. The clusterings not
+        found in the memo run in a shared pool of processes (in-process for
+        a few of them).
+        """
+        # Configure the component
+        self._prepare(body)
+
+        # Precomputed mechanisms or neighbours of each alert
+        results = []
+        partials = []
+        for e in body['events']:
+            self._setEvent(e)
+            cmts = self._getGridMechanism()
+            if cmts is None:
+                partials.append((len(results), self._getNeighbourMechanisms()))
+            results.append(cmts)
+
+        # Clustering already known (memo) or calculated in parallel
+        keys = [clusteringMemo.key(clusteringInputs[0]) for i, (cmts, clusteringInputs) in partials]
+        clusterings = [clusteringMemo.get(key) for key in keys]
+        missing = {key: clusteringInputs[0]
+                   for key, clustering, (i, (cmts, clusteringInputs)) in zip(keys, clusterings, partials)
+                   if clustering is None}
+        if missing:
+            missing = selectClusterings(missing)
+            for key, clustering in missing.items():
+                clusteringMemo.put(key, clustering)
+
+        # Median solution of the clusters of each alert
+        for key, clustering, (i, (cmts, clusteringInputs)) in zip(keys, clusterings, partials):
+            if clustering is None:
+                clustering = missing[key]
+            cmts.update(clusterFocalMechanisms(*clusteringInputs, clustering=clustering))
+            results[i] = cmts
+
+        return jsonify(result = results, response = 201)
+
+    def _prepare(self, body):
+        """
+        Load the setup and locate the catalog of the region
+        """
         # Create the data structure
         dataFormat = dataStructure.formats[body['region']['file_structure']]()
         dataFormat.prepare(body['region']['id'])
@@ -239,11 +358,15 @@ class CMTCalculation(microServiceABC.MicroServiceABC):
         # Configure the component
         self.setup = body['setup']
 
-        # Read the input catalog from file
-        catalogFileName = body['region']['path'] + "/" + \
-                          dataFormat.getPathTo('source_ensemble') + "/" + \
-                          self.setup['catalog']
-        self.cat = obspy.read_events(catalogFileName)
+        # Input catalog (its index is loaded when needed)
+        self.catalogFileName = body['region']['path'] + "/" + \
+                               dataFormat.getPathTo('source_ensemble') + "/" + \
+                               self.setup['catalog']
+        self.index = None
+
+        # Precomputed CMT grid is only used when it is requested
+        self.regionId = body['region']['id']
+        self.useGrid = body.get('grid', False)
 
 
         # Check input parameters
@@ -256,8 +379,10 @@ class CMTCalculation(microServiceABC.MicroServiceABC):
         if self.setup['distance']['threshold'] <= 0:
             raise Exception('Threshold must be > 0')
 
-        # Set an input event with an unknown CMT
-        e = body['event']
+    def _setEvent(self, e):
+        """
+        Set an input event with an unknown CMT
+        """
         print(e)
         self.event = Event(e['latitude'],
                            e['longitude'],
@@ -266,111 +391,118 @@ class CMTCalculation(microServiceABC.MicroServiceABC):
                            datetime=e['time']
                           )
 
-        # Obtain Focal Mechanisms
-        cmts = self._getFocalMechanism()
+    def _getGridMechanism(self):
+        """
+        Focal mechanisms of the current event obtained from the precomputed
+        CMT grid of the region (None if not requested or available). They
+        are the ones of the nearest node, which excluded no event of the
+        catalog, so events found in the catalog are calculated exactly.
+        """
+        if not self.useGrid:
+            return None
 
-        # Append input CMT's to the list of calculated ones
-        # MPC commenting this because we don't necessarily want to simulate that every time.
-        # if "cmt" in body['event'].keys():
-        #     cmts.update(body['event']["cmt"])
+        grid = CMTGrid.loadGrid(self.regionId, self.catalogFileName, self.setup)
+        if grid is None:
+            return None
 
-        return jsonify(result = cmts, response = 201)
+        cmts = grid.lookup(self.event.lat, self.event.lon, self.event.depth)
+        if cmts is None:
+            return None
+
+        if np.any(self._getTargetEvents()):
+            print("INFO: (CMT calculation) The event is in the catalog, the CMT grid is not used",
+                  flush=True)
+            return None
+
+        print("INFO: (CMT calculation) Focal mechanisms obtained from the CMT grid", flush=True)
+        return cmts
+
+    def _getTargetEvents(self):
+        """
+        Events of the catalog that are the current one (within 20 seconds),
+        which must be excluded from its neighbours
+        """
+        if self.index is None:
+            self.index = CMTCatalog.loadIndex(self.catalogFileName,
+                                              self.setup['magnitudethreshold'])
+        catalog = self.index.catalog
+
+        if self.event.time is None:
+            return np.zeros(len(catalog), dtype=bool)
+
+        eventTime = self.event.time
+        return (catalog.time > eventTime - 20) & (catalog.time < eventTime + 20)
 
     def _getFocalMechanism(self):
         """
         This method obtains the Focal Mechanism from an historical provided
         earthquakes events
         """
+        cmts, clusteringInputs = self._getNeighbourMechanisms()
+        clustering = clusteringMemo.cluster(clusteringInputs[0])
+        cmts.update(clusterFocalMechanisms(*clusteringInputs, clustering=clustering))
+
+        return cmts
+
+    def _getNeighbourMechanisms(self):
+        """
+        This method obtains the median and k-nearest Focal Mechanisms of the
+        current event, together with the inputs needed for clustering them
+        """
 
         # Retrieve the historical information from a past events catalog
         # MPC note that origins have a [0] and [1] indices; [0] (reforigin) is the initial estimate
         # while [1] (CMTorigin) are the updated values; the date and time varies by just a few seconds
         # but the location may have had significant updates; hence, from the catalog we use the updated CMTorigin
 
-        hEvents = []
         # For each event in the catalog, extract the FM, Mg and position
         # (only for events for which we are above the threshold i.e. mag >= magnitudethreshold)
-        for e in self.cat:
-            if e.magnitudes[0]['mag'] >= self.setup['magnitudethreshold']:
-                fm = e.focal_mechanisms[0]['nodal_planes'].nodal_plane_1
-
-                # MPC identify if the given event is a historical event that already exists in the catalog
-                # if it exists, we have to exclude it to make the test realistic; cannot do the exclusion by magnitude,
-                # as the magnitudes can vary between the agencies.
-                # ToDo verify if we don't exclude anything if it is a new event, but I think it is OK
-                if ((self.event.datetime - 20) < e.origins[1]['time'] < (self.event.datetime + 20)): #and \
-                    #(e.magnitudes[0]['mag'] == self.event.mag):
-                    print("\nINFO: (CMT calculation) Skipping target event in the catalog: \n", flush=True)
-                    print(e, flush=True)
-                    print("\n", flush=True)
-                    continue
-
-                hEvents.append(Event(e.origins[1]['latitude'],
-                                     e.origins[1]['longitude'],
-                                     e.origins[1]['depth'],
-                                     e.magnitudes[0]['mag'],
-                                     strike=fm.strike,
-                                     dip=fm.dip,
-                                     rake=fm.rake
-                                    )
-                             )
+        # MPC identify if the given event is a historical event that already exists in the catalog
+        # if it exists, we have to exclude it to make the test realistic; cannot do the exclusion by magnitude,
+        # as the magnitudes can vary between the agencies.
+        # ToDo verify if we don't exclude anything if it is a new event, but I think it is OK
+        target = self._getTargetEvents()
+        catalog = self.index.catalog
+        for i in np.flatnonzero(target):
+            e = catalog[i]
+            print("\nINFO: (CMT calculation) Skipping target event in the catalog: \n", flush=True)
+            print("Lat: " + str(e.latitude) + " Lon: " + str(e.longitude) +
+                  " Mag: " + str(e.magnitude) + " Time: " + str(obspy.UTCDateTime(e.time)),
+                  flush=True)
+            print("\n", flush=True)
 
         # Print the total number of events in the catalog and known focal
         # mechanisms
-        print("\nINFO: (CMT calculation) Total number of events: " + str(len(hEvents)))
-
-        # Initialization
-        vectorDistances = np.zeros((len(hEvents), 11))
-        #vecMagMediana[contEventosThresholdDist,kk] = vecMagMed[kk]
-        #latiMediana[contEventosThresholdDist,kk] = latiMed[kk]
-        #longMediana[contEventosThresholdDist,kk] = longMed[kk]
-        #deptMediana[contEventosThresholdDist,kk] = deptMed[kk]
-        #vecFocalMecanismMed[contEventosThresholdDist,kk,:] = mt2[kk,:]
-
-        # Calculate Euclidean distances
-        i = 0
-        #print('self.event.depth',self.event.depth,flush=True)
-        for e in hEvents:
-            #print('i=',i,flush=True)
-            sphereDist = haversine((e.lat, e.lon), (self.event.lat, self.event.lon)) * 1000
-            #print('e.depth',e.depth,flush=True)  ## TODOOOOOOO Check UNITS
-            depthDist = (e.depth - self.event.depth)
-            euclideanDist = np.sqrt(sphereDist**2 + depthDist**2)
-            # Store the calculated information
-            vectorDistances[i, :] = [i, euclideanDist, sphereDist, depthDist, e.strike, e.dip, e.rake,  e.mag, e.depth, e.lat, e.lon]
-            i=i+1
-
-        # Sort by the distance by 'euclideanDist' field
-        distSorted = vectorDistances[vectorDistances[:,1].argsort()]
+        print("\nINFO: (CMT calculation) Total number of events: " +
+              str(len(catalog) - np.count_nonzero(target)))
 
         # Increase distance threshold till the minimum k-neighbors be reached
         kmin = self.setup['k']['min']
         growthrate = self.setup['distance']['growthrate']
         threshold = self.setup['distance']['threshold']*1000
 
-        while True:
-
-            # Sort and filter with the new threshold value
-            #print('distSorted[:,1] <= threshold',distSorted[:,1],' <= ' ,threshold)
-            distFiltered = distSorted[np.where(distSorted[:,1] <= threshold)]
-            #print("distFiltered", distFiltered)
-            # distFiltered = distFiltered[0:self.setup['k']['max'], :]
-
-            k = len(distFiltered)
-            vecMagNeig = distFiltered[0:k,7]
-            vecDepNeig = distFiltered[0:k,8]
-            vecLatNeig = distFiltered[0:k,9]
-            vecLonNeig = distFiltered[0:k,10]
-            vecStrikeNeig = distFiltered[0:k,4]
-            vecDipNeig = distFiltered[0:k,5]
-            vecRakeNeig = distFiltered[0:k,6]
-
-            # Check if the number of neighbors found was enough
-            if (kmin <= k) or (k == len(distSorted)):
-                break
-
-            # Increase the search threshold
-            threshold = threshold * growthrate
+        # Query the spatial index (neighbours sorted by euclidean distance)
+        neighbours, euclideanDist, sphereDist, depthDist, threshold = \
+            self.index.neighbours(self.event.lat, self.event.lon, self.event.depth,
+                                  kmin, threshold, growthrate, exclude=target)
+        k = len(neighbours)
+
+        # Final threshold (events beyond it would not change the neighbours)
+        self.threshold = threshold
+
+        # Store the calculated information
+        records = catalog[neighbours]
+        distFiltered = np.column_stack((neighbours, euclideanDist, sphereDist, depthDist,
+                                        records.strike, records.dip, records.rake,
+                                        records.magnitude, records.depth,
+                                        records.latitude, records.longitude))
+        vecMagNeig = distFiltered[:,7]
+        vecDepNeig = distFiltered[:,8]
+        vecLatNeig = distFiltered[:,9]
+        vecLonNeig = distFiltered[:,10]
+        vecStrikeNeig = distFiltered[:,4]
+        vecDipNeig = distFiltered[:,5]
+        vecRakeNeig = distFiltered[:,6]
 
         #print("Neighbors found:", str(k), "Final threshold:", str(threshold), "meters")
 
@@ -383,16 +515,15 @@ class CMTCalculation(microServiceABC.MicroServiceABC):
         self.event.dip = np.percentile(distFiltered[0:k, 5], 50, interpolation = 'midpoint')
         self.event.rake = np.percentile(distFiltered[0:k, 6], 50, interpolation = 'midpoint')
 
-        AuxNodalPlanes = []
-        contNodalPlanes = -1
         # Build the list of CMTs for the current events
         cmts = {"Median": self.event.toJSON()}
-        aux_plane_median = aux_plane(self.event.strike, self.event.dip, self.event.rake)
-        AuxNodalPlanes.append(Event(0.0,0.0,0.0,0.0,aux_plane_median[0],aux_plane_median[1],aux_plane_median[2]))
-        contNodalPlanes += 1
-        e = AuxNodalPlanes[contNodalPlanes]
+        aux_plane_median = aux_plane_batch(self.event.strike, self.event.dip, self.event.rake)
+        e = Event(0.0,0.0,0.0,0.0,aux_plane_median[0],aux_plane_median[1],aux_plane_median[2])
         cmts.update({"Median_AuxPlane" : e.toJSON()})
 
+        # Auxiliary planes of all the neighbours
+        auxPlanes = np.column_stack(aux_plane_batch(vecStrikeNeig, vecDipNeig, vecRakeNeig))
+
         if kmin < self.setup['output']['focalmechanisms']:
             nb_nearest_neighbours = kmin
             print("\nWARNING: (CMT calculation) The requested number of focal mechanisms for the nearest neighbour algorithm (%i)"
@@ -406,36 +537,27 @@ class CMTCalculation(microServiceABC.MicroServiceABC):
         for i in range(0, nb_nearest_neighbours):
             #hEvents[distFiltered[0:self.setup['output']['focalmechanisms'], 0]]:
             name = "k-" + str(i+1) +  ""
-            e = hEvents[int(distFiltered[i, 0])]
+            e = Event(distFiltered[i, 9], distFiltered[i, 10], distFiltered[i, 8],
+                      distFiltered[i, 7], strike=distFiltered[i, 4],
+                      dip=distFiltered[i, 5], rake=distFiltered[i, 6])
             #print("[" + name + "]"+ " --> " + str(e))
             cmts.update({name: e.toJSON()})
-            aux_plane_k = aux_plane(distFiltered[i, 4],distFiltered[i, 5],distFiltered[i, 6])
-            AuxNodalPlanes.append(Event(distFiltered[i,9],distFiltered[i,10],distFiltered[i,8],distFiltered[i,7],aux_plane_k[0],aux_plane_k[1],aux_plane_k[2]))
-            contNodalPlanes += 1
-            e = AuxNodalPlanes[contNodalPlanes]
+            e = Event(distFiltered[i,9],distFiltered[i,10],distFiltered[i,8],distFiltered[i,7],auxPlanes[i,0],auxPlanes[i,1],auxPlanes[i,2])
             cmts.update({"k-" + str(i + 1) + "_AuxPlane": e.toJSON()})
 
         # Clustering results
         # MPC adding here the missing part of Marisol's method
         # an update that first orders the nodal planes before clustering
-
-        cont = -1
-        X_results_FM = np.zeros((k, 3))
-        for ll in range(0, k):
-            if vecMagNeig[ll] != 0:
-                cont += 1
-                auxplane_vector = aux_plane(vecStrikeNeig[ll], vecDipNeig[ll], vecRakeNeig[ll])
-                if auxplane_vector[0] < vecStrikeNeig[ll]:
-                    X_results_FM[cont, :] = auxplane_vector
-                else:
-                    X_results_FM[cont, :] = np.array([vecStrikeNeig[ll], vecDipNeig[ll], vecRakeNeig[ll]])
+        # (keep the nodal plane with the lowest strike of each neighbour)
+        known = vecMagNeig != 0
+        X_results_FM = np.where((auxPlanes[:, 0] < vecStrikeNeig)[:, None],
+                                auxPlanes, distFiltered[:, 4:7])[known]
 
         X_results = np.zeros((k, 4))
 
         dataCoordinatesCentroidEvent = (self.event.lat, self.event.lon)
         profEvent = self.event.depth
         #print('profEvent',profEvent,flush=True)
-        hEventsCluster = []
 
         cont = -1
         for kk in range(0, k):
@@ -456,132 +578,216 @@ class CMTCalculation(microServiceABC.MicroServiceABC):
                 # print('distancesEvents[cont]',distancesEvents[cont],flush=True)
                 # X_results[cont, 3] = distancesEvents[cont]
                 # print('X_results[cont,:]',  X_results[cont,:], flush=True)
-        ## DBSCAN hyperparameters
-        nearest_neighbors = NearestNeighbors(n_neighbors=2)
-        neighbors = nearest_neighbors.fit(X_results[0:cont + 1, :])
-        distances, indices = neighbors.kneighbors(X_results[0:cont + 1, :])
-        distances = np.sort(distances[:, 1], axis=0)
-        i = np.arange(len(distances))
-        knee = KneeLocator(i, distances, S=1, curve='convex',
-                           direction='increasing',
-                           interp_method='polynomial'
-                           )
-        try:
-            clustering = DBSCAN(eps=distances[knee.knee],
-                                min_samples=2).fit(X_results[0:cont + 1, :])
-            X_resultsCluster = np.zeros((cont + 1, 9))
-            X_resultsCluster[:, 0:4] = X_results[0:cont + 1, :]
-            X_resultsCluster[:, 4] = clustering.labels_
-            vecNumElementsCluster = np.zeros(cont + 1)
-            contCluster = 0
-            contNumberCluster = -1
-            for iCluster in np.arange(min(X_resultsCluster[:, 4]),
-                                      max(X_resultsCluster[:, 4]) + 1):
-                contNumberCluster += 1
-                for kk in range(0, cont + 1):
-                    if X_resultsCluster[kk, 4] == iCluster:
-                        contCluster += 1
-                vecNumElementsCluster[contNumberCluster] = contCluster
-                contCluster = 0
-
-            percentageEachCluster = np.zeros(contNumberCluster + 1)
-            sumTotEvents = sum(vecNumElementsCluster[0:contNumberCluster + 1])
-
-            for ij in np.arange(contNumberCluster + 1):
-                percentageEachCluster[ij] = vecNumElementsCluster[ij] / sumTotEvents
-
-            contNumberCluster = -1
-            for iCluster in np.arange(min(X_resultsCluster[:, 4]),
-                                      max(X_resultsCluster[:, 4]) + 1):
-                contNumberCluster += 1
-                for kk in range(0,cont + 1):
-                    if X_resultsCluster[kk, 4] == iCluster:
-                        X_resultsCluster[kk, 5] = percentageEachCluster[contNumberCluster]
-                        X_resultsCluster[kk, 6] = vecLatNeig[kk]
-                        X_resultsCluster[kk, 7] = vecLonNeig[kk]
-                        X_resultsCluster[kk, 8] = vecDepNeig[kk]
-
-            # For each cluster obtained the median and the mean of the FM considering each angle as independent variable. Compare with the k-closest neighbors
-
-            X_resultsSortCluster = X_resultsCluster[X_resultsCluster[0:cont+1,4].argsort()]
-
-            VecTempClusterMean = np.zeros((contNumberCluster+1,3))
-            VecTempClusterStd = np.zeros((contNumberCluster+1,3))
-            VecTempClusterMedian = np.zeros((contNumberCluster+1,3))
-            VecCentroides = np.zeros((contNumberCluster+1,3))
-            VecCentroidesStd =  np.zeros((contNumberCluster+1,3))
-            contTmp = -1
-            contClustMean = -1
-
-            for jj in np.arange(contNumberCluster+1):
-                #print('jj',jj)
-                contTmpIni = int(contTmp + 1)
-                contTmpFin = int(contTmpIni + vecNumElementsCluster[jj]-1)
-                #print('contTmpIni',contTmpIni,flush=True)
-                #print('contTmpFin',contTmpFin,flush=True)
-                #for ij in np.arange(contTmpIni,contTmpFin+1):
-                #  print('X_resultsSortCluster[int(ij),:]',X_resultsSortCluster[int(ij),:],flush=True)
-                VecTempClusterMean[jj,0] = np.mean(X_resultsSortCluster[contTmpIni:contTmpFin+1,0])  #mean Strike,Dip,Rake Cluster
-                VecTempClusterStd[jj,0] = np.std(X_resultsSortCluster[contTmpIni:contTmpFin+1,0])  #mean Strike,Dip,Rake Cluster
-                VecTempClusterMedian[jj,0] = np.percentile(X_resultsSortCluster[contTmpIni:contTmpFin+1,0], 50, interpolation = 'midpoint')
-                VecTempClusterMean[jj,1] = np.mean(X_resultsSortCluster[contTmpIni:contTmpFin+1,1])  #mean Strike,Dip,Rake Cluster
-                VecTempClusterStd[jj,1] = np.std(X_resultsSortCluster[contTmpIni:contTmpFin+1,1])  #mean Strike,Dip,Rake Cluster
-                VecTempClusterMedian[jj,1] = np.percentile(X_resultsSortCluster[contTmpIni:contTmpFin+1,1], 50, interpolation = 'midpoint')
-                VecTempClusterMean[jj,2] = np.mean(X_resultsSortCluster[contTmpIni:contTmpFin+1,2])  #mean Strike,Dip,Rake Cluster
-                VecTempClusterStd[jj,2] = np.std(X_resultsSortCluster[contTmpIni:contTmpFin+1,2])  #mean Strike,Dip,Rake Cluster
-                VecTempClusterMedian[jj,2] = np.percentile(X_resultsSortCluster[contTmpIni:contTmpFin+1,2], 50, interpolation = 'midpoint')
-                VecCentroides[jj,0] = np.mean(X_resultsSortCluster[contTmpIni:contTmpFin+1,6]) #Latitude
-                VecCentroides[jj,1] = np.mean(X_resultsSortCluster[contTmpIni:contTmpFin+1,7]) #Longitude
-                VecCentroides[jj,2] = np.mean(X_resultsSortCluster[contTmpIni:contTmpFin+1,8]) #Depth
-                VecCentroidesStd[jj,0] = np.std(X_resultsSortCluster[contTmpIni:contTmpFin+1,6]) #Latitude
-                VecCentroidesStd[jj,1] = np.std(X_resultsSortCluster[contTmpIni:contTmpFin+1,7]) #Longitude
-                VecCentroidesStd[jj,2] = np.std(X_resultsSortCluster[contTmpIni:contTmpFin+1,8]) #Depth
-                contTmp = contTmpFin
-                ## Mean Clustering Solutions
-                #contClustMean = contClustMean + 1
-                #hEventsCluster.append(Event(VecCentroides[jj,0],
-                 #                    VecCentroides[jj,1],
-                 #                   VecCentroides[jj,2],
-                 #                   0.0,
-                 #                    VecTempClusterMean[jj,0],
-                 #                    VecTempClusterMean[jj,1],
-                 #                    VecTempClusterMean[jj,2]
-                 #                    )
-                 #                )
-                #name = "ClustMean-" + str(jj+1) +  ""
-                #e = hEventsCluster[int(contClustMean)]
-                #print("[" + name + "]"+ " --> " + str(e))
-                #cmts.update({name: e.toJSON()})
-                #######
-
-                ## Median Clustering Solution
-                contClustMean = contClustMean + 1
-                hEventsCluster.append(Event(VecCentroides[jj,0],
-                                     VecCentroides[jj,1],
-                                     VecCentroides[jj,2],
-                                     0.0,
-                                     VecTempClusterMedian[jj,0],
-                                     VecTempClusterMedian[jj,1],
-                                     VecTempClusterMedian[jj,2]
-                                     )
-                                 )
-                name = "ClustMedian-" + str(jj+1) +  ""
-                e = hEventsCluster[int(contClustMean)]
-                #print("[" + name + "]"+ " --> " + str(e))
-                cmts.update({name: e.toJSON()})
-
-                ## AuxPlanes_Median Clustering Solution
-                aux_plane_Clust = aux_plane(VecTempClusterMedian[jj,0],VecTempClusterMedian[jj,1],VecTempClusterMedian[jj,2])
-                AuxNodalPlanes.append(Event(VecCentroides[jj,0],VecCentroides[jj,1],VecCentroides[jj,2],0.0,aux_plane_Clust[0],aux_plane_Clust[1],aux_plane_Clust[2]))
-                contNodalPlanes += 1
-                e = AuxNodalPlanes[contNodalPlanes]
-                cmts.update({"ClustMedian-" + str(jj+1) + "_AuxPlane" : e.toJSON()})
-
-        except ValueError:
-            print("\nWARNING: (CMT calculation) There is a ValueError in the DBSCAN clustering algorithm, see log for details. "
-                  "Most likely the number of events in the neighbourhood was too small. \n",
-                  flush=True
-                  )
-        # Return the JSON file!!!!
+        # Clustering inputs (only events with known magnitude)
+        return cmts, (X_results[0:cont + 1, :], vecLatNeig[0:cont + 1],
+                      vecLonNeig[0:cont + 1], vecDepNeig[0:cont + 1])
+
+
+class ClusteringMemo():
+    """
+    LRU memo of the DBSCAN clustering (eps and labels) of neighbour
+    matrices. Matrices equal after rounding (repeated or near-duplicate
+    alerts of an event) share the same entry.
+    """
+
+    # Initialization method
+    def __init__(self, size=256, decimals=1):
+        """
+        Initialize the memo
+        """
+        self.size = size
+        self.decimals = decimals
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, X_results):
+        """
+        Hash of the rounded neighbour matrix
+        """
+        X = np.ascontiguousarray(np.round(X_results, self.decimals) + 0.0)
+        return hashlib.sha1(str(X.shape).encode() + X.tobytes()).hexdigest()
+
+    def get(self, key):
+        """
+        Return the (eps, labels) stored for a key or None
+        """
+        with self._lock:
+            clustering = self._entries.get(key)
+            if clustering is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+
+        return clustering
+
+    def put(self, key, clustering):
+        """
+        Store the (eps, labels) of a key evicting the least recently used
+        """
+        with self._lock:
+            self._entries[key] = clustering
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def cluster(self, X_results):
+        """
+        Return the memoized clustering of X_results (computed if missing)
+        """
+        key = self.key(X_results)
+        clustering = self.get(key)
+        if clustering is None:
+            clustering = selectClustering(X_results)
+            self.put(key, clustering)
+
+        return clustering
+
+    def stats(self):
+        """
+        Memo usage counters
+        """
+        with self._lock:
+            return {"entries": len(self._entries), "size": self.size,
+                    "hits": self.hits, "misses": self.misses}
+
+# Memo of the clustering of this process
+clusteringMemo = ClusteringMemo()
+
+# Batches with fewer clusterings to calculate are solved in-process
+parallelClusterings = 4
+
+# Pool of processes shared by all the requests. Its workers are spawned, so
+# the threads of the service (Flask, pymongo) are never forked.
+_clusteringPool = None
+_clusteringPoolLock = threading.Lock()
+
+def clusteringPool():
+    """
+    Obtain the pool of processes used for the clusterings
+    """
+    global _clusteringPool
+    with _clusteringPoolLock:
+        if _clusteringPool is None:
+            _clusteringPool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=os.cpu_count() or 1,
+                mp_context=multiprocessing.get_context("spawn"))
+        return _clusteringPool
+
+def selectClusterings(inputs):
+    """
+    Clustering of each of the given inputs (dict), in parallel only when
+    there are enough of them
+    """
+    if len(inputs) < parallelClusterings:
+        return {key: selectClustering(X_results) for key, X_results in inputs.items()}
+
+    global _clusteringPool
+    try:
+        pool = clusteringPool()
+        futures = {key: pool.submit(selectClustering, X_results)
+                   for key, X_results in inputs.items()}
+        return {key: future.result() for key, future in futures.items()}
+    except concurrent.futures.process.BrokenProcessPool:
+        # A worker died, start a new pool for the next requests
+        print("WARNING: (CMT calculation) The clustering pool broke, clustering in-process",
+              flush=True)
+        with _clusteringPoolLock:
+            _clusteringPool = None
+        return {key: selectClustering(X_results) for key, X_results in inputs.items()}
+
+
+def selectClustering(X_results):
+    """
+    Choose the DBSCAN eps from the knee of the k-distance curve and cluster
+    X_results. Return (eps, labels) or (None, None) when DBSCAN fails.
+    """
+
+    ## DBSCAN hyperparameters
+    nearest_neighbors = NearestNeighbors(n_neighbors=2)
+    neighbors = nearest_neighbors.fit(X_results)
+    distances, indices = neighbors.kneighbors(X_results)
+    distances = np.sort(distances[:, 1], axis=0)
+    i = np.arange(len(distances))
+    knee = KneeLocator(i, distances, S=1, curve='convex',
+                       direction='increasing',
+                       interp_method='polynomial'
+                       )
+    try:
+        eps = distances[knee.knee]
+        clustering = DBSCAN(eps=eps, min_samples=2).fit(X_results)
+    except ValueError:
+        print("\nWARNING: (CMT calculation) There is a ValueError in the DBSCAN clustering algorithm, see log for details. "
+              "Most likely the number of events in the neighbourhood was too small. \n",
+              flush=True
+              )
+        return None, None
+
+    return float(eps), clustering.labels_
+
+
+def clusterFocalMechanisms(X_results, vecLatNeig, vecLonNeig, vecDepNeig, clustering=None):
+    """
+    Cluster (DBSCAN) the focal mechanisms of the neighbours of an event and
+    obtain the median solution of each cluster. X_results holds the
+    strike, dip, rake and distance to the event (km) of each neighbour.
+    The clustering (eps, labels) is calculated when not given.
+    Being a plain function, it can run in a pool of processes.
+    """
+    cmts = {}
+
+    if clustering is None:
+        clustering = selectClustering(X_results)
+    eps, labels = clustering
+    if labels is None:
         return cmts
+    labels = labels.astype(float)
+
+    # Group the neighbours by cluster (same ordering as the former
+    # X_resultsSortCluster) and count the elements of each cluster
+    order = labels.argsort()
+    clusters, vecNumElementsCluster = np.unique(labels, return_counts=True)
+    bounds = np.concatenate(([0], np.cumsum(vecNumElementsCluster)))
+
+    # Contiguous column groups: strike/dip/rake and lat/lon/depth
+    mechanisms = np.ascontiguousarray(X_results[order, 0:3].T)
+    positions = np.vstack((vecLatNeig, vecLonNeig, vecDepNeig))[:, order]
+
+    # For each cluster obtained the median and the mean of the FM considering each angle as independent variable. Compare with the k-closest neighbors
+    nClusters = len(clusters)
+    VecTempClusterMean = np.zeros((nClusters, 3))
+    VecTempClusterStd = np.zeros((nClusters, 3))
+    VecTempClusterMedian = np.zeros((nClusters, 3))
+    VecCentroides = np.zeros((nClusters, 3))
+    VecCentroidesStd = np.zeros((nClusters, 3))
+    for jj in range(nClusters):
+        segment = slice(bounds[jj], bounds[jj + 1])
+        VecTempClusterMean[jj] = np.mean(mechanisms[:, segment], axis=1)
+        VecTempClusterStd[jj] = np.std(mechanisms[:, segment], axis=1)
+        VecTempClusterMedian[jj] = np.percentile(mechanisms[:, segment], 50, axis=1,
+                                                 interpolation = 'midpoint')
+        VecCentroides[jj] = np.mean(positions[:, segment], axis=1)
+        VecCentroidesStd[jj] = np.std(positions[:, segment], axis=1)
+
+    aux_plane_Clust = np.column_stack(aux_plane_batch(VecTempClusterMedian[:,0],
+                                                      VecTempClusterMedian[:,1],
+                                                      VecTempClusterMedian[:,2]))
+    for jj in range(nClusters):
+        ## Median Clustering Solution
+        e = Event(VecCentroides[jj,0],
+                  VecCentroides[jj,1],
+                  VecCentroides[jj,2],
+                  0.0,
+                  VecTempClusterMedian[jj,0],
+                  VecTempClusterMedian[jj,1],
+                  VecTempClusterMedian[jj,2]
+                  )
+        cmts.update({"ClustMedian-" + str(jj+1): e.toJSON()})
+
+        ## AuxPlanes_Median Clustering Solution
+        e = Event(VecCentroides[jj,0],VecCentroides[jj,1],VecCentroides[jj,2],0.0,aux_plane_Clust[jj,0],aux_plane_Clust[jj,1],aux_plane_Clust[jj,2])
+        cmts.update({"ClustMedian-" + str(jj+1) + "_AuxPlane" : e.toJSON()})
 
+    return cmts
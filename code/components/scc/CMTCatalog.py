@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+
+# Historical focal mechanisms catalog
+# This module is part of the Smart Center Control (SSC) solution
+
+# Author:  Juan Esteban Rodríguez, Josep de la Puente
+# Contact: juan.rodriguez@bsc.es, josep.delapuente@bsc.es
+
+# ###############################################################################
+#       BSD 3-CLAUSE, aka BSD NEW, aka BSD REVISED, aka MODIFIED BSD LICENSE
+
+# Copyright 2023,2024 Josep de la Puente, Juan Esteban Rodriguez
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name(s) of the copyright holder(s) nor the name(s) of its
+# contributor(s) may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDER(S) AND CONTRIBUTOR(S) “AS
+# IS” AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER(S) OR CONTRIBUTOR(S) BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# ###############################################################################
+# Module imports
+import os
+import copy
+import time
+import threading
+
+# Third parties
+import obspy
+import numpy as np
+from pymongo import errors
+from sklearn.neighbors import BallTree
+
+# Internal
+import ucis4eq.dal as dal
+from ucis4eq.dal import staticDataCache
+
+# ###############################################################################
+# Methods and classes
+
+# Mean Earth radius (km) used by the 'haversine' package
+EARTH_RADIUS = 6371.0088
+
+def haversineVector(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance (km) between two sets of points given in degrees.
+    It follows the same formulation than 'haversine.haversine' but it accepts
+    NumPy arrays (broadcasting a single point is allowed)
+    """
+    lat1, lon1 = np.radians(lat1), np.radians(lon1)
+    lat2, lon2 = np.radians(lat2), np.radians(lon2)
+
+    d = np.sin((lat2 - lat1) * 0.5) ** 2 \
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) * 0.5) ** 2
+
+    return EARTH_RADIUS * 2 * np.arcsin(np.sqrt(d))
+
+
+class FocalMechanismCatalog():
+    "Historical focal mechanisms catalog stored as a single NumPy record array"
+
+    # Columns stored for each event of the catalog
+    fields = ("latitude", "longitude", "depth", "magnitude",
+              "strike", "dip", "rake", "time")
+    dtype = np.dtype([(field, np.float64) for field in fields])
+
+    # Initialization method
+    def __init__(self, records=None, **columns):
+        """
+        Initialize the catalog from a record array or from a set of equally
+        sized columns
+        """
+        if records is None:
+            records = np.empty(len(columns[self.fields[0]]), dtype=self.dtype)
+            for field in self.fields:
+                records[field] = columns[field]
+
+        self.records = records.view(np.recarray)
+
+    def __getattr__(self, name):
+        """
+        Columns of the catalog (views over the records)
+        """
+        if name in FocalMechanismCatalog.fields and 'records' in self.__dict__:
+            return self.records[name]
+        raise AttributeError(name)
+
+    def __getitem__(self, i):
+        """
+        Single event of the catalog (view with attribute access)
+        """
+        return self.records[i]
+
+    @classmethod
+    def fromObspy(cls, cat):
+        """
+        Build the catalog from an obspy one. Note that origins have a [0] and
+        [1] indices; [0] (reforigin) is the initial estimate while [1]
+        (CMTorigin) are the updated values, hence we use the CMT origin
+        """
+        records = np.empty(len(cat), dtype=cls.dtype)
+
+        for i, e in enumerate(cat):
+            origin = e.origins[1]
+            fm = e.focal_mechanisms[0]['nodal_planes'].nodal_plane_1
+
+            records[i] = (origin['latitude'], origin['longitude'], origin['depth'],
+                          e.magnitudes[0]['mag'], fm.strike, fm.dip, fm.rake,
+                          origin['time'].timestamp)
+
+        return cls(records)
+
+    @classmethod
+    def load(cls, fileName, magnitudeThreshold=None):
+        """
+        Load a QuakeML catalog through the columnar cache of the DAL, so the
+        file is only parsed by obspy the first time it is used (or changed).
+        Only the events over a magnitude threshold (if given) are loaded in
+        memory.
+        """
+        columns = staticDataCache.cache.columns(fileName, cls._parse, cls.fields)
+        if magnitudeThreshold is not None:
+            mask = columns['magnitude'] >= magnitudeThreshold
+            columns = {field: values[mask] for field, values in columns.items()}
+
+        return cls(**columns)
+
+    @classmethod
+    def _parse(cls, fileName):
+        """
+        Parse a QuakeML catalog file and return its columns
+        """
+        catalog = cls.fromObspy(obspy.read_events(fileName))
+        return {field: getattr(catalog, field) for field in cls.fields}
+
+    def __len__(self):
+        return len(self.records)
+
+    def select(self, mask):
+        """
+        Obtain a new catalog with the events selected by a mask (or indices)
+        """
+        return FocalMechanismCatalog(np.asarray(self.records)[mask])
+
+    def distances(self, latitude, longitude, depth, indices=slice(None)):
+        """
+        Compute in one call the distances (m) from a given hypocenter to all
+        the events of the catalog (or to a subset given by 'indices'). It
+        returns the euclidean distance and its great-circle and depth
+        components
+        """
+        sphereDist = haversineVector(self.latitude[indices], self.longitude[indices],
+                                     latitude, longitude) * 1000
+        depthDist = self.depth[indices] - depth
+        euclideanDist = np.sqrt(sphereDist**2 + depthDist**2)
+
+        return euclideanDist, sphereDist, depthDist
+
+
+class FocalMechanismIndex():
+    """
+    Spatial index (haversine BallTree) over an historical catalog. Events
+    appended afterwards (incremental updates) are kept at the end of the
+    catalog and scanned directly until they are merged into a new tree.
+    """
+
+    # Initialization method
+    def __init__(self, catalog):
+        """
+        Build the index for a given catalog
+        """
+        self.catalog = catalog
+        self.static = len(catalog)
+        self._records = np.asarray(catalog.records)
+        self._staticTimes = np.sort(catalog.time)
+        self.tree = None
+        if len(catalog):
+            self.tree = BallTree(np.radians(np.column_stack((catalog.latitude,
+                                                             catalog.longitude))),
+                                 metric='haversine')
+
+    def merge(self):
+        """
+        Obtain an index with the incremental updates in the tree. The catalog
+        (and the position of its events) is the same, so the neighbours
+        found are the same too.
+        """
+        if self.static == len(self.catalog):
+            return self
+
+        index = FocalMechanismIndex(self.catalog)
+        index._staticTimes = self._staticTimes
+        return index
+
+    def extend(self, records):
+        """
+        Obtain an index including new events (record array with the catalog
+        fields) that shares the tree of the current one. Events already in
+        the static catalog (same origin time within 20 s) are ignored.
+        Indexes in use are never modified.
+        """
+        records = np.asarray(records, dtype=FocalMechanismCatalog.dtype)
+
+        if len(self._staticTimes) and len(records):
+            times = self._staticTimes
+            position = np.searchsorted(times, records['time'])
+            before = times[np.maximum(position - 1, 0)]
+            after = times[np.minimum(position, len(times) - 1)]
+            known = (np.abs(records['time'] - before) < 20) | \
+                    (np.abs(after - records['time']) < 20)
+            records = records[~known]
+
+        if not len(records):
+            return self
+
+        # Amortized growth of the buffer shared with the previous indexes
+        size = len(self.catalog)
+        needed = size + len(records)
+        if needed > len(self._records):
+            buffer = np.empty(max(needed, 2 * len(self._records), 16),
+                              dtype=FocalMechanismCatalog.dtype)
+            buffer[:size] = self._records[:size]
+        else:
+            buffer = self._records
+        buffer[size:needed] = records
+
+        index = copy.copy(self)
+        index._records = buffer
+        index.catalog = FocalMechanismCatalog(buffer[:needed])
+
+        return index
+
+    def _query(self, latitude, longitude, k=None, radius=None):
+        """
+        Obtain the events closest (great-circle) to a point, either the 'k'
+        nearest ones or those within a 'radius' (m)
+        """
+        point = np.radians([[latitude, longitude]])
+        if k is not None:
+            return self.tree.query(point, k=k, return_distance=False)[0]
+
+        # A relative margin protects the search from rounding differences,
+        # exact distances are checked afterwards anyway
+        angle = radius / (EARTH_RADIUS * 1000) * (1 + 1e-9)
+        return self.tree.query_radius(point, r=angle)[0]
+
+    def neighbours(self, latitude, longitude, depth, kmin, threshold,
+                   growthrate, exclude=None):
+        """
+        Find the events within a distance threshold (m) that is increased by
+        'growthrate' till at least 'kmin' neighbours are found (or the whole
+        catalog is included). Events flagged in the 'exclude' mask are
+        ignored. It returns the neighbours (sorted by euclidean distance and
+        catalog position), their distances and the final threshold.
+
+        Since the euclidean distance is never below the great-circle one, the
+        'kmin' nearest events on the sphere bound the distance of the
+        kmin-th neighbour, so a single radius query covers the final
+        threshold and the result is the same than scanning the catalog.
+        """
+        catalog = self.catalog
+        if exclude is None:
+            exclude = np.zeros(len(catalog), dtype=bool)
+        available = len(catalog) - np.count_nonzero(exclude)
+        updates = np.arange(self.static, len(catalog))
+
+        candidates = np.empty(0, dtype=np.intp)
+        if available:
+            # Bound the distance of the kmin-th neighbour (the kmin-th
+            # closest event of any subset of the catalog is an upper bound)
+            radius = threshold
+            if kmin > 0:
+                nearest = np.empty(0, dtype=np.intp)
+                if self.static:
+                    k = min(self.static, kmin + np.count_nonzero(exclude[:self.static]))
+                    nearest = self._query(latitude, longitude, k=k)
+                nearest = np.concatenate((nearest, updates))
+                nearest = nearest[~exclude[nearest]]
+                bounds = catalog.distances(latitude, longitude, depth, nearest)[0]
+                kth = min(kmin, len(bounds)) - 1
+                bound = np.partition(bounds, kth)[kth]
+                radius = max(threshold, bound * growthrate)
+
+            # Obtain every event that may fall within the final threshold
+            # (incremental updates are always checked)
+            if self.static:
+                candidates = self._query(latitude, longitude, radius=radius)
+            candidates = np.concatenate((candidates, updates))
+            candidates = candidates[~exclude[candidates]]
+
+        euclideanDist, sphereDist, depthDist = catalog.distances(latitude, longitude,
+                                                                 depth, candidates)
+        order = np.lexsort((candidates, euclideanDist))
+
+        # Increase distance threshold till the minimum k-neighbors be reached
+        while True:
+            k = np.searchsorted(euclideanDist[order], threshold, side='right')
+
+            # Check if the number of neighbors found was enough
+            if (kmin <= k) or (k == available):
+                break
+
+            # Increase the search threshold
+            threshold = threshold * growthrate
+
+        order = order[0:k]
+
+        return candidates[order], euclideanDist[order], sphereDist[order], \
+               depthDist[order], threshold
+
+
+# Collection storing the focal mechanisms observed after the catalogs were built
+UPDATES = "CatalogUpdates"
+
+# Seconds between two reads of the incremental catalog (the events appended
+# by the current process are read on next use)
+updatesRefresh = 60
+
+# Incremental updates scanned directly before they are merged into the tree
+mergeThreshold = 1024
+
+# Events appended by the current process
+_appended = 0
+
+def updatesDue(checked, appended):
+    """
+    Check if the incremental catalog must be read again. 'checked' is the
+    (monotonic) time of the last read and 'appended' the events appended by
+    the process at that time.
+    """
+    return checked is None or appended != _appended or \
+           time.monotonic() - checked >= updatesRefresh
+
+def appendEvent(latitude, longitude, depth, magnitude, strike, dip, rake, time, **info):
+    """
+    Store a new focal mechanism (e.g. a GCMT solution of a past event) in
+    the incremental catalog. It is merged with every catalog the next time
+    its index is used. Events with 'uuid' and 'agency' in 'info' are stored
+    only once.
+    """
+    document = {"latitude": float(latitude), "longitude": float(longitude),
+                "depth": float(depth), "magnitude": float(magnitude),
+                "strike": float(strike), "dip": float(dip), "rake": float(rake),
+                "time": obspy.UTCDateTime(time).timestamp}
+    document.update(info)
+
+    collection = dal.database[UPDATES]
+    if "uuid" in info and "agency" in info:
+        collection.update_one({"uuid": info["uuid"], "agency": info["agency"]},
+                              {"$setOnInsert": document}, upsert=True)
+    else:
+        collection.insert_one(document)
+
+    global _appended
+    _appended += 1
+
+def lastUpdate():
+    """
+    Identifier of the latest focal mechanism of the incremental catalog
+    ("" if there is none)
+    """
+    document = dal.database[UPDATES].find_one({}, {"_id": True}, sort=[("_id", -1)])
+    return str(document["_id"]) if document else ""
+
+def _readUpdates(magnitudeThreshold, after=None):
+    """
+    Focal mechanisms of the incremental catalog over a magnitude threshold
+    stored after a given identifier. Returns a record array and the
+    identifier of the last one.
+    """
+    query = {"magnitude": {"$gte": magnitudeThreshold}}
+    if after is not None:
+        query["_id"] = {"$gt": after}
+
+    documents = list(dal.database[UPDATES].find(query).sort("_id", 1))
+    records = np.array([tuple(float(d[field]) for field in FocalMechanismCatalog.fields)
+                        for d in documents], dtype=FocalMechanismCatalog.dtype)
+
+    return records, (documents[-1]["_id"] if documents else after)
+
+# Spatial indexes alive in the current process (one per catalog and setup)
+_indexes = {}
+_indexesLock = threading.Lock()
+
+def loadIndex(fileName, magnitudeThreshold):
+    """
+    Obtain the spatial index of the events of a catalog file with a magnitude
+    over a given threshold, merged with the incremental catalog. Indexes are
+    kept across requests, rebuilt only when the catalog file changes and
+    extended with the focal mechanisms stored since the last read (every
+    'updatesRefresh' seconds). Their tree is rebuilt when more than
+    'mergeThreshold' updates are scanned directly.
+    """
+    key = (os.path.abspath(fileName), magnitudeThreshold)
+    stamp = staticDataCache.cache.stamp(fileName)
+
+    with _indexesLock:
+        entry = _indexes.get(key)
+        if not entry or entry[0] != stamp:
+            catalog = FocalMechanismCatalog.load(fileName, magnitudeThreshold)
+            entry = (stamp, FocalMechanismIndex(catalog), None, None, 0)
+
+        # Absorb the newly observed events
+        stamp, index, last, checked, appended = entry
+        if updatesDue(checked, appended):
+            checked, appended = time.monotonic(), _appended
+            try:
+                records, last = _readUpdates(magnitudeThreshold, last)
+                index = index.extend(records)
+            except errors.PyMongoError as e:
+                print("WARNING: (CMT catalog) Incremental catalog not available: " + str(e),
+                      flush=True)
+
+            if len(index.catalog) - index.static > mergeThreshold:
+                index = index.merge()
+
+        entry = (stamp, index, last, checked, appended)
+        _indexes[key] = entry
+
+    return entry[1]
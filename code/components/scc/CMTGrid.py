@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+# Precomputed lattice of focal mechanisms for a region
+# This module is part of the Smart Center Control (SSC) solution
+
+# Author:  Juan Esteban Rodríguez, Josep de la Puente
+# Contact: juan.rodriguez@bsc.es, josep.delapuente@bsc.es
+
+# ###############################################################################
+#       BSD 3-CLAUSE, aka BSD NEW, aka BSD REVISED, aka MODIFIED BSD LICENSE
+
+# Copyright 2023,2024 Josep de la Puente, Juan Esteban Rodriguez
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name(s) of the copyright holder(s) nor the name(s) of its
+# contributor(s) may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDER(S) AND CONTRIBUTOR(S) “AS
+# IS” AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER(S) OR CONTRIBUTOR(S) BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# ###############################################################################
+# Module imports
+import os
+import json
+import time
+import bisect
+import hashlib
+import threading
+
+# Third parties
+import numpy as np
+from bson import ObjectId
+from pymongo import errors
+
+# Internal
+import ucis4eq
+from ucis4eq.dal import staticDataCache
+from ucis4eq.scc import CMTCatalog
+
+# ###############################################################################
+# Methods and classes
+
+def gridFileName(regionId):
+    """
+    Location of the CMT grid of a region in the DAL workspace
+    """
+    return ucis4eq.workSpace + "DAL/cmtGrid/" + regionId + ".npz"
+
+def setupDigest(setup):
+    """
+    Hash of a CMT calculation setup (the event, if present, is not part of it)
+    """
+    setup = {key: value for key, value in setup.items() if key != "event"}
+    return hashlib.sha1(json.dumps(setup, sort_keys=True).encode('utf-8')).hexdigest()
+
+def catalogVersion(catalogFileName):
+    """
+    Version of a catalog: contents of the file and latest incremental update
+    (the grid is only outdated by the updates stored after it that reach its
+    nodes)
+    """
+    return staticDataCache.cache.digest(catalogFileName) + ":" + CMTCatalog.lastUpdate()
+
+class CMTGrid():
+    "Focal mechanisms (strike, dip, rake) calculated on a lat/lon/depth lattice"
+
+    # Increase it if the layout or the solutions of the stored arrays change
+    version = 3
+
+    # Initialization method
+    def __init__(self, latitudes, longitudes, depths, names, mechanisms,
+                 catalog="", setup="", reach=None):
+        """
+        Initialize the grid. 'mechanisms' has shape
+        (latitudes, longitudes, depths, names, 3) and stores NaN for the
+        solutions not available in a node. 'reach' (latitudes, longitudes)
+        is the largest distance (m) at which an event of the catalog was
+        searched for the nodes of each position (infinite by default).
+        """
+        self.latitudes = np.asarray(latitudes, dtype=float)
+        self.longitudes = np.asarray(longitudes, dtype=float)
+        self.depths = np.asarray(depths, dtype=float)
+        self.names = [str(name) for name in names]
+        self.mechanisms = np.asarray(mechanisms, dtype=np.float32)
+        self.catalog = str(catalog)
+        self.setup = str(setup)
+        if reach is None:
+            reach = np.full((len(self.latitudes), len(self.longitudes)), np.inf)
+        self.reach = np.asarray(reach, dtype=float)
+
+        # Incremental updates already checked (last one, time of the read
+        # and events appended by the process then)
+        self.checked = None
+        self.checkedAt = None
+        self.appended = 0
+        self.outdated = False
+
+        # Plain lists are faster for looking up a single point
+        self._axes = (self.latitudes.tolist(), self.longitudes.tolist(), self.depths.tolist())
+
+    @classmethod
+    def load(cls, fileName):
+        """
+        Read a grid from a .npz file
+        """
+        with np.load(fileName) as data:
+            if int(data['version']) != cls.version:
+                raise Exception("CMT grid '" + fileName + "' has an unsupported version")
+
+            return cls(data['latitudes'], data['longitudes'], data['depths'],
+                       data['names'], data['mechanisms'],
+                       data['catalog'], data['setup'], data['reach'])
+
+    def save(self, fileName):
+        """
+        Store the grid as a .npz file
+        """
+        os.makedirs(os.path.dirname(fileName), exist_ok=True)
+        tmp = fileName + ".tmp.npz"
+        np.savez_compressed(tmp, version=self.version,
+                            latitudes=self.latitudes,
+                            longitudes=self.longitudes,
+                            depths=self.depths,
+                            names=np.array(self.names),
+                            mechanisms=self.mechanisms,
+                            catalog=self.catalog,
+                            setup=self.setup,
+                            reach=self.reach)
+        os.replace(tmp, fileName)
+
+    @staticmethod
+    def _nearest(axis, value):
+        i = bisect.bisect_left(axis, value)
+        if i == len(axis) or (i > 0 and value - axis[i - 1] <= axis[i] - value):
+            i -= 1
+        return i
+
+    def affectedBy(self, latitudes, longitudes):
+        """
+        Check if any of the given events is within the reach of a node (the
+        great-circle distance never exceeds the euclidean one, so the depth
+        is not needed)
+        """
+        nodes = np.meshgrid(self.latitudes, self.longitudes, indexing='ij')
+        for lat, lon in zip(latitudes, longitudes):
+            if np.any(CMTCatalog.haversineVector(nodes[0], nodes[1], lat, lon) * 1000
+                      <= self.reach):
+                return True
+
+        return False
+
+    def contains(self, lat, lon, depth):
+        """
+        Check if a point lies inside the lattice
+        """
+        return self.latitudes[0] <= lat <= self.latitudes[-1] and \
+               self.longitudes[0] <= lon <= self.longitudes[-1] and \
+               self.depths[0] <= depth <= self.depths[-1]
+
+    def lookup(self, lat, lon, depth):
+        """
+        Focal mechanisms of the nearest node of the lattice (same layout than
+        the CMT calculation output) or None if the point is outside the grid
+        or the node has no solution
+        """
+        if not self.contains(lat, lon, depth):
+            return None
+
+        latitudes, longitudes, depths = self._axes
+        node = self.mechanisms[self._nearest(latitudes, lat),
+                               self._nearest(longitudes, lon),
+                               self._nearest(depths, depth)]
+
+        # Angles are stored in single precision (rounded to 1e-4 degrees)
+        cmts = {}
+        for name, (strike, dip, rake) in zip(self.names, node.astype(float).round(4).tolist()):
+            if strike == strike:
+                cmts[name] = {"strike": str(strike), "dip": str(dip), "rake": str(rake)}
+
+        return cmts or None
+
+# Grids already loaded in the process
+_grids = {}
+_gridsLock = threading.Lock()
+
+def _updated(grid, magnitudeThreshold):
+    """
+    Check if a focal mechanism of the incremental catalog stored after the
+    grid was built (and over the magnitude threshold) reaches its nodes. Only
+    the updates not checked yet are read (every 'updatesRefresh' seconds).
+    """
+    with _gridsLock:
+        if not grid.outdated and CMTCatalog.updatesDue(grid.checkedAt, grid.appended):
+            grid.checkedAt, grid.appended = time.monotonic(), CMTCatalog._appended
+            after = grid.checked
+            if after is None:
+                built = grid.catalog.partition(":")[2]
+                after = ObjectId(built) if built else None
+
+            try:
+                records, grid.checked = CMTCatalog._readUpdates(magnitudeThreshold, after)
+            except errors.PyMongoError as e:
+                # Use the grid with the updates known (as the catalog index does)
+                print("WARNING: (CMT calculation) Incremental catalog not available: " + str(e),
+                      flush=True)
+                return False
+
+            grid.outdated = grid.affectedBy(records['latitude'], records['longitude'])
+
+        return grid.outdated
+
+def loadGrid(regionId, catalogFileName, setup):
+    """
+    Obtain the CMT grid of a region if it exists and it was built from the
+    current catalog and setup. Otherwise return None.
+    """
+    fileName = gridFileName(regionId)
+    if not os.path.isfile(fileName):
+        return None
+
+    stamp = staticDataCache.cache.stamp(fileName)
+    with _gridsLock:
+        entry = _grids.get(fileName)
+        if not entry or entry[0] != stamp:
+            try:
+                entry = (stamp, CMTGrid.load(fileName))
+            except Exception as e:
+                print("WARNING: (CMT calculation) The CMT grid of region '" + regionId +
+                      "' can not be used: " + str(e), flush=True)
+                return None
+            _grids[fileName] = entry
+    grid = entry[1]
+
+    digest = grid.catalog.partition(":")[0]
+    if digest != staticDataCache.cache.digest(catalogFileName) or \
+       grid.setup != setupDigest(setup) or \
+       _updated(grid, setup['magnitudethreshold']):
+        print("WARNING: (CMT calculation) The CMT grid of region '" + regionId +
+              "' is outdated and will not be used", flush=True)
+        return None
+
+    return grid
@@ -38,11 +38,8 @@ import os
 import traceback
 import json
 import requests
-import math
 
-from shapely.geometry import mapping, shape
-from shapely.prepared import prep
-from shapely.geometry import Point
+import numpy as np
 
 from bson.json_util import dumps
 from bson import ObjectId
@@ -51,9 +48,10 @@ from urllib.request import urlopen
 from flask import jsonify
 
 # Internal
-from ucis4eq.misc import config, microServiceABC
+from ucis4eq.misc import config, microServiceABC, geoResolver
 import ucis4eq as ucis4eq
-from ucis4eq.dal import staticDataMap
+from ucis4eq.dal import staticDataMap, staticDataRegistry
+from ucis4eq.scc import CMTCatalog, regionIndex
 import ucis4eq.dal as dal
 
 # ###############################################################################
@@ -89,6 +87,16 @@ class EventRegistration(microServiceABC.MicroServiceABC):
         print("Request Id. [" + str(event) + "] registered for event [" + \
              field['uuid'] + "]", flush=True)
 
+        # Known focal mechanisms (GCMT) feed the incremental CMT catalog
+        for alert in body['alerts']:
+            if "cmt" in alert.keys() and "GCMT" in alert["cmt"].keys():
+                fm = alert["cmt"]["GCMT"]
+                CMTCatalog.appendEvent(alert['latitude'], alert['longitude'],
+                                       alert['depth'], alert['magnitude'],
+                                       fm['strike'], fm['dip'], fm['rake'],
+                                       alert['time'], uuid=field['uuid'],
+                                       agency=alert.get('agency', ""))
+
         # Return list of Id of the newly created item
         return jsonify(result = str(event), response = 201)
 
@@ -141,53 +149,64 @@ class EventRegion(microServiceABC.MicroServiceABC):
         # Retrieve the event's complete information
         rid = body['id']
 
-        # Build the pipeline for obtaining the AVG of the set of alerts
-        avgPosPipeline = [
-            {"$match": {"_id": ObjectId(rid)}},
-            {"$unwind": "$alerts"},
-            {"$group": {"_id": ObjectId(rid),
-                        "avgLatitude": {"$avg": "$alerts.latitude"},
-                        "avgLongitude": {"$avg": "$alerts.longitude"}
-                        }
-             }
-        ]
-
-        # It assumed that just one result is obtained
-        for event in self.db['Requests'].aggregate(avgPosPipeline):
-            # Build pipeline to obtain the region from a concrete given event
-            regionPipeline = [{"$project": {
-                "_id": {"$toString": "$_id"},
-                "id": 1,
-                "file_structure": 1,
-                "available_ensemble": 1,
-                "available_fmax": 1,
-                "depth_in_m": 1,
-                "min_latitude": "$min_latitude",
-                "max_latitude": "$max_latitude",
-                "min_longitude": "$min_longitude",
-                "max_longitude": "$max_longitude"}
-            }, {
-                "$match": {"$and": [
-                    {"min_latitude": {"$lte": event["avgLatitude"]}},
-                    {"max_latitude": {"$gte": event["avgLatitude"]}},
-                    {"min_longitude": {"$lte": event["avgLongitude"]}},
-                    {"max_longitude": {"$gte": event["avgLongitude"]}}]}}
-            ]
-
-            # For region in self.db['Regions'].aggregate(regionPipeline):
-            regions = list(self.db['Regions'].aggregate(regionPipeline))
-            if regions:
-                # Select the region
-                # TODO: Calculate the area of each of the regions an choose the minimal one
-                # Ref: https://stackoverflow.com/questions/4681737/how-to-calculate-the-area-of-a-polygon-on-the-earths-surface-using-python
-                self.region = regions[0]
+        # Average position of the set of alerts
+        event = self.db['Requests'].find_one({"_id": ObjectId(rid)},
+                    {"alerts.latitude": 1, "alerts.longitude": 1})
 
-                # Download remote region's setup
-                self.region['path'] = self.fileMapping[self.region['id']]
+        if event and event.get('alerts'):
+            self.region = self._getRegion(*regionIndex.averagePosition(event['alerts']))
 
         # Return list of Id of the newly created item
         return jsonify(result=self.region, response=201)
 
+    @config.safeRun
+    def entryPointBatch(self, body):
+        """
+        Figure out the region of each of the events in body['ids']
+        """
+        ids = [ObjectId(rid) for rid in body['ids']]
+        events = {event['_id']: event for event in self.db['Requests'].find(
+                  {"_id": {"$in": ids}}, {"alerts.latitude": 1, "alerts.longitude": 1})}
+
+        # Locate all the events at once
+        positions = [regionIndex.averagePosition(events[rid]['alerts'])
+                     if rid in events and events[rid].get('alerts') else (None, None)
+                     for rid in ids]
+        latitudes = [np.nan if lat is None else lat for lat, lon in positions]
+        longitudes = [np.nan if lon is None else lon for lat, lon in positions]
+
+        results = []
+        for regions in regionIndex.regions.lookupMany(latitudes, longitudes):
+            results.append(self._selectRegion(regions))
+
+        return jsonify(result=results, response=201)
+
+    def _getRegion(self, latitude, longitude):
+        """
+        Smallest region containing a point
+        """
+        regions = regionIndex.regions.lookup(latitude, longitude)
+
+        # Regions added after the last refresh of the index
+        if not regions and latitude is not None and longitude is not None:
+            regions = regionIndex.regions.query(latitude, longitude)
+            if regions:
+                regionIndex.regions.invalidate()
+
+        return self._selectRegion(regions)
+
+    def _selectRegion(self, regions):
+        if not regions:
+            return None
+
+        # Regions are sorted by area
+        region = regions[0]
+
+        # Download remote region's setup
+        region['path'] = self.fileMapping[region['id']]
+
+        return region
+
 
 @staticDataMap.build
 class EventSetup(microServiceABC.MicroServiceABC):
@@ -241,28 +260,50 @@ class EventCountry(microServiceABC.MicroServiceABC):
 
         # TODO: Download the countries.geojson to save in local
         # data = requests.get("https://raw.githubusercontent.com/datasets/geo-countries/master/data/countries.geojson").json()
-        with open(self.fileMapping["countries"], 'r', encoding='utf-8') as f:
-            data = json.load(f)
-
-        countries = {}
-        for feature in data["features"]:
-            geom = feature["geometry"]
-            country = feature["properties"]["ADMIN"]
-            countries[country] = prep(shape(geom))
-
-        def get_country(lon, lat):
-            point = Point(lon, lat)
-            for country, geom in countries.items():
-                if geom.contains(point):
-                    return country
-
-        country = get_country(lon, lat)
+        countries = staticDataRegistry.registry.get(self.fileMapping, "countries",
+                                                    geoResolver.GeoResolver)
+
+        country = countries.locate(lon, lat, "ADMIN")
         if not country:
             raise Exception("Ouch! No country was found")
 
         return country.upper()
 
 
+def utmZones(longitudes, latitudes):
+    """
+    UTM zone of each point, including the special zones of Norway and
+    Svalbard
+    Source: https://gis.stackexchange.com/questions/365584/convert-utm-zone-into-epsg-code
+    """
+    longitudes = np.asarray(longitudes, dtype=np.float64)
+    latitudes = np.asarray(latitudes, dtype=np.float64)
+
+    # Regular zones (180 degrees belongs to the first zone)
+    zones = np.floor((longitudes + 180) / 6).astype(int) % 60 + 1
+
+    # Norway
+    norway = (latitudes >= 56.0) & (latitudes < 64.0) & \
+             (longitudes >= 3.0) & (longitudes < 12.0)
+    zones = np.where(norway, 32, zones)
+
+    # Svalbard
+    svalbard = (latitudes >= 72.0) & (latitudes < 84.0)
+    for west, east, zone in [(0.0, 9.0, 31), (9.0, 21.0, 33),
+                             (21.0, 33.0, 35), (33.0, 42.0, 37)]:
+        zones = np.where(svalbard & (longitudes >= west) & (longitudes < east),
+                         zone, zones)
+
+    return zones
+
+def epsgCodes(longitudes, latitudes):
+    """
+    EPSG code (WGS 84 / UTM) of each point
+    """
+    zones = utmZones(longitudes, latitudes)
+    return 32600 + zones + np.where(np.asarray(latitudes) < 0, 100, 0)
+
+
 class EventEPSG(microServiceABC.MicroServiceABC):
 
     # Initialization method
@@ -275,8 +316,13 @@ class EventEPSG(microServiceABC.MicroServiceABC):
     @microServiceABC.MicroServiceABC.runRegistration
     def entryPoint(self, body):
         """
-        Figure out the country which the incoming EQ event belong
+        Figure out the EPSG code (UTM zone) of the incoming EQ event or of a
+        list of [longitude, latitude] points given in body['points']
         """
+        if 'points' in body:
+            points = np.asarray(body['points'], dtype=np.float64).reshape(-1, 2)
+            epsg = epsgCodes(points[:, 0], points[:, 1]).tolist()
+            return jsonify(result=epsg, response=201)
 
         alert = body['alerts'][0]
         epsg = self._getEPSG(alert['longitude'], alert['latitude'])
@@ -285,28 +331,4 @@ class EventEPSG(microServiceABC.MicroServiceABC):
         return jsonify(result=epsg, response=201)
 
     def _getEPSG(self, longitude, latitude):
-        # Special zones for Svalbard and Norway
-        # Source: https://gis.stackexchange.com/questions/365584/convert-utm-zone-into-epsg-code
-        def getZones(longitude, latitude):
-
-            if (latitude >= 72.0 and latitude < 84.0):
-                if (longitude >= 0.0 and longitude < 9.0):
-                    return 31
-            if (longitude >= 9.0 and longitude < 21.0):
-                return 33
-            if (longitude >= 21.0 and longitude < 33.0):
-                return 35
-            if (longitude >= 33.0 and longitude < 42.0):
-                return 37
-            return (math.floor((longitude + 180) / 6)) + 1
-
-        def findEPSG(longitude, latitude):
-            zone = getZones(longitude, latitude)
-            #zone = (math.floor((longitude + 180) / 6) ) + 1  # without special zones for Svalbard and Norway
-            epsg_code = 32600
-            epsg_code += int(zone)
-            if (latitude < 0):   # South
-                epsg_code += 100
-            return epsg_code
-
-        return (findEPSG(longitude, latitude))
+        return int(epsgCodes(longitude, latitude))
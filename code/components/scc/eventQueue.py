@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+# Persistent priority queue of the events waiting for the workflow manager
+# This module is part of the Smart Center Control (SSC) solution
+
+# Author:  Juan Esteban Rodríguez, Josep de la Puente
+# Contact: juan.rodriguez@bsc.es, josep.delapuente@bsc.es
+
+# ###############################################################################
+#       BSD 3-CLAUSE, aka BSD NEW, aka BSD REVISED, aka MODIFIED BSD LICENSE
+
+# Copyright 2023,2024 Josep de la Puente, Juan Esteban Rodriguez
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name(s) of the copyright holder(s) nor the name(s) of its
+# contributor(s) may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDER(S) AND CONTRIBUTOR(S) “AS
+# IS” AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER(S) OR CONTRIBUTOR(S) BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# ###############################################################################
+# Module imports
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+import traceback
+
+# Third parties
+import requests
+
+# ###############################################################################
+# Methods and classes
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    uuid TEXT UNIQUE NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    magnitude REAL,
+    body TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    queued REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS events_order
+    ON events (state, priority DESC, magnitude DESC, id);
+"""
+
+def isValid(event):
+    """
+    Check if an event can be queued (it needs its UUID)
+    """
+    return isinstance(event, dict) and isinstance(event.get('uuid'), str) and \
+           event['uuid'] != ""
+
+def magnitude(event):
+    """
+    Largest magnitude given by the alerts of an event
+    """
+    values = [a['magnitude'] for a in event.get('alerts', [])
+              if a.get('magnitude') is not None]
+    return max(values) if values else None
+
+def scoreEvents(events, url, timeout=5):
+    """
+    Index priority of a list of events (the one already set in an event is
+    kept). Events get priority 0 if the service is not available, does not
+    answer in 'timeout' seconds or can not score them (invalid events are
+    not sent).
+    """
+    priorities = [event.get('priority') if isValid(event) else 0 for event in events]
+    missing = [i for i, p in enumerate(priorities) if p is None]
+    if not missing:
+        return priorities
+
+    try:
+        r = requests.post(url, json={'events': [events[i] for i in missing]},
+                          timeout=timeout)
+        result = r.json()
+        if result['response'] == 501:
+            raise Exception(result['result'])
+        for i, p in zip(missing, result['result']):
+            if p.get('priorityIndex') is not None:
+                priorities[i] = int(p['priorityIndex'])
+    except Exception as error:
+        print("WARNING: Index priority of the queued events is not available (" +
+              str(error) + ")", flush=True)
+
+    return [p if p is not None else 0 for p in priorities]
+
+
+class EventQueue():
+    """
+    Queue of events stored in SQLite. Pending events are run by 'workers'
+    threads calling 'runner(event)', highest index priority first, then
+    largest magnitude and then arrival order. At most 'capacity' events wait
+    at the same time. An event (identified by its UUID) is never pending or
+    running twice (finished ones can be queued again) and the events still
+    running when the service stopped are run again at start.
+    """
+
+    # Initialization method
+    def __init__(self, path, runner, capacity=256, workers=1, retention=30*86400):
+        """
+        Open (or create) the queue
+        """
+        self.path = path
+        self.runner = runner
+        self.capacity = capacity
+        self.workers = workers
+        self.window = 100
+        self._threads = []
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=FULL")
+            self._db.executescript(SCHEMA)
+
+            # Forget old finished events
+            self._db.execute("DELETE FROM events WHERE state IN ('done', 'failed') "
+                             "AND finished < ?", (time.time() - retention,))
+
+            # Workflows interrupted by a restart are run again
+            interrupted = self._db.execute("UPDATE events SET state = 'pending', started = NULL "
+                                           "WHERE state = 'running'").rowcount
+
+        if interrupted:
+            print("INFO: " + str(interrupted) + " interrupted events queued again", flush=True)
+
+    def start(self):
+        """
+        Start the worker threads
+        """
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def room(self):
+        """
+        Number of events that can be queued
+        """
+        with self._lock:
+            depth = self._db.execute("SELECT COUNT(*) FROM events "
+                                     "WHERE state = 'pending'").fetchone()[0]
+        return max(self.capacity - depth, 0)
+
+    def push(self, events, priorities):
+        """
+        Queue a list of events in order until the queue is full. Return the
+        status of each event processed: 'queued', 'requeued' (it had already
+        finished and will run again), 'duplicate' (it is pending or running,
+        so it is not queued twice) or 'invalid' (it has no UUID).
+        """
+        status = []
+        now = time.time()
+
+        with self._available:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                depth = self._db.execute("SELECT COUNT(*) FROM events "
+                                         "WHERE state = 'pending'").fetchone()[0]
+                for event, priority in zip(events, priorities):
+                    if not isValid(event):
+                        status.append('invalid')
+                        continue
+
+                    known = self._db.execute("SELECT state FROM events WHERE uuid = ?",
+                                             (event['uuid'],)).fetchone()
+                    if known and known[0] in ('pending', 'running'):
+                        status.append('duplicate')
+                        continue
+
+                    if depth >= self.capacity:
+                        break
+
+                    values = (priority, magnitude(event), json.dumps(event), now, event['uuid'])
+                    if known:
+                        self._db.execute("UPDATE events SET state = 'pending', priority = ?, "
+                                         "magnitude = ?, body = ?, queued = ?, started = NULL, "
+                                         "finished = NULL WHERE uuid = ?", values)
+                        status.append('requeued')
+                    else:
+                        self._db.execute("INSERT INTO events (priority, magnitude, body, queued, uuid) "
+                                         "VALUES (?, ?, ?, ?, ?)", values)
+                        status.append('queued')
+                    depth += 1
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+            self._available.notify_all()
+
+        return status
+
+    def _claim(self):
+        """
+        Wait for the next pending event and mark it as running
+        """
+        with self._available:
+            while True:
+                row = self._db.execute("SELECT id, body FROM events WHERE state = 'pending' "
+                                       "ORDER BY priority DESC, magnitude DESC, id "
+                                       "LIMIT 1").fetchone()
+                if row:
+                    break
+                self._available.wait()
+
+            self._db.execute("UPDATE events SET state = 'running', started = ? WHERE id = ?",
+                             (time.time(), row[0]))
+
+        return row[0], json.loads(row[1])
+
+    def _finish(self, id, state):
+        with self._lock:
+            self._db.execute("UPDATE events SET state = ?, finished = ? WHERE id = ?",
+                             (state, time.time(), id))
+
+    def _work(self):
+        while True:
+            id, event = self._claim()
+            try:
+                state = 'done' if self.runner(event) else 'failed'
+            except Exception as error:
+                print("ERROR: Event " + str(event.get('uuid')) + " failed", flush=True)
+                traceback.print_exc(file=sys.stdout)
+                state = 'failed'
+            self._finish(id, state)
+
+    def stats(self):
+        """
+        Depth, running events and waiting times (seconds) of the queue
+        """
+        now = time.time()
+        with self._lock:
+            states = dict(self._db.execute("SELECT state, COUNT(*) FROM events "
+                                           "GROUP BY state").fetchall())
+            oldest = self._db.execute("SELECT MIN(queued) FROM events "
+                                      "WHERE state = 'pending'").fetchone()[0]
+            byPriority = dict(self._db.execute("SELECT priority, COUNT(*) FROM events "
+                                               "WHERE state = 'pending' "
+                                               "GROUP BY priority").fetchall())
+            waits = [w for (w,) in self._db.execute("SELECT started - queued FROM events "
+                                                    "WHERE started IS NOT NULL "
+                                                    "ORDER BY started DESC LIMIT ?",
+                                                    (self.window,))]
+
+        return {'depth': states.get('pending', 0),
+                'depthByPriority': {str(p): n for p, n in byPriority.items()},
+                'running': states.get('running', 0),
+                'done': states.get('done', 0),
+                'failed': states.get('failed', 0),
+                'capacity': self.capacity,
+                'workers': self.workers,
+                'oldestWait': now - oldest if oldest is not None else 0.0,
+                'meanWait': sum(waits) / len(waits) if waits else 0.0,
+                'maxWait': max(waits) if waits else 0.0}
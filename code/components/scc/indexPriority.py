@@ -48,22 +48,133 @@ from flask import jsonify
 import numpy as np
 import pandas as pd
 import pickle
-from sklearn.preprocessing import MinMaxScaler
-from sklearn.decomposition import PCA
+from scipy.spatial import ConvexHull
+import sklearn
 from sklearn.svm import SVC  
-from haversine import haversine
 
 # Internal
-from ucis4eq.misc import config, principalComponents, microServiceABC
+from ucis4eq.misc import config, principalComponents, microServiceABC, geoResolver
 import ucis4eq.dal as dal
-from ucis4eq.dal import staticDataMap
+from ucis4eq.dal import staticDataMap, staticDataRegistry
+from ucis4eq.scc import pgaIndex
 
 # ###############################################################################
 # Methods and classes
 
+# scikit-learn >= 1.5 takes the sign of the PCA components from the components
+# themselves (largest entry positive), older versions from the projections of
+# the samples (largest one positive). With two samples both projections have
+# the same magnitude, the first one (latitudes) is taken as positive (a fitted
+# PCA breaks this tie by the rounding of the SVD, i.e. randomly).
+signFromComponents = tuple(int(v) for v in sklearn.__version__.split('.')[:2]) >= (1, 5)
+
+def loadModel(fileName):
+    """
+    Load a pickled classifier
+    """
+    with open(fileName, 'rb') as f:
+        return pickle.load(f)
+
+class ReferenceNormalization():
+    """
+    Normalization of the events against the reference database
+    (DataBase_LatLon). It stores the minimum and maximum of each column and
+    the moments of the coordinates, so an event is scaled (MinMaxScaler) and
+    its location index (PCA of the scaled latitudes and longitudes) obtained
+    without fitting them again on the whole database. The reference ranges
+    are extended with the event exactly as fitting it together with the
+    database did.
+    """
+
+    # Initialization method
+    def __init__(self, dfLatLon):
+        """
+        Precompute the statistics of a reference database
+        """
+        df = dfLatLon.drop(['Country'], axis=1)
+        values = df.to_numpy(dtype=np.float64)
+        self.min = dict(zip(df.columns, np.nanmin(values, axis=0)))
+        self.max = dict(zip(df.columns, np.nanmax(values, axis=0)))
+
+        # Centered moments of the coordinates
+        points = df[['Latitude', 'Longitude']].to_numpy(dtype=np.float64)
+        self.size = len(points)
+        self.mean = points.mean(axis=0)
+        centered = points - self.mean
+        self.moments = centered.T @ centered
+
+        # The furthest points along any direction are in the convex hull
+        try:
+            vertices = np.sort(ConvexHull(points).vertices)
+        except Exception:
+            # Degenerate sets of points (e.g. aligned)
+            vertices = np.arange(len(points))
+        self.hull = points[vertices]
+
+    @classmethod
+    def fromFile(cls, fileName):
+        return cls(pd.read_pickle(fileName))
+
+    def _scaler(self, column, value):
+        """
+        MinMaxScaler parameters (scale and offset) of a column including a
+        new value
+        """
+        low = np.fmin(self.min.get(column, np.nan), value)
+        high = np.fmax(self.max.get(column, np.nan), value)
+        scale = high - low
+        if not scale >= 10 * np.finfo(np.float64).eps:
+            scale = 1.0
+        scale = 1.0 / scale
+        return scale, -low * scale
+
+    def scale(self, column, value):
+        """
+        Value of a column scaled to [0, 1]
+        """
+        scale, offset = self._scaler(column, value)
+        return value * scale + offset
+
+    def indexLocation(self, latitude, longitude):
+        """
+        Location index of a new event: its component in the first principal
+        direction of the scaled latitudes and longitudes of the database and
+        the event. With two samples (latitudes and longitudes) this direction
+        is the normalized difference between them (latitudes minus
+        longitudes), with the sign convention of the scikit-learn version.
+        """
+        sLat, oLat = self._scaler('Latitude', latitude)
+        sLon, oLon = self._scaler('Longitude', longitude)
+
+        # Difference of the scaled coordinates (a*lat + b*lon + c)
+        a, b = sLat, -sLon
+        c = oLat - oLon
+        d = a * latitude + b * longitude + c
+
+        # Squared norm of the differences of the database and the event
+        coefficients = np.array([a, b])
+        shift = c + coefficients @ self.mean
+        norm = coefficients @ self.moments @ coefficients + \
+               self.size * shift ** 2 + d ** 2
+        if norm <= 0:
+            return 0.0
+
+        if not signFromComponents:
+            return d / np.sqrt(norm)
+
+        # Sign of the largest entry
+        extremes = np.append(self.hull @ coefficients + c, d)
+        sign = np.sign(extremes[np.argmax(np.abs(extremes))])
+
+        return sign * d / np.sqrt(norm)
+
 @staticDataMap.build
 class IndexPriority(microServiceABC.MicroServiceABC):
 
+    # Classifiers voting the urgency of an event
+    classifiers = ("Classifier_RF1990-6", "Classifier_XGB1990-6",
+                   "Classifier_SVM1990-6")
+
     # Initialization method
     def __init__(self):
         """
@@ -75,38 +186,147 @@ class IndexPriority(microServiceABC.MicroServiceABC):
     def entryPoint(self, body):
         """
         This method will figure out the index priority for a given event
+        considering the alerts of all the agencies
+        """
+        
+        alertPriority = self._score(body['alerts'])
+        
+        # Return list of Id of the newly created item
+        return jsonify(result = self._unify(alertPriority), response = 201)   
+
+    @config.safeRun
+    def entryPointBatch(self, body):
         """
+        This method will figure out the index priority for each of the events
+        in body['events'] (e.g. for replaying historical catalogs). Events that
+        can not be scored get an 'error' instead.
+        """
+        
+        events = body['events']
+        alerts = [event.get('alerts') if isinstance(event, dict) else None
+                  for event in events]
+        alertPriority = self._score([alert for eventAlerts in alerts
+                                           if isinstance(eventAlerts, list)
+                                           for alert in eventAlerts])
         
-        alertPriority = []
+        # Split the alerts of each event
+        results = []
+        start = 0
+        for eventAlerts in alerts:
+            if not isinstance(eventAlerts, list):
+                results.append({'error': "The event has no list of alerts"})
+                continue
             
-        alert = body['alerts'][0]
-        self.country = self._getPlace(alert['latitude'], alert['longitude'])
+            end = start + len(eventAlerts)
+            try:
+                results.append(self._unify(alertPriority[start:end]))
+            except Exception as e:
+                results.append({'error': str(e)})
+            start = end
+        
+        return jsonify(result = results, response = 201)
+
+    def _score(self, alerts):
+        """
+        Index priority of a list of alerts. Features are assembled in one
+        DataFrame and each classifier is called once for all of them. Alerts
+        that can not be scored get an 'error' instead.
+        """
         
-        # TODO: Loop for each agency 
-        self.latitude = alert['latitude']
-        self.longitude = alert['longitude']
-        self.depth = alert['depth']
-        self.magnitude = alert['magnitude']
-        self.hour = 0.0   
-        self.intensity = -1000        
-        alertPriority.append(self._indexPriorityCalculation())        
+        # Similar earthquakes of each country
+        self.similarEarthquakes = {}
         
-        # TODO: Unify the decision in one value considering the different agencies 
+        # Countries of all the alerts at once (invalid coordinates are NaN)
+        coordinates = []
+        for alert in alerts:
+            try:
+                coordinates.append((float(alert['latitude']), float(alert['longitude'])))
+            except (KeyError, TypeError, ValueError):
+                coordinates.append((np.nan, np.nan))
+        countries = self._getPlaces([lat for lat, lon in coordinates],
+                                    [lon for lat, lon in coordinates]) if alerts else []
         
-        # Return list of Id of the newly created item
-        return jsonify(result = alertPriority[0], response = 201)   
+        features = {}
+        results = []
+        for i, (alert, country) in enumerate(zip(alerts, countries)):
+            try:
+                if country is None:
+                    raise Exception("The country of the alert could not be resolved")
+                self.country = country
+                self.latitude = float(alert['latitude'])
+                self.longitude = float(alert['longitude'])
+                self.depth = float(alert['depth'])
+                self.magnitude = float(alert['magnitude'])
+                self.hour = 0.0   
+                self.intensity = -1000        
+                features[i] = self._indexPriorityFeatures()
+                results.append(None)
+            except Exception as e:
+                print("WARNING: (Index priority) Alert " + str(i) + " could not be scored: " +
+                      str(e), flush=True)
+                results.append({'priorityIndex': None, 'error': str(e)})
+        
+        if features:
+            dfTest = pd.concat([dfTest for dfTest, similar in features.values()],
+                               ignore_index=True)
+            print(dfTest, flush=True)
+            
+            priority = self._predict(dfTest)
+            print('highPriorityIndex', priority, flush=True)
+            
+            for highPriorityIndex, (i, (dfTest, similar)) in zip(priority, features.items()):
+                results[i] = {'priorityIndex': int(highPriorityIndex),
+                              'similarEarthquakes': similar}
+        
+        return results
+
+    def _predict(self, dfTest):
+        """
+        An event has high priority (1) when at least two of the classifiers
+        agree on it
+        """
+        
+        votes = np.zeros(len(dfTest), dtype=int)
+        for classifier in self.classifiers:
+            model = self._load(classifier, loadModel)
+            votes += np.asarray(model.predict(dfTest), dtype=int)
+        
+        return (votes >= 2).astype(int)
+
+    @staticmethod
+    def _unify(alertPriority):
+        """
+        An event has high priority if any of its alerts has it (similar
+        earthquakes are those of the first alert with the highest priority).
+        Alerts that could not be scored are ignored.
+        """
+        
+        if not alertPriority:
+            raise Exception("The event has no alerts")
+        
+        scored = [a for a in alertPriority if a['priorityIndex'] is not None]
+        if not scored:
+            errors = [a['error'] for a in alertPriority]
+            raise Exception("None of the alerts of the event could be scored" +
+                            (" (" + "; ".join(errors) + ")" if errors else ""))
+        
+        result = dict(max(scored, key=lambda a: a['priorityIndex']))
+        result['alerts'] = [a['priorityIndex'] for a in alertPriority]
+        errors = {str(i): a['error'] for i, a in enumerate(alertPriority) if 'error' in a}
+        if errors:
+            result['errors'] = errors
+        
+        return result
 
-    def _indexPriorityCalculation(self):
+    def _indexPriorityFeatures(self):
         """
-        This method will compute the index priority for a given event
+        This method will compute the features used by the classifiers for a
+        given event and its similar historical earthquakes
         """
         
         # TODO: Put your code here @Marisol
         
         # load databases
-        classifierSVM_file = "Classifier_SVM1990-6"
-        classifierRF_file = "Classifier_RF1990-6"
-        classifierXGB_file = "Classifier_XGB1990-6"
         dataPGA = "dataPGA"
         # dataPGA_folder = dataPGAPath
         fullDB_file = "Full_DataBase"
@@ -124,87 +344,37 @@ class IndexPriority(microServiceABC.MicroServiceABC):
         dfNewEarthquake['Longitude'] = [self.longitude]        
         CountryNewEQ = dfNewEarthquake['Country']
         
-        latVec = np.arange(-90,100,1)
-        for i in np.arange(len(latVec)):
-            if latVec[i] <= dfNewEarthquake['Latitude'][0] < latVec[i+1]:
-                nflag = latVec[i]
-                nflagP = latVec[i-1]
-                nflagL = latVec[i+1]                
-                break
-                
-        dataPGAPath = self.fileMapping[dataPGA] + "/"
-        
-        dataPGAlocal = np.loadtxt(dataPGAPath +'1Degree-PGA_db'+str(nflag)+'.DAT')
-        print(dataPGAPath+'1Degree-PGA_db-'+str(nflag)+'.DAT')
-        df2 = pd.DataFrame()
-        df2['Longitude'] = dataPGAlocal[:,1]
-        df2['Latitude'] = dataPGAlocal[:,0]
-        df2['PGA'] = dataPGAlocal[:,2]        
-        print('df2', df2)
-        dataPGAlocalP = np.loadtxt(dataPGAPath+'1Degree-PGA_db'+str(nflagP)+'.DAT')
-        print(dataPGAPath+'1Degree-PGA_db-'+str(nflagP)+'.DAT')
-        df3 = pd.DataFrame()
-        df3['Longitude'] = dataPGAlocalP[:,1]
-        df3['Latitude'] = dataPGAlocalP[:,0]
-        df3['PGA'] = dataPGAlocalP[:,2] 
-        print('df3', df3)
-        dataPGAlocalL = np.loadtxt(dataPGAPath+'1Degree-PGA_db'+str(nflagL)+'.DAT')
-        print(dataPGAPath+'1Degree-PGA_db-'+str(nflagL)+'.DAT')
-        df4 = pd.DataFrame()
-        df4['Longitude'] = dataPGAlocalL[:,1]
-        df4['Latitude'] = dataPGAlocalL[:,0]
-        df4['PGA'] = dataPGAlocalL[:,2]
-        print('df4', df4)
-        frames = [df3, df2, df4]
-        df1 = pd.concat(frames)  
-        print(df1, flush=True)
-        
+        # PGA of the closest sites of the database (the original scan stopped
+        # one site short of k_neigh)
         k_neigh = 40    # number of neighbors to consider their PGA value
-        PGAneigbors = np.zeros(k_neigh)
         Threshold = 20  # in km
-        A = [1]         # one event 
-        VecKPGA = np.zeros((len(A),2))
-        for j in np.arange(len(A)):           
-            PGAneigbors = np.zeros(k_neigh)
-            NeighborsID = np.zeros(k_neigh)
-            cont = 0
-            for i in np.arange(len(df1)):        
-                dataCoordinatesNew = (dfNewEarthquake['Latitude'],dfNewEarthquake['Longitude'])
-                dataCoordinates = (df1['Latitude'].iloc[i], df1['Longitude'].iloc[i])
-                data_Dist = haversine(dataCoordinates, dataCoordinatesNew) #Haversine distance in km
-                if data_Dist <= Threshold:
-                    PGAneigbors[cont] = df1['PGA'].iloc[i]
-                    NeighborsID[cont] = i
-                    cont += 1                    
-                    if cont == k_neigh-1:
-                        break
-                            
-            VecKPGA[j,0] = np.mean(PGAneigbors[0:cont])
-            VecKPGA[j,1] = np.std(PGAneigbors[0:cont])
+        pga = self._load(dataPGA, pgaIndex.PGAIndex)
+        VecKPGA = np.zeros((1,2))
+        VecKPGA[0] = pga.statistics(self.latitude, self.longitude,
+                                    k_neigh-1, Threshold)
                           
         
         print('VecKPGA', VecKPGA, flush = True)
         
-        dfFull = pd.read_pickle(self.fileMapping[fullDB_file])
-        PGAFull = np.loadtxt(self.fileMapping[fullPGA_file])
-        df = pd.DataFrame()
-        df['PGAMean'] = PGAFull[:,0]
-        df['PGAStd'] = PGAFull[:,1]
-        dfFullNew = pd.concat([dfFull, df], axis=1)
-        
-        print(dfFullNew['Country'], flush=True)
         print('CountryNewEQ', CountryNewEQ, flush=True)
         
-        Z = dfFullNew.index[dfFullNew['Country'].values == CountryNewEQ.values].tolist()
-        SimilarEarthquakes = []
-        for i in np.arange(len(Z)):
-            index = Z[i]
-            SimilarEarthquakes.append(dfFullNew.iloc[Z[i]])
-          
+        # Similar earthquakes (shared by all the events of the same country)
+        if self.country not in self.similarEarthquakes:
+            dfFull = self._load(fullDB_file, pd.read_pickle)
+            PGAFull = self._load(fullPGA_file, np.loadtxt)
+            df = pd.DataFrame()
+            df['PGAMean'] = PGAFull[:,0]
+            df['PGAStd'] = PGAFull[:,1]
+            dfFullNew = pd.concat([dfFull, df], axis=1)
+        
+            Z = dfFullNew.index[dfFullNew['Country'].values == CountryNewEQ.values].tolist()
+            SimilarEarthquakes = []
+            for i in np.arange(len(Z)):
+                SimilarEarthquakes.append(dfFullNew.iloc[Z[i]])
+            print('Z', Z, flush = True)  
+            self.similarEarthquakes[self.country] = pd.DataFrame(SimilarEarthquakes).to_dict()
           
-        print('Z', Z, flush = True)  
-        dfCountry = pd.read_table(self.fileMapping[countryDB_file])
-        print(dfCountry['Country'])
+        dfCountry = self._load(countryDB_file, pd.read_table)
         A = dfCountry.index[dfCountry['Country'].values == CountryNewEQ.values].tolist()
         print('A', A)
         
@@ -217,130 +387,71 @@ class IndexPriority(microServiceABC.MicroServiceABC):
         dfNewEarthquake['PGAMean'] = [VecKPGA[j,0]]
         dfNewEarthquake['PGAStd'] = [VecKPGA[j,1]]
         print('dfNewEarthquake', dfNewEarthquake, flush = True)
-        dfLatLon = pd.read_pickle(self.fileMapping[latlonDB_file])
-        dfLatLon = dfLatLon.append(dfNewEarthquake,sort=False)
-      
-        dfLatLon = dfLatLon.drop(['Country'],axis=1)
-        scaler = MinMaxScaler(feature_range=(0,1))
-        df_Sca = pd.DataFrame(scaler.fit_transform(dfLatLon), columns=dfLatLon.columns)
-        
-        
-        data = [df_Sca['Latitude'],df_Sca['Longitude']] #.iloc[:,5]]
-        print('data', data, flush=True)
-        headers = ["Latitude", "Longitude"] 
-        df3 = pd.concat(data, axis=1, keys=headers)
-        df_Sca = df_Sca.drop(['PGAStd'],axis=1)
-        num_components=1
-        var_threshold=0.99
+        # Scale the event against the reference database (the location
+        # index is the first principal component of the scaled coordinates)
+        normalization = self._load(latlonDB_file, ReferenceNormalization.fromFile)
+        dfTest = pd.DataFrame()
+        dfTest['PGAMean'] = [normalization.scale('PGAMean', VecKPGA[j,0])]
+        dfTest['indexLocation'] = [normalization.indexLocation(self.latitude,
+                                                               self.longitude)*-1.0]
+        for column in ['FocalDepth', 'Magnitude', 'InfIndex', 'IndexQuality']:
+            dfTest[column] = [normalization.scale(column, dfNewEarthquake[column][0])]
         
-        print('entre_a_PCA')
-        pca = PCA()
-        pca.fit(df3.T)
-	
-        pcomp = pca.components_
-        pcomp = pcomp.T # take transopose in order to get as (n_features, n_components)
-	
-        if num_components is None:
-          num_components = pd.Series(pca.explained_variance_ratio_).cumsum()
-          num_components = num_components[num_components < var_threshold].size
-    
-        pcomp = pd.DataFrame(pcomp[:,:num_components])
-        pcomp.index = df3.index
-        indice = pcomp     
+        return dfTest, self.similarEarthquakes[self.country]
+
+    def _load(self, name, loader):
+        """
+        Obtain a static data object shared by all the requests (it is only
+        loaded again when its file changes)
+        """
+        return staticDataRegistry.registry.get(self.fileMapping, name, loader)
+
+    def _getPlaces(self, latitudes, longitudes):
+        """
+        Country of each event among the ones of the historical database,
+        looking for it onshore and then offshore (EEZ)
+        """
         
-        print('indice', indice, flush=True)
+        dfFull = self._load("Full_DataBase", pd.read_pickle)
+        dfFullVec = set(dfFull["Country"].unique())
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
         
-        df_Sca['indexLocation'] = indice
-        cols = ['indexLocation']  + [col for col in df_Sca if col != 'indexLocation']
-        df_Sca = df_Sca[cols]
-        cols = ['PGAMean']  + [col for col in df_Sca if col != 'PGAMean']
-        df_Sca = df_Sca[cols]
-        df_Sca = df_Sca.drop(['Latitude'],axis = 1)
-        df_Sca = df_Sca.drop(['Longitude'],axis = 1)
-        df_Sca = df_Sca.drop(['Hour'],axis = 1)
-        df_Sca = df_Sca.drop(['IncomingSal'],axis = 1)
-        df_Sca.iloc[-1]['FocalDepth']
-        print(df_Sca, flush=True)
-        dfTest = pd.DataFrame()
-        dfTest['PGAMean'] = [df_Sca.iloc[-1]['PGAMean']]
-        dfTest['indexLocation'] = [df_Sca.iloc[-1]['indexLocation']*-1.0]
-        dfTest['FocalDepth'] = [df_Sca.iloc[-1]['FocalDepth']]
-        dfTest['Magnitude'] = [df_Sca.iloc[-1]['Magnitude']]
-        dfTest['InfIndex'] = [df_Sca.iloc[-1]['InfIndex']]
-        dfTest['IndexQuality'] = [df_Sca.iloc[-1]['IndexQuality']]
-        print(dfTest, flush=True)
+        countries = [None] * len(latitudes)
         
-        modelRF = pickle.load(open(self.fileMapping[classifierRF_file], 'rb'))
-        UrgencyIndexRF = modelRF.predict(dfTest)
-        PredRF = modelRF.predict_proba(dfTest)
+        # data = requests.get("https://raw.githubusercontent.com/datasets/geo-countries/master/data/countries.geojson").json()
+        onShore = self._load("Countries_OnShore", geoResolver.GeoResolver)
+        pending = []
+        for i, country_Name in enumerate(onShore.locateMany(longitudes, latitudes, "ADMIN")):
+            print("country_Name_OnShore", country_Name)
+            if country_Name and country_Name.upper() in dfFullVec:
+                countries[i] = country_Name.upper()
+            elif not country_Name:
+                pending.append(i)
         
-        modelXGB = pickle.load(open(self.fileMapping[classifierXGB_file], 'rb'))
-        UrgencyIndexXGB = modelXGB.predict(dfTest)
-        PredXGB = modelXGB.predict_proba(dfTest)
-        
-        modelSVM = pickle.load(open(self.fileMapping[classifierSVM_file], 'rb'))
-        UrgencyIndexSVM = modelSVM.predict(dfTest)
-        PredSVM = modelSVM.predict_proba(dfTest)
+        # eez_v11.json
+        properties = ["TERRITORY1", "SOVEREIGN1", "SOVEREIGN2", "TERRITORY2", "GEONAME"]
+        if pending:
+            offShore = self._load("Countries_OffShore", geoResolver.GeoResolver)
+        for proper in properties:
+            if not pending:
+                break
+            
+            print("proper",proper)
+            names = offShore.locateMany(longitudes[pending], latitudes[pending], proper)
+            remaining = []
+            for i, country_Name in zip(pending, names):
+                print("country_Name",country_Name)
+                if country_Name and country_Name.upper() in dfFullVec:
+                    countries[i] = country_Name.upper()
+                else:
+                    remaining.append(i)
+            pending = remaining
         
-        dfSE = pd.DataFrame(SimilarEarthquakes) 
-        highPriorityIndex = 0
-        if UrgencyIndexRF[0] + UrgencyIndexXGB[0] + UrgencyIndexSVM[0] >= 2:
-          highPriorityIndex = 1
-        elif UrgencyIndexRF[0] + UrgencyIndexXGB[0] + UrgencyIndexSVM[0] <= 1:
-          highPriorityIndex = 0
-          
-        print('highPriorityIndex', highPriorityIndex, flush=True)
-        print('dfSE',dfSE.to_dict())
-
-                      
-        return {'priorityIndex':highPriorityIndex, 'similarEarthquakes': dfSE.to_dict()} 
+        return countries
 
     def _getPlace(self, lat, lon):
-
-      dfFull = pd.read_pickle(self.fileMapping["Full_DataBase"])
-      dfFullVec = dfFull["Country"].unique()
-      country_Name = ""
-
-    
-    # data = requests.get("https://raw.githubusercontent.com/datasets/geo-countries/master/data/countries.geojson").json()
-      with open(self.fileMapping["Countries_OnShore"], 'r', encoding='utf-8') as f:
-          data = json.load(f)
-          countries = {}
-          for feature in data["features"]:
-              geom = feature["geometry"]
-              country = feature["properties"]["ADMIN"] # countries.geojson
-              countries[country] = prep(shape(geom))
-            
-          def get_country(lon, lat):
-              point = Point(lon, lat)
-              for country, geom in countries.items():
-                  if geom.contains(point):
-                      return country    
-                  
-          country_Name = get_country(lon, lat)        
-          print("country_Name_OnShore", country_Name)
-          if country_Name and country_Name.upper() in dfFullVec:                          
-              return country_Name.upper()
-                        
-          if not country_Name:
-              with open(self.fileMapping["Countries_OffShore"], 'r', encoding='utf-8') as f:
-                  data = json.load(f)               
-
-                  properties = ["TERRITORY1", "SOVEREIGN1", "SOVEREIGN2", "TERRITORY2", "GEONAME"]
-                  for proper in properties:
-                      print("proper",proper)
-                      countries = {}   
-                      for feature in data["features"]:                            
-                          geom = feature["geometry"]
-                          country = feature["properties"][proper] # eez_v11.json  #JAPAN
-                          countries[country] = prep(shape(geom))        
-                      def get_country(lon, lat):
-                          point = Point(lon, lat)
-                          for country, geom in countries.items():
-                              if geom.contains(point):
-                                  return country             
-                      country_Name = get_country(lon, lat)                   
-                      print("country_Name",country_Name)
-                      if country_Name and country_Name.upper() in dfFullVec:                          
-                          return country_Name.upper()
-                          break        
+        """
+        Country of an event (see _getPlaces)
+        """
+        return self._getPlaces([lat], [lon])[0]
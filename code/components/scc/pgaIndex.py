@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+
+# Spatial index over the 1-degree PGA database
+# This module is part of the Smart Center Control (SSC) solution
+
+# Author:  Juan Esteban Rodríguez, Josep de la Puente
+# Contact: juan.rodriguez@bsc.es, josep.delapuente@bsc.es
+
+# ###############################################################################
+#       BSD 3-CLAUSE, aka BSD NEW, aka BSD REVISED, aka MODIFIED BSD LICENSE
+
+# Copyright 2023,2024 Josep de la Puente, Juan Esteban Rodriguez
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name(s) of the copyright holder(s) nor the name(s) of its
+# contributor(s) may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDER(S) AND CONTRIBUTOR(S) “AS
+# IS” AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER(S) OR CONTRIBUTOR(S) BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# ###############################################################################
+# Module imports
+import os
+import re
+import json
+import math
+import shutil
+
+# Third parties
+import numpy as np
+
+# Internal
+from ucis4eq.dal import staticDataCache
+from ucis4eq.scc.CMTCatalog import haversineVector, EARTH_RADIUS
+
+# ###############################################################################
+# Methods and classes
+
+# Files of the text database (one per degree of latitude)
+BAND_FILE = re.compile(r"^1Degree-PGA_db(-?\d+)\.DAT$")
+
+# Columns of the binary store (the row of each site in its original file is
+# needed to keep the order of the text database)
+COLUMNS = ("latitude", "longitude", "pga", "row")
+
+def storeFolder(folder):
+    """
+    Location of the binary store of a PGA database folder
+    """
+    return folder.rstrip("/") + ".store/"
+
+def _bands(folder):
+    """
+    Text files of the database indexed by band, with their modification time
+    and size
+    """
+    bands = {}
+    for name in os.listdir(folder):
+        match = BAND_FILE.match(name)
+        if match:
+            st = os.stat(os.path.join(folder, name))
+            bands[int(match.group(1))] = [name, st.st_mtime_ns, st.st_size]
+    return bands
+
+def _unchanged(folder, stored, bands):
+    """
+    Check if the text files are the converted ones. Files touched again
+    (e.g. downloaded) are accepted when their size and contents are the same.
+    """
+    if set(stored) != set(str(band) for band in bands):
+        return False
+
+    for band, (name, mtime, size) in bands.items():
+        old = stored[str(band)]
+        if len(old) != 4 or old[0] != name or old[2] != size:
+            return False
+        if old[1] != mtime and old[3] != staticDataCache.cache.digest(folder + name):
+            return False
+
+    return True
+
+def _readMetadata(store):
+    try:
+        with open(store + "meta.json", 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def convert(folder):
+    """
+    Convert the text database into a single float32 array (one row per
+    column, sites of each band sorted by longitude) and a table with the
+    offsets of each band
+    """
+    folder = folder.rstrip("/") + "/"
+    store = storeFolder(folder)
+    bands = _bands(folder)
+
+    print("INFO: Converting the PGA database '" + folder + "' (" +
+          str(len(bands)) + " bands)", flush=True)
+
+    chunks = []
+    offsets = {}
+    start = 0
+    for band in sorted(bands):
+        bands[band].append(staticDataCache.cache.digest(folder + bands[band][0]))
+        data = np.loadtxt(folder + bands[band][0], ndmin=2)
+        if len(data) > 2**24:
+            raise Exception("Band " + str(band) + " of the PGA database is too large")
+
+        order = np.argsort(data[:, 1], kind='stable')
+        chunk = np.empty((len(COLUMNS), len(data)), dtype=np.float32)
+        chunk[0] = data[order, 0]
+        chunk[1] = data[order, 1]
+        chunk[2] = data[order, 2]
+        chunk[3] = order
+        chunks.append(chunk)
+
+        offsets[str(band)] = [start, start + len(data)]
+        start += len(data)
+
+    if chunks:
+        sites = np.concatenate(chunks, axis=1)
+    else:
+        sites = np.zeros((len(COLUMNS), 0), dtype=np.float32)
+
+    # Write in a temporary folder and then replace the old one
+    tmp = store.rstrip("/") + ".tmp/"
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+    np.save(tmp + "sites.npy", sites)
+    with open(tmp + "meta.json", 'w') as f:
+        json.dump({"columns": COLUMNS, "bands": bands, "offsets": offsets}, f)
+
+    shutil.rmtree(store, ignore_errors=True)
+    os.replace(tmp.rstrip("/"), store.rstrip("/"))
+
+    return store
+
+def prepare(folder):
+    """
+    Obtain the binary store of a PGA database, converting the text files
+    only when there is no store or their contents changed
+    """
+    folder = folder.rstrip("/") + "/"
+    store = storeFolder(folder)
+    meta = _readMetadata(store)
+    bands = _bands(folder)
+
+    if not meta or not _unchanged(folder, meta['bands'], bands):
+        convert(folder)
+    elif any(meta['bands'][str(band)][1] != mtime for band, (name, mtime, size) in bands.items()):
+        # Same contents, remember the new modification times
+        for band, (name, mtime, size) in bands.items():
+            meta['bands'][str(band)][1] = mtime
+        with open(store + "meta.json", 'w') as f:
+            json.dump(meta, f)
+
+    return store
+
+class PGAIndex():
+    """
+    Spatial index over the PGA database. The sites are read (zero-copy) from
+    the memory-mapped binary store, where the sites of each band are sorted
+    by longitude, so a query only evaluates the distance to the sites inside
+    a longitude window.
+    """
+
+    # Initialization method
+    def __init__(self, folder):
+        """
+        Initialize the index with the folder of the PGA database
+        """
+        store = prepare(folder)
+        self.sites = np.load(store + "sites.npy", mmap_mode='r')
+        self.offsets = {int(band): tuple(offset)
+                        for band, offset in _readMetadata(store)['offsets'].items()}
+
+    def band(self, band):
+        """
+        Sites of a latitude band (None if it is not in the database)
+        """
+        if band not in self.offsets:
+            return None
+
+        start, end = self.offsets[band]
+        return self.sites[:, start:end]
+
+    @staticmethod
+    def _window(latitude, longitude, radius):
+        """
+        Longitude ranges containing every site closer than 'radius' (km)
+        """
+        # Highest latitude reachable within the radius
+        angle = radius / EARTH_RADIUS
+        phi = min(math.radians(abs(latitude)) + angle, math.pi / 2)
+        ratio = math.sin(angle / 2) / max(math.cos(phi), 1e-12)
+
+        if ratio >= 1:
+            return [(-np.inf, np.inf)]
+
+        # Extra margin for rounding errors
+        width = math.degrees(2 * math.asin(ratio)) * (1 + 1e-6) + 1e-6
+        if width >= 180:
+            return [(-np.inf, np.inf)]
+
+        # Consider longitudes given in [-180, 180] or in [0, 360]
+        return [(longitude + shift - width, longitude + shift + width)
+                for shift in (-360, 0, 360)]
+
+    def neighbours(self, latitude, longitude, k, radius):
+        """
+        PGA of the first 'k' sites closer than 'radius' (km) to a point. Sites
+        follow the order of the database files (band below, the band of the
+        point and band above), as the original row by row scan did.
+        """
+        nflag = int(math.floor(latitude))
+        windows = self._window(latitude, longitude, radius)
+
+        values = []
+        for band in (nflag - 1, nflag, nflag + 1):
+            sites = self.band(band)
+            if sites is None:
+                continue
+
+            # Candidates by longitude
+            lon = sites[1]
+            candidates = np.concatenate([
+                np.arange(np.searchsorted(lon, lo, 'left'),
+                          np.searchsorted(lon, hi, 'right'))
+                for lo, hi in windows])
+            candidates = sites[:, candidates].astype(np.float64)
+
+            distance = haversineVector(candidates[0], candidates[1],
+                                       latitude, longitude)
+            selected = candidates[:, distance <= radius]
+
+            # Back to the order of the file
+            selected = selected[:, np.argsort(selected[3], kind='stable')]
+            values.append(selected[2])
+
+            if sum(len(v) for v in values) >= k:
+                break
+
+        if not values:
+            return np.zeros(0)
+
+        return np.concatenate(values)[:k]
+
+    def statistics(self, latitude, longitude, k, radius):
+        """
+        Mean and standard deviation of the PGA of the neighbour sites
+        """
+        values = self.neighbours(latitude, longitude, k, radius)
+
+        return np.mean(values), np.std(values)
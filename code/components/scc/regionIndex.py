@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+
+# In-memory spatial index of the simulation regions
+# This module is part of the Smart Center Control (SSC) solution
+
+# Author:  Juan Esteban Rodríguez, Josep de la Puente
+# Contact: juan.rodriguez@bsc.es, josep.delapuente@bsc.es
+
+# ###############################################################################
+#       BSD 3-CLAUSE, aka BSD NEW, aka BSD REVISED, aka MODIFIED BSD LICENSE
+
+# Copyright 2023,2024 Josep de la Puente, Juan Esteban Rodriguez
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name(s) of the copyright holder(s) nor the name(s) of its
+# contributor(s) may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDER(S) AND CONTRIBUTOR(S) “AS
+# IS” AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER(S) OR CONTRIBUTOR(S) BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# ###############################################################################
+# Module imports
+import math
+import time
+import hashlib
+import threading
+
+# Third parties
+import numpy as np
+import shapely
+from shapely.strtree import STRtree
+from bson.json_util import dumps
+
+# Internal
+import ucis4eq.dal as dal
+from ucis4eq.scc.CMTCatalog import EARTH_RADIUS
+
+# ###############################################################################
+# Methods and classes
+
+# Fields of the regions returned by EventRegion
+FIELDS = ("id", "file_structure", "available_ensemble", "available_fmax",
+          "depth_in_m", "min_latitude", "max_latitude", "min_longitude",
+          "max_longitude")
+
+def longitudeSpan(minLongitude, maxLongitude):
+    """
+    Width (degrees) of a longitude range. Ranges crossing the antimeridian
+    can be given as min > max (170, -170) or beyond 180 (170, 190).
+    """
+    width = np.asarray(maxLongitude, dtype=np.float64) - minLongitude
+    return np.where(width >= 360, 360.0, np.mod(width, 360))
+
+def containsLongitude(minLongitude, maxLongitude, longitude):
+    """
+    Check if longitudes are in a range (inclusive limits)
+    """
+    return np.mod(np.asarray(longitude, dtype=np.float64) - minLongitude, 360) <= \
+           longitudeSpan(minLongitude, maxLongitude)
+
+def boxArea(minLatitude, maxLatitude, minLongitude, maxLongitude):
+    """
+    Area (km2) of a latitude/longitude box on the sphere
+    """
+    return EARTH_RADIUS ** 2 * np.radians(longitudeSpan(minLongitude, maxLongitude)) * \
+           np.abs(np.sin(np.radians(maxLatitude)) - np.sin(np.radians(minLatitude)))
+
+def bounds(region):
+    """
+    Bounding box (min/max latitude, min/max longitude) of a region document
+    (None if it is not complete)
+    """
+    values = [region.get(field) for field in FIELDS[-4:]]
+    if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in values):
+        return values
+
+    return None
+
+def _boxRing(lat0, lat1, lon0, lon1, step):
+    """
+    Counter-clockwise ring of a box with the edges sampled every 'step' degrees
+    """
+    lons = np.linspace(lon0, lon1, max(int(math.ceil((lon1 - lon0) / step)), 1) + 1)
+    lats = np.linspace(lat0, lat1, max(int(math.ceil((lat1 - lat0) / step)), 1) + 1)
+
+    ring = [[lon, lat0] for lon in lons] + \
+           [[lon1, lat] for lat in lats[1:]] + \
+           [[lon, lat1] for lon in lons[::-1][1:]] + \
+           [[lon0, lat] for lat in lats[::-1][1:]]
+
+    return np.array(ring).tolist()
+
+def boxGeometry(minLatitude, maxLatitude, minLongitude, maxLongitude,
+                step=0.5, margin=1e-3):
+    """
+    GeoJSON polygon of a latitude/longitude box. Edges of 2dsphere polygons
+    are geodesics, so the parallels are sampled every 'step' degrees and the
+    box is enlarged by 'margin' degrees (exact limits are checked on the
+    results of the queries).
+
+    Mongo takes the smaller of the two polygons a ring defines, so boxes
+    crossing the antimeridian or wider than 180 degrees are split (at the
+    antimeridian and then in equal parts) into a MultiPolygon.
+    """
+    lat0 = max(minLatitude - margin, -90 + 1e-6)
+    lat1 = min(maxLatitude + margin, 90 - 1e-6)
+
+    # Start in [-180, 180), the end is beyond 180 if it crosses the antimeridian
+    start = (minLongitude + 180) % 360 - 180
+    end = start + float(longitudeSpan(minLongitude, maxLongitude))
+    lon0 = max(start - margin, -180)
+    lon1 = end + margin if end > 180 else min(end + margin, 180)
+    if lon1 - lon0 >= 360:
+        lon0, lon1 = -180, 180
+
+    parts = [[lon0, min(lon1, 180)]]
+    if lon1 > 180:
+        parts.append([-180, lon1 - 360])
+
+    polygons = []
+    for start, end in parts:
+        pieces = int((end - start) // 180) + 1
+        cuts = np.linspace(start, end, pieces + 1)
+        for i in range(pieces):
+            polygons.append([_boxRing(lat0, lat1, cuts[i], cuts[i + 1], step)])
+
+    if len(polygons) == 1:
+        return {"type": "Polygon", "coordinates": polygons[0]}
+
+    return {"type": "MultiPolygon", "coordinates": polygons}
+
+def averagePosition(alerts):
+    """
+    Average latitude and longitude of a set of alerts (non numeric values are
+    ignored as $avg does)
+    """
+    position = []
+    for field in ("latitude", "longitude"):
+        values = [a[field] for a in alerts
+                  if isinstance(a.get(field), (int, float)) and not isinstance(a.get(field), bool)]
+        position.append(float(np.mean(values)) if values else None)
+
+    return tuple(position)
+
+class RegionIndex():
+    """
+    In-memory R-tree (STRtree) over the bounding boxes of the Regions
+    collection. Regions containing a point are returned sorted by area (the
+    smallest first). The collection is read again every 'refresh' seconds
+    and the index rebuilt only when it changed.
+    """
+
+    # Initialization method
+    def __init__(self, collection="Regions", refresh=60):
+        """
+        Initialize the index (it is built on first use)
+        """
+        self.collection = collection
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        self._checked = None
+        self._digest = None
+        self.regions = []
+
+    def _read(self):
+        """
+        Regions (and their bounding boxes) of the collection
+        """
+        projection = {field: 1 for field in FIELDS}
+        regions = []
+        for doc in dal.database[self.collection].find({}, projection):
+            doc["_id"] = str(doc["_id"])
+            if bounds(doc):
+                regions.append(doc)
+
+        return regions
+
+    def _build(self, regions):
+        """
+        Sort the regions by area and index their bounding boxes
+        """
+        bounds = np.array([[r["min_latitude"], r["max_latitude"],
+                            r["min_longitude"], r["max_longitude"]] for r in regions],
+                          dtype=np.float64).reshape(-1, 4)
+
+        # Smallest regions first (ties keep the order of the collection)
+        order = np.argsort(boxArea(*bounds.T), kind='stable')
+        self.regions = [regions[i] for i in order]
+        self.bounds = bounds[order]
+
+        # Boxes start in [-180, 180) and can go beyond 180 (up to 540)
+        starts = np.mod(self.bounds[:, 2] + 180, 360) - 180
+        ends = starts + longitudeSpan(self.bounds[:, 2], self.bounds[:, 3])
+        self.tree = STRtree(shapely.box(starts, self.bounds[:, 0],
+                                        ends, self.bounds[:, 1]))
+
+    def update(self, force=False):
+        """
+        Read the collection again when the refresh period expired
+        """
+        with self._lock:
+            now = time.monotonic()
+            if not force and self._checked is not None and \
+               now - self._checked < self.refresh:
+                return
+
+            regions = self._read()
+            digest = hashlib.sha1(dumps(regions, sort_keys=True).encode('utf-8')).hexdigest()
+            if digest != self._digest:
+                print("INFO: Indexing " + str(len(regions)) + " regions", flush=True)
+                self._build(regions)
+                self._digest = digest
+            self._checked = now
+
+    def invalidate(self):
+        """
+        Read the collection on next lookup
+        """
+        with self._lock:
+            self._checked = None
+
+    def lookupMany(self, latitudes, longitudes):
+        """
+        Regions containing each of the points (sorted by area)
+        """
+        self.update()
+
+        latitudes = np.atleast_1d(np.asarray(latitudes, dtype=np.float64))
+        longitudes = np.atleast_1d(np.asarray(longitudes, dtype=np.float64))
+        results = [[] for i in range(len(latitudes))]
+        if not self.regions:
+            return results
+
+        # Candidates by bounding box (regions are sorted by area). Points are
+        # also looked up one turn east for the boxes beyond 180.
+        valid = ~(np.isnan(latitudes) | np.isnan(longitudes))
+        normalized = np.mod(longitudes + 180, 360) - 180
+        points, regions = self.tree.query(
+            shapely.points(np.concatenate([normalized, normalized + 360]),
+                           np.concatenate([latitudes, latitudes])))
+        points = points % len(latitudes)
+        keep = valid[points]
+        points, regions = points[keep], regions[keep]
+
+        # Inclusive limits, as the former $lte/$gte query
+        b = self.bounds[regions]
+        inside = (b[:, 0] <= latitudes[points]) & (latitudes[points] <= b[:, 1]) & \
+                 containsLongitude(b[:, 2], b[:, 3], longitudes[points])
+        points, regions = points[inside], regions[inside]
+
+        # Sorted by point and region, without repetitions
+        for point, region in np.unique(np.column_stack([points, regions]), axis=0):
+            results[point].append(dict(self.regions[region]))
+
+        return results
+
+    def query(self, latitude, longitude):
+        """
+        Regions containing a point obtained from the database (the 2dsphere
+        index on their GeoJSON geometry), sorted by area
+        """
+        point = {"type": "Point", "coordinates": [longitude, latitude]}
+        projection = {field: 1 for field in FIELDS}
+
+        regions = []
+        for doc in dal.database[self.collection].find(
+                {"geometry": {"$geoIntersects": {"$geometry": point}}},
+                projection).sort([("area", 1), ("_id", 1)]):
+            limits = bounds(doc)
+            if limits and limits[0] <= latitude <= limits[1] and \
+               containsLongitude(limits[2], limits[3], longitude):
+                doc["_id"] = str(doc["_id"])
+                regions.append(doc)
+
+        return regions
+
+    def lookup(self, latitude, longitude):
+        """
+        Regions containing a point (sorted by area)
+        """
+        if latitude is None or longitude is None:
+            return []
+
+        return self.lookupMany([latitude], [longitude])[0]
+
+# Index shared by all the services of the process
+regions = RegionIndex()
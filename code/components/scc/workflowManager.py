@@ -185,14 +185,15 @@ class WorkflowManagerEmulator(microServiceABC.MicroServiceABC):
                 input["domain"] = domain
                 input["resources"] = compResources
 
-                for a in event['alerts']:
-
-                    input['event'] = a
+                # All the alerts share the same catalog (just one request)
+                r = requests.post(self.url + ":5000/cmtBatch",
+                                  json=dict(input, events=event['alerts']))
+                config.checkPostRequest(r)
+                cmtsAlerts = r.json()['result']
 
-                    r = requests.post(self.url + ":5000/cmt", json=input)
-                    config.checkPostRequest(r)
+                for a, cmt in zip(event['alerts'], cmtsAlerts):
 
-                    cmt = r.json()['result']
+                    input['event'] = a
 
                     if "cmt" in a.keys():
                         cmt.update(a["cmt"])
@@ -361,11 +362,11 @@ class PyCommsWorkflowManager(microServiceABC.MicroServiceABC):
                 precmt = build_cmt_input(eid, region, resources, setup)		
                 # Compute alerts
                 all_results = []
-                for alert in event['alerts']:	
-                    # Calculating CMTs
-                    cmts = calculate_cmt(alert, eid, region, precmt)
-                    # Wait for calculated CMTs
-                    cmts = compss_wait_on(cmts)	
+                # Calculating CMTs of all the alerts (sharing the catalog)
+                cmtsAlerts = calculate_cmt_batch(event['alerts'], eid, region, precmt)
+                # Wait for calculated CMTs
+                cmtsAlerts = compss_wait_on(cmtsAlerts)
+                for alert, cmts in zip(event['alerts'], cmtsAlerts):
                     # For each calculated or provided CMT
                     for cmt in cmts.keys():
                         # For each GP defined trial
@@ -493,6 +494,17 @@ def calculate_cmt(alert, event_id, region, precmt):
     """
     pass
 
+#@on_failure(management='IGNORE', returns=0)
+@http(request="POST", resource="cmtBatch", service_name="microServices",
+      payload='{ "events" : {{alerts}}, "id" : {{event_id}}, \
+                 "region" : {{region}}, "setup" : {{precmt}} }',
+      produces='{"result" : "{{return_0}}"}')
+@task(returns=1)
+def calculate_cmt_batch(alerts, event_id, region, precmt):
+    """
+    """
+    pass
+
 #@on_failure(management='IGNORE', returns=0)
 @http(request="POST", resource="computeResources", service_name="microServices",
       payload='{ "id" : {{event_id}}, "region": {{region}} }',
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+
+# Offline builder of the precomputed CMT grids of the regions
+# This module is part of the Smart Center Control (SSC) solution
+
+# Author:  Juan Esteban Rodríguez, Josep de la Puente
+# Contact: juan.rodriguez@bsc.es, josep.delapuente@bsc.es
+
+# ###############################################################################
+#       BSD 3-CLAUSE, aka BSD NEW, aka BSD REVISED, aka MODIFIED BSD LICENSE
+
+# Copyright 2023,2024 Josep de la Puente, Juan Esteban Rodriguez
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name(s) of the copyright holder(s) nor the name(s) of its
+# contributor(s) may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDER(S) AND CONTRIBUTOR(S) “AS
+# IS” AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER(S) OR CONTRIBUTOR(S) BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+# ###############################################################################
+import os
+import sys
+import traceback
+import argparse
+import contextlib
+import multiprocessing
+
+# Third parties
+import numpy as np
+
+# Internal
+import ucis4eq
+import ucis4eq.dal as dal
+from ucis4eq.dal import dataStructure, staticDataCache
+from ucis4eq.scc.event import EventRegion
+from ucis4eq.scc.CMTCalculation import CMTCalculation
+from ucis4eq.scc.CMTGrid import CMTGrid, gridFileName, setupDigest, catalogVersion
+
+# CMT calculation of each worker process
+_calculator = None
+_verbose = False
+
+
+def parser():
+
+    # Parse the arguments
+    parser = argparse.ArgumentParser(
+        prog='cmtGridBuilder',
+        description='Precompute the statistical CMT of the regions on a lat/lon/depth grid')
+    parser.add_argument('--regions', nargs='+', default=None,
+                        help='Regions to build (all of them by default)')
+    parser.add_argument('--step', type=float, default=0.1,
+                        help='Latitude and longitude step (degrees)')
+    parser.add_argument('--depths', type=float, nargs=3, default=[0., 50000., 5000.],
+                        metavar=('MIN', 'MAX', 'STEP'),
+                        help='Depth range and step (meters)')
+    parser.add_argument('--processes', type=int, default=os.cpu_count(),
+                        help='Number of worker processes')
+    parser.add_argument('--verbose', action='store_true',
+                        help='Show the output of the CMT calculation')
+    args = parser.parse_args()
+
+    # Check the arguments
+    if args.step <= 0 or args.depths[2] <= 0:
+        raise Exception("Grid steps must be > 0")
+
+    # Return them
+    return args
+
+def initialize(body, verbose):
+    """
+    Prepare the CMT calculation of a worker process
+    """
+    global _calculator, _verbose
+    _verbose = verbose
+    _calculator = CMTCalculation()
+    _calculator._prepare(body)
+
+def evaluate(task):
+    """
+    Solutions of the nodes of a latitude row (as the CMT calculation of
+    an event without origin time at each node)
+    """
+    lat, longitudes, depths = task
+
+    row = []
+    with contextlib.ExitStack() as stack:
+        if not _verbose:
+            devnull = stack.enter_context(open(os.devnull, 'w'))
+            stack.enter_context(contextlib.redirect_stdout(devnull))
+
+        for lon in longitudes:
+            for depth in depths:
+                _calculator._setEvent({"latitude": lat, "longitude": lon, "depth": depth,
+                                       "magnitude": 0., "time": None})
+                # Distance reached by the neighbours search (any new event
+                # may change a failed node)
+                try:
+                    cmts = _calculator._getFocalMechanism()
+                    reach = _calculator.threshold
+                except Exception:
+                    cmts = {}
+                    reach = np.inf
+
+                row.append(({name: (float(cmt['strike']), float(cmt['dip']), float(cmt['rake']))
+                             for name, cmt in cmts.items()},
+                            reach))
+
+    return row
+
+def solutionOrder(name):
+    """
+    Order of the CMT calculation output: median solution, nearest neighbours
+    and clusters (auxiliary plane after each one)
+    """
+    base, aux = name.replace("_AuxPlane", ""), name.endswith("_AuxPlane")
+    if base == "Median":
+        return (0, 0, aux)
+    kind, number = base.split("-")
+    return (1 if kind == "k" else 2, int(number), aux)
+
+def assemble(latitudes, longitudes, depths, rows, version, setup):
+    """
+    CMT grid of the rows evaluated
+    """
+    # Store the solutions as a dense array
+    names = sorted({name for row in rows for node, reach in row for name in node},
+                   key=solutionOrder)
+    position = {name: i for i, name in enumerate(names)}
+    mechanisms = np.full((len(latitudes), len(longitudes), len(depths), len(names), 3),
+                         np.nan, dtype=np.float32)
+    reaches = np.zeros((len(latitudes), len(longitudes)))
+    for i, row in enumerate(rows):
+        for j, (node, reach) in enumerate(row):
+            for name, mechanism in node.items():
+                mechanisms[i, j // len(depths), j % len(depths), position[name]] = mechanism
+            reaches[i, j // len(depths)] = max(reaches[i, j // len(depths)], reach)
+
+    return CMTGrid(latitudes, longitudes, depths, names, mechanisms,
+                   catalog=version,
+                   setup=setupDigest(setup),
+                   reach=reaches)
+
+def buildRegion(region, args):
+    """
+    Build the CMT grid of a region
+    """
+    # Download the region and its statistical CMT setup
+    region['path'] = EventRegion().fileMapping[region['id']]
+    dataFormat = dataStructure.formats[region['file_structure']]()
+    dataFormat.prepare(region['id'])
+    setup = staticDataCache.cache.document(region['path'] + "/" +
+                                           dataFormat.getPathTo('source_ensemble') +
+                                           "/statisticalCMT.json")
+    body = {"region": region, "setup": setup}
+
+    # Lattice covering the region
+    latitudes = np.arange(region['min_latitude'], region['max_latitude'] + args.step / 2, args.step)
+    longitudes = np.arange(region['min_longitude'], region['max_longitude'] + args.step / 2, args.step)
+    depths = np.arange(args.depths[0], args.depths[1] + args.depths[2] / 2, args.depths[2])
+    print("INFO: Building the CMT grid of region '" + region['id'] + "' (" +
+          str(len(latitudes)) + "x" + str(len(longitudes)) + "x" + str(len(depths)) + " nodes)",
+          flush=True)
+
+    # Version of the catalog (and incremental updates) used
+    calculator = CMTCalculation()
+    calculator._prepare(body)
+    version = catalogVersion(calculator.catalogFileName)
+
+    # Evaluate the rows in parallel
+    tasks = [(lat, longitudes, depths) for lat in latitudes]
+    with multiprocessing.Pool(args.processes, initializer=initialize,
+                              initargs=(body, args.verbose)) as pool:
+        rows = []
+        for row in pool.imap(evaluate, tasks):
+            rows.append(row)
+            print("INFO: Row " + str(len(rows)) + "/" + str(len(tasks)) + " done", flush=True)
+
+    grid = assemble(latitudes, longitudes, depths, rows, version, setup)
+    grid.save(gridFileName(region['id']))
+    print("INFO: CMT grid stored in '" + gridFileName(region['id']) + "'", flush=True)
+
+def main():
+    try:
+        # Call the parser
+        args = parser()
+
+        # Regions with a statistical CMT ensemble
+        query = {"available_ensemble": "statisticalCMT"}
+        if args.regions:
+            query["id"] = {"$in": args.regions}
+        regions = list(dal.database['Regions'].find(query, {"_id": False}))
+        if not regions:
+            raise Exception("There are no regions with a statistical CMT ensemble to build")
+
+        for region in regions:
+            buildRegion(region, args)
+
+    except Exception as error:
+        print("Exception in code:")
+        print('-'*80)
+        traceback.print_exc(file=sys.stdout)
+        print('-'*80)
+
+# ###############################################################################
+
+if __name__ == "__main__":
+    main()
@@ -53,6 +53,10 @@ def parser():
     parser.add_argument('config', help='Remote JSON configuration file')
     parser.add_argument('-p', dest='opid',
                         help='Wait for a given PID before start')
+    parser.add_argument('--mode', choices=['pool', 'asyncio'], default=None,
+                        help='Poll the agencies in rounds (pool) or each one on '
+                             'its own (asyncio). Taken from the configuration '
+                             'file by default')
     args = parser.parse_args()
     # Return them
     return args
@@ -63,9 +67,9 @@ def main():
         # Call the parser
         args = parser()
         if (args.config == "config_events"):
-            ws = FDSNClient.WSEvents().start(args.config)
+            ws = FDSNClient.WSEvents().start(args.config, args.mode)
         else:
-            ws = FDSNClient.WSGeneral().start(args.config)
+            ws = FDSNClient.WSGeneral().start(args.config, args.mode)
     except Exception as error:
         print("Exception in code:")
         print('-' * 80)
@@ -44,8 +44,8 @@ from flask import Flask, request, jsonify
 
 # Load micro-services implemented components
 from ucis4eq.misc import config
-from ucis4eq.scc.event import EventRegistration, EventRegion, EventCountry, EventSetState, EventSetup
-from ucis4eq.scc.CMTCalculation import CMTCalculation, CMTInputs, CMTSeisEnsMan
+from ucis4eq.scc.event import EventRegistration, EventRegion, EventCountry, EventSetState, EventSetup, EventEPSG
+from ucis4eq.scc.CMTCalculation import CMTCalculation, CMTInputs, CMTSeisEnsMan, clusteringMemo
 from ucis4eq.scc.sourceAssesment import SourceType, PunctualSource
 from ucis4eq.scc.inputBuilder import InputParametersBuilder
 from ucis4eq.scc.indexPriority import IndexPriority
@@ -143,6 +143,25 @@ def CMTCalculationService(body):
     return CMTCalculation().entryPoint(body)
 
 
+# CMT Aproximation for all the alerts of an event
+@microServicesApp.route("/cmtBatch", methods=['POST'])
+@postRequest
+def CMTCalculationBatchService(body):
+    """
+    Call component implementing this micro service
+    """
+    return CMTCalculation().entryPointBatch(body)
+
+
+# Usage of the CMT clustering memo
+@microServicesApp.route("/cmtClusteringMemo", methods=['GET'])
+def CMTClusteringMemoService():
+    """
+    Hits and misses of the memoized CMT clustering
+    """
+    return jsonify(result = clusteringMemo.stats(), response = 200)
+
+
 # CMT SeisEnsMan
 @microServicesApp.route("/cmtSeisEnsMan", methods=['POST'])
 @postRequest
@@ -164,6 +183,16 @@ def indexPriorityService(body):
     return IndexPriority().entryPoint(body)
 
 
+# Index Priority for a list of events
+@microServicesApp.route("/indexPriorityBatch", methods=['POST'])
+@postRequest
+def indexPriorityBatchService(body):
+    """
+    Call component implementing this micro service
+    """
+    return IndexPriority().entryPointBatch(body)
+
+
 # Determine the kind of source for the simulation
 @microServicesApp.route("/sourceType", methods=['POST'])
 @postRequest
@@ -224,6 +253,16 @@ def eventRegionService(body):
     return EventRegion().entryPoint(body)
 
 
+# Event domains detection for a list of events
+@microServicesApp.route("/eventRegionBatch", methods=['POST'])
+@postRequest
+def eventRegionBatchService(body):
+    """
+    Call component implementing this micro service
+    """
+    return EventRegion().entryPointBatch(body)
+
+
 # Event domains detection
 @microServicesApp.route("/eventSetup", methods=['POST'])
 @postRequest
@@ -244,6 +283,16 @@ def eventCountryService(body):
     return EventCountry().entryPoint(body)
 
 
+# UTM zone (EPSG code) of an event or a list of points
+@microServicesApp.route("/eventEPSG", methods=['POST'])
+@postRequest
+def eventEPSGService(body):
+    """
+    Call component implementing this micro service
+    """
+    return EventEPSG().entryPoint(body)
+
+
 # Computing resources service
 @microServicesApp.route("/computeResources", methods=['POST'])
 @postRequest
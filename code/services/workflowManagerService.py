@@ -34,6 +34,7 @@
 # OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 # ###############################################################################
+import os
 import sys
 import json
 import ast
@@ -44,7 +45,9 @@ from functools import wraps
 from flask import Flask, request, jsonify
 
 # Load micro-services implemented components
+import ucis4eq
 from ucis4eq.scc.workflowManager import WorkflowManagerEmulator, PyCommsWorkflowManager
+from ucis4eq.scc import eventQueue
 #from ucis4eq.scc.workflowManagerExperimental import DaskWorkflowManager
 
 # ###############################################################################
@@ -52,6 +55,17 @@ from ucis4eq.scc.workflowManager import WorkflowManagerEmulator, PyCommsWorkflow
 # ###############################################################################
 workflowManagerServiceApp = Flask(__name__)
 
+# Queued events run in background (at most WM_WORKERS at the same time and
+# WM_CAPACITY waiting). Workflows end with a global compss_barrier in the
+# shared PyCOMPSs runtime, so events must run one at a time until they wait
+# only on their own tasks.
+workers = int(os.environ.get("WM_WORKERS", "1"))
+capacity = int(os.environ.get("WM_CAPACITY", "256"))
+retryAfter = os.environ.get("WM_RETRY_AFTER", "5")
+queuePath = os.environ.get("WM_QUEUE", ucis4eq.workSpace + "WM/queue.sqlite")
+priorityUrl = (os.getenv("UCIS4EQ_LOCATION") or "http://127.0.0.1") + ":5000/indexPriorityBatch"
+priorityTimeout = float(os.environ.get("WM_PRIORITY_TIMEOUT", "5"))
+
 
 # POST request decorator
 def postRequest(fn):
@@ -108,14 +122,77 @@ def workflowManagerEmulatorService(body):
     return WorkflowManagerEmulator().entryPoint(body)
 
 
+# Run a queued event
+def runEvent(event):
+    with workflowManagerServiceApp.app_context():
+        result = PyCommsWorkflowManager().entryPoint(event)
+
+    # Rejected events and errors caught by the component
+    if isinstance(result, tuple):
+        return False
+    return result.get_json().get('response') != 501
+
+# Persistent queue of the events
+events = eventQueue.EventQueue(queuePath, runEvent, capacity, workers)
+events.start()
+
+
+# Queue a list of events (as many as fit)
+def queueEvents(body):
+    if not isinstance(body, list) or (body and not any(map(eventQueue.isValid, body))):
+        return jsonify(result = "Malformed events (a list of events with their 'uuid' is expected)",
+                       accepted = 0, response = 400), 400
+
+    status = []
+
+    # Full queue, the listener will retry later (events are not scored)
+    if events.room():
+        status = events.push(body, eventQueue.scoreEvents(body, priorityUrl,
+                                                          priorityTimeout))
+    if body and not status:
+        return jsonify(result = "The workflow manager queue is full", accepted = 0,
+                       response = 503), 503, {'Retry-After': retryAfter}
+
+    counts = {s: status.count(s) for s in ('queued', 'requeued', 'duplicate', 'invalid')}
+    return jsonify(result = str(counts['queued'] + counts['requeued']) + " events queued, " +
+                            str(counts['duplicate']) + " already pending or running, " +
+                            str(counts['invalid']) + " invalid",
+                   accepted = len(status), queued = counts['queued'],
+                   requeued = counts['requeued'], duplicates = counts['duplicate'],
+                   invalid = counts['invalid'], status = status,
+                   response = 201), 200, {'Retry-After': retryAfter}
+
+
 # Determine the kind of source for the simulation
 @workflowManagerServiceApp.route("/PyCOMPSsWM", methods=['POST'])
 @postRequest
 def PyCommsWorkflowManagerService(body):
     """
-    Call component implementing this micro service
+    Queue the event for the PyCOMPSs workflow manager
+    """
+    return queueEvents([body])
+
+
+# Accept a batch of events (as many as the workflow manager can take)
+@workflowManagerServiceApp.route("/PyCOMPSsWMBatch", methods=['POST'])
+@postRequest
+def PyCommsWorkflowManagerBatchService(body):
+    """
+    Queue the events for the PyCOMPSs workflow manager
+    """
+    if not isinstance(body, dict):
+        return queueEvents(None)
+
+    return queueEvents(body.get('events', []))
+
+
+# State of the events queue
+@workflowManagerServiceApp.route("/queue", methods=['GET'])
+def queueService():
+    """
+    Depth and waiting times of the events queue
     """
-    return PyCommsWorkflowManager().entryPoint(body)
+    return jsonify(result = events.stats(), response = 201)
 
 
 # ###############################################################################
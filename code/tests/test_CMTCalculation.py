@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+# Tests of the vectorized CMT calculation helpers
+# This module is part of the Smart Center Control (SSC) solution
+
+# Author:  Juan Esteban Rodríguez, Josep de la Puente
+# Contact: juan.rodriguez@bsc.es, josep.delapuente@bsc.es
+
+# ###############################################################################
+#       BSD 3-CLAUSE, aka BSD NEW, aka BSD REVISED, aka MODIFIED BSD LICENSE
+
+# Copyright 2023,2024 Josep de la Puente, Juan Esteban Rodriguez
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name(s) of the copyright holder(s) nor the name(s) of its
+# contributor(s) may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDER(S) AND CONTRIBUTOR(S) “AS
+# IS” AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER(S) OR CONTRIBUTOR(S) BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# ###############################################################################
+# Module imports
+import numpy as np
+import pytest
+from obspy.imaging.beachball import aux_plane
+
+from ucis4eq.scc.CMTCalculation import aux_plane_batch
+
+# ###############################################################################
+# Methods and classes
+
+def test_aux_plane_random():
+    rng = np.random.default_rng(0)
+    strike = rng.uniform(0, 360, 2000)
+    dip = rng.uniform(0, 90, 2000)
+    rake = rng.uniform(-180, 180, 2000)
+
+    strike2, dip2, rake2 = aux_plane_batch(strike, dip, rake)
+    expected = np.array([aux_plane(s, d, r) for s, d, r in zip(strike, dip, rake)])
+
+    np.testing.assert_allclose(strike2, expected[:, 0], rtol=0, atol=1e-9)
+    np.testing.assert_allclose(dip2, expected[:, 1], rtol=0, atol=1e-9)
+    np.testing.assert_allclose(rake2, expected[:, 2], rtol=0, atol=1e-9)
+
+@pytest.mark.parametrize("strike, dip, rake", [
+    (0., 90., 0.), (0., 90., 180.), (45., 0., 0.), (90., 45., 90.),
+    (180., 45., -90.), (359.9, 89.9, -179.9), (30., 60., 0.), (270., 30., 180.)])
+def test_aux_plane_special(strike, dip, rake):
+    # Vertical planes, pure dip-slip and strike-slip mechanisms
+    result = aux_plane_batch(strike, dip, rake)
+    np.testing.assert_allclose(result, aux_plane(strike, dip, rake), rtol=0, atol=1e-9)
+    assert all(np.ndim(value) == 0 for value in result)
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+# Tests of the spatial index of the focal mechanisms catalog
+# This module is part of the Smart Center Control (SSC) solution
+
+# Author:  Juan Esteban Rodríguez, Josep de la Puente
+# Contact: juan.rodriguez@bsc.es, josep.delapuente@bsc.es
+
+# ###############################################################################
+#       BSD 3-CLAUSE, aka BSD NEW, aka BSD REVISED, aka MODIFIED BSD LICENSE
+
+# Copyright 2023,2024 Josep de la Puente, Juan Esteban Rodriguez
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name(s) of the copyright holder(s) nor the name(s) of its
+# contributor(s) may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDER(S) AND CONTRIBUTOR(S) “AS
+# IS” AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER(S) OR CONTRIBUTOR(S) BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# ###############################################################################
+# Module imports
+import numpy as np
+import pytest
+from haversine import haversine
+
+from ucis4eq.scc import CMTCatalog
+from ucis4eq.scc.CMTCatalog import (FocalMechanismCatalog, FocalMechanismIndex,
+                                    haversineVector, EARTH_RADIUS)
+
+# ###############################################################################
+# Methods and classes
+
+def randomCatalog(rng, size, latitudes=(-90, 90), longitudes=(-180, 180)):
+    return FocalMechanismCatalog(latitude=rng.uniform(*latitudes, size),
+                                 longitude=rng.uniform(*longitudes, size),
+                                 depth=rng.uniform(0, 700000, size),
+                                 magnitude=rng.uniform(5, 9, size),
+                                 strike=rng.uniform(0, 360, size),
+                                 dip=rng.uniform(0, 90, size),
+                                 rake=rng.uniform(-180, 180, size),
+                                 time=rng.uniform(0, 1e9, size))
+
+def destination(latitude, longitude, distance, bearing):
+    """
+    Point at a great-circle distance (m) and bearing (degrees) of another one
+    """
+    lat, lon = np.radians(latitude), np.radians(longitude)
+    angle, bearing = distance / (EARTH_RADIUS * 1000), np.radians(bearing)
+    lat2 = np.arcsin(np.sin(lat) * np.cos(angle) +
+                     np.cos(lat) * np.sin(angle) * np.cos(bearing))
+    lon2 = lon + np.arctan2(np.sin(bearing) * np.sin(angle) * np.cos(lat),
+                            np.cos(angle) - np.sin(lat) * np.sin(lat2))
+    return np.degrees(lat2), (np.degrees(lon2) + 540) % 360 - 180
+
+def linearScan(catalog, latitude, longitude, depth, kmin, threshold, growthrate,
+               exclude):
+    """
+    Neighbours computing the distances to every event of the catalog
+    """
+    candidates = np.flatnonzero(~exclude)
+    euclideanDist = catalog.distances(latitude, longitude, depth, candidates)[0]
+    order = np.lexsort((candidates, euclideanDist))
+    while True:
+        k = np.searchsorted(euclideanDist[order], threshold, side='right')
+        if kmin <= k or k == len(candidates):
+            break
+        threshold = threshold * growthrate
+
+    return candidates[order[:k]], euclideanDist[order[:k]], threshold
+
+def check(catalog, index, latitude, longitude, depth, kmin, threshold, growthrate,
+          exclude=None):
+    if exclude is None:
+        exclude = np.zeros(len(catalog), dtype=bool)
+    neighbours, euclideanDist, sphereDist, depthDist, final = \
+        index.neighbours(latitude, longitude, depth, kmin, threshold, growthrate,
+                         exclude=exclude)
+    expected, expectedDist, expectedFinal = \
+        linearScan(catalog, latitude, longitude, depth, kmin, threshold, growthrate,
+                   exclude)
+
+    np.testing.assert_array_equal(neighbours, expected)
+    np.testing.assert_array_equal(euclideanDist, expectedDist)
+    assert final == expectedFinal
+
+@pytest.mark.parametrize("seed", range(5))
+def test_random_catalogs(seed):
+    rng = np.random.default_rng(seed)
+    catalog = randomCatalog(rng, 2000)
+    index = FocalMechanismIndex(catalog)
+
+    for i in range(50):
+        exclude = rng.random(len(catalog)) < 0.05
+        check(catalog, index, rng.uniform(-90, 90), rng.uniform(-180, 180),
+              rng.uniform(0, 700000), int(rng.integers(1, 60)),
+              rng.uniform(1e4, 1e6), rng.uniform(1.05, 2.0), exclude)
+
+@pytest.mark.parametrize("latitude, longitude", [(0., 0.), (89.95, 10.), (-89.95, -170.),
+                                                 (10., 179.99), (-30., -179.99)])
+def test_radius_boundary(latitude, longitude):
+    # Events at the threshold distance (rounding decides if they are inside)
+    rng = np.random.default_rng(1)
+    threshold = 250000.
+    bearings = rng.uniform(0, 360, 400)
+    distances = threshold * (1 + rng.choice([-1e-12, 0., 1e-12], 400))
+    lats, lons = destination(latitude, longitude, distances, bearings)
+    catalog = FocalMechanismCatalog(latitude=lats, longitude=lons,
+                                    depth=np.full(400, 10000.),
+                                    magnitude=np.full(400, 6.), strike=bearings,
+                                    dip=np.full(400, 45.), rake=np.zeros(400),
+                                    time=np.arange(400.))
+    index = FocalMechanismIndex(catalog)
+
+    for kmin in (1, 10, 200, 400, 500):
+        check(catalog, index, latitude, longitude, 10000., kmin, threshold, 1.1)
+        check(catalog, index, latitude, longitude, 10000., kmin, threshold * 0.999, 1.001)
+
+@pytest.mark.parametrize("latitudes, longitudes, point", [
+    ((80, 90), (-180, 180), (89.5, 45.)),
+    ((-90, -80), (-180, 180), (-89.5, -135.)),
+    ((-10, 10), (170, 180), (0., -179.5)),
+    ((-10, 10), (-180, -170), (0., 179.5))])
+def test_poles_and_antimeridian(latitudes, longitudes, point):
+    rng = np.random.default_rng(2)
+    catalog = randomCatalog(rng, 1000, latitudes, longitudes)
+    index = FocalMechanismIndex(catalog)
+
+    for kmin in (1, 5, 30, 100):
+        for threshold in (1e4, 1e5, 5e5):
+            check(catalog, index, point[0], point[1], 10000., kmin, threshold, 1.5)
+
+def test_incremental_updates():
+    rng = np.random.default_rng(3)
+    static = randomCatalog(rng, 1000)
+    updates = randomCatalog(rng, 200).records
+    index = FocalMechanismIndex(static).extend(updates)
+    catalog = index.catalog
+    assert len(catalog) == 1200
+
+    for i in range(30):
+        check(catalog, index, rng.uniform(-90, 90), rng.uniform(-180, 180),
+              rng.uniform(0, 700000), int(rng.integers(1, 60)),
+              rng.uniform(1e4, 1e6), 1.5)
+
+def test_merged_updates():
+    rng = np.random.default_rng(5)
+    index = FocalMechanismIndex(randomCatalog(rng, 1000)).extend(randomCatalog(rng, 300).records)
+    merged = index.merge()
+    assert merged.static == len(merged.catalog) == 1300
+
+    for i in range(30):
+        args = (rng.uniform(-90, 90), rng.uniform(-180, 180), rng.uniform(0, 700000),
+                int(rng.integers(1, 60)), rng.uniform(1e4, 1e6), 1.5)
+        for expected, found in zip(index.neighbours(*args), merged.neighbours(*args)):
+            np.testing.assert_array_equal(found, expected)
+
+    # Events of the static catalog are still ignored, the merged ones are not
+    known = index.catalog.records[[10, 1100]]
+    assert len(merged.extend(known).catalog) == 1301
+
+def test_throttled_updates(monkeypatch):
+    rng = np.random.default_rng(6)
+    reads = []
+    def readUpdates(magnitudeThreshold, after=None):
+        reads.append(after)
+        return randomCatalog(rng, 10).records, len(reads)
+
+    monkeypatch.setattr(CMTCatalog, "_indexes", {})
+    monkeypatch.setattr(CMTCatalog, "_readUpdates", readUpdates)
+    monkeypatch.setattr(CMTCatalog.FocalMechanismCatalog, "load",
+                        classmethod(lambda cls, fileName, threshold: randomCatalog(rng, 100)))
+    monkeypatch.setattr(CMTCatalog.staticDataCache.cache, "stamp", lambda fileName: 1)
+    monkeypatch.setattr(CMTCatalog, "mergeThreshold", 25)
+
+    # Read once per refresh period
+    index = CMTCatalog.loadIndex("catalog.npz", 5.)
+    assert CMTCatalog.loadIndex("catalog.npz", 5.) is index
+    assert reads == [None] and len(index.catalog) == 110
+
+    # Events appended by the process are read on next use
+    monkeypatch.setattr(CMTCatalog, "_appended", CMTCatalog._appended + 1)
+    index = CMTCatalog.loadIndex("catalog.npz", 5.)
+    assert reads == [None, 1] and index.static == 100
+
+    # Expired period, the tree is rebuilt beyond the threshold
+    monkeypatch.setattr(CMTCatalog, "updatesRefresh", 0)
+    index = CMTCatalog.loadIndex("catalog.npz", 5.)
+    assert reads == [None, 1, 2] and index.static == len(index.catalog) == 130
+
+def test_haversine_package():
+    rng = np.random.default_rng(4)
+    lat1, lon1 = rng.uniform(-90, 90, 200), rng.uniform(-180, 180, 200)
+    lat2, lon2 = rng.uniform(-90, 90, 200), rng.uniform(-180, 180, 200)
+    expected = [haversine((a, b), (c, d)) for a, b, c, d in zip(lat1, lon1, lat2, lon2)]
+    np.testing.assert_allclose(haversineVector(lat1, lon1, lat2, lon2), expected,
+                               rtol=1e-12, atol=1e-9)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+# Tests of the precomputed CMT grid
+# This module is part of the Smart Center Control (SSC) solution
+
+# Author:  Juan Esteban Rodríguez, Josep de la Puente
+# Contact: juan.rodriguez@bsc.es, josep.delapuente@bsc.es
+
+# ###############################################################################
+#       BSD 3-CLAUSE, aka BSD NEW, aka BSD REVISED, aka MODIFIED BSD LICENSE
+
+# Copyright 2023,2024 Josep de la Puente, Juan Esteban Rodriguez
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name(s) of the copyright holder(s) nor the name(s) of its
+# contributor(s) may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDER(S) AND CONTRIBUTOR(S) “AS
+# IS” AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER(S) OR CONTRIBUTOR(S) BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# ###############################################################################
+# Module imports
+import os
+import importlib.util
+
+import numpy as np
+import pytest
+
+from ucis4eq.scc import CMTGrid
+from ucis4eq.scc.CMTCatalog import FocalMechanismCatalog, FocalMechanismIndex
+from ucis4eq.scc.CMTCalculation import CMTCalculation
+
+spec = importlib.util.spec_from_file_location("cmtGridBuilder",
+    os.path.join(os.path.dirname(__file__), "..", "services", "cmtGridBuilder.py"))
+builder = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(builder)
+
+# ###############################################################################
+# Methods and classes
+
+SETUP = {"catalog": "catalog.npz", "magnitudethreshold": 5.,
+         "k": {"min": 12}, "distance": {"threshold": 50., "growthrate": 1.5},
+         "output": {"focalmechanisms": 4}}
+
+@pytest.fixture(scope="module")
+def calculation():
+    rng = np.random.default_rng(0)
+    size = 400
+    catalog = FocalMechanismCatalog(latitude=rng.uniform(35, 45, size),
+                                    longitude=rng.uniform(10, 20, size),
+                                    depth=rng.uniform(0, 50000, size),
+                                    magnitude=rng.uniform(5, 8, size),
+                                    strike=rng.uniform(0, 360, size),
+                                    dip=rng.uniform(0, 90, size),
+                                    rake=rng.uniform(-180, 180, size),
+                                    time=rng.uniform(0, 1e9, size))
+    # The static data map of the service is not needed (nor the database)
+    calculation = CMTCalculation.__new__(CMTCalculation)
+    calculation.setup = SETUP
+    calculation.index = FocalMechanismIndex(catalog)
+    calculation.useGrid = False
+    return calculation
+
+@pytest.fixture(scope="module")
+def grid(calculation):
+    latitudes = np.arange(39., 41.01, 0.5)
+    longitudes = np.arange(14., 16.01, 0.5)
+    depths = np.array([0., 10000., 20000.])
+
+    builder._calculator = calculation
+    rows = [builder.evaluate((lat, longitudes, depths)) for lat in latitudes]
+    return builder.assemble(latitudes, longitudes, depths, rows, "", SETUP)
+
+def exact(calculation, lat, lon, depth, time=None):
+    calculation._setEvent({"latitude": lat, "longitude": lon, "depth": depth,
+                           "magnitude": 6., "time": time})
+    return calculation._getFocalMechanism()
+
+def test_grid_matches_exact(calculation, grid):
+    for lat in grid.latitudes[1:-1]:
+        for lon in grid.longitudes[1:-1]:
+            for depth in grid.depths:
+                expected = exact(calculation, lat, lon, depth)
+
+                # Any point nearer to the node than to the others
+                cmts = grid.lookup(lat + 0.1, lon - 0.1,
+                                   depth + (1000. if depth < grid.depths[-1] else -1000.))
+                assert list(cmts) == list(expected)
+                assert any(name.startswith("k-") for name in cmts)
+                for name, cmt in expected.items():
+                    for angle in ("strike", "dip", "rake"):
+                        assert float(cmts[name][angle]) == \
+                               pytest.approx(float(cmt[angle]), abs=1e-3)
+
+def test_grid_opt_in(calculation, grid, monkeypatch):
+    monkeypatch.setattr(CMTGrid, "loadGrid", lambda *args: grid)
+    calculation.regionId, calculation.catalogFileName = "region", "catalog.npz"
+    catalog = calculation.index.catalog
+    try:
+        # Not requested
+        calculation._setEvent({"latitude": 40., "longitude": 15., "depth": 10000.,
+                               "magnitude": 6., "time": None})
+        assert calculation._getGridMechanism() is None
+
+        # Requested for new events
+        calculation.useGrid = True
+        assert calculation._getGridMechanism() == grid.lookup(40., 15., 10000.)
+
+        # Events of the catalog are excluded from their neighbours (exact path)
+        target = int(np.flatnonzero((np.abs(catalog.latitude - 40) < 1) &
+                                    (np.abs(catalog.longitude - 15) < 1))[0])
+        calculation._setEvent({"latitude": 40., "longitude": 15., "depth": 10000.,
+                               "magnitude": 6., "time": float(catalog.time[target])})
+        assert calculation._getGridMechanism() is None
+    finally:
+        calculation.useGrid = False
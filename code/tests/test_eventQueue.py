@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+
+# Tests of the persistent queue of the workflow manager events
+# This module is part of the Smart Center Control (SSC) solution
+
+# Author:  Juan Esteban Rodríguez, Josep de la Puente
+# Contact: juan.rodriguez@bsc.es, josep.delapuente@bsc.es
+
+# ###############################################################################
+#       BSD 3-CLAUSE, aka BSD NEW, aka BSD REVISED, aka MODIFIED BSD LICENSE
+
+# Copyright 2023,2024 Josep de la Puente, Juan Esteban Rodriguez
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name(s) of the copyright holder(s) nor the name(s) of its
+# contributor(s) may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDER(S) AND CONTRIBUTOR(S) “AS
+# IS” AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER(S) OR CONTRIBUTOR(S) BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# ###############################################################################
+# Module imports
+import os
+import importlib.util
+
+import pytest
+
+from ucis4eq.scc.eventQueue import EventQueue, scoreEvents
+
+# ###############################################################################
+# Methods and classes
+
+MALFORMED = [{'alerts': []}, {'uuid': None}, {'uuid': ""}, "event", None]
+
+def test_push_invalid(tmp_path):
+    queue = EventQueue(str(tmp_path / "queue.sqlite"), lambda event: True)
+
+    events = MALFORMED + [{'uuid': 'a'}, {'uuid': 'a'}]
+    assert queue.push(events, [0] * len(events)) == ['invalid'] * len(MALFORMED) + \
+                                                    ['queued', 'duplicate']
+    assert queue.stats()['depth'] == 1
+
+def test_score_invalid():
+    # Invalid events are not scored (nor is the unavailable service reached)
+    assert scoreEvents(MALFORMED, "http://127.0.0.1:9/indexPriorityBatch",
+                       timeout=0.5) == [0] * len(MALFORMED)
+
+@pytest.mark.parametrize("route, body, code", [
+    ("/PyCOMPSsWM", {'alerts': []}, 400),
+    ("/PyCOMPSsWMBatch", {'events': [{'alerts': []}]}, 400),
+    ("/PyCOMPSsWMBatch", {'events': {'uuid': 'a'}}, 400),
+    ("/PyCOMPSsWMBatch", [{'uuid': 'a'}], 400),
+    ("/PyCOMPSsWMBatch", {'events': [{'alerts': []}, {'uuid': 'a', 'priority': 1}]}, 200)])
+def test_route_malformed(tmp_path, monkeypatch, route, body, code):
+    pytest.importorskip("pycompss")
+    monkeypatch.setenv("WM_QUEUE", str(tmp_path / "queue.sqlite"))
+    monkeypatch.setenv("WM_WORKERS", "0")
+    spec = importlib.util.spec_from_file_location("workflowManagerService",
+        os.path.join(os.path.dirname(__file__), "..", "services", "workflowManagerService.py"))
+    service = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(service)
+
+    r = service.workflowManagerServiceApp.test_client().post(route, json=body)
+    assert r.status_code == code
+    if code == 200:
+        assert r.get_json()['status'] == ['invalid', 'queued']
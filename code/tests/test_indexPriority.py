@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+
+# Tests of the reference normalization of the index priority
+# This module is part of the Smart Center Control (SSC) solution
+
+# Author:  Juan Esteban Rodríguez, Josep de la Puente
+# Contact: juan.rodriguez@bsc.es, josep.delapuente@bsc.es
+
+# ###############################################################################
+#       BSD 3-CLAUSE, aka BSD NEW, aka BSD REVISED, aka MODIFIED BSD LICENSE
+
+# Copyright 2023,2024 Josep de la Puente, Juan Esteban Rodriguez
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name(s) of the copyright holder(s) nor the name(s) of its
+# contributor(s) may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDER(S) AND CONTRIBUTOR(S) “AS
+# IS” AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER(S) OR CONTRIBUTOR(S) BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# ###############################################################################
+# Module imports
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.preprocessing import MinMaxScaler
+from sklearn.decomposition import PCA
+
+from ucis4eq.scc import indexPriority
+from ucis4eq.scc.indexPriority import ReferenceNormalization
+
+# ###############################################################################
+# Methods and classes
+
+def database(rng, size=500):
+    """
+    Reference database with the layout of DataBase_LatLon
+    """
+    return pd.DataFrame({'Country': rng.choice(["Chile", "Peru", "Italy"], size),
+                         'Latitude': rng.uniform(-60, 70, size),
+                         'Longitude': rng.uniform(-180, 180, size),
+                         'Hour': rng.integers(0, 24, size).astype(float),
+                         'Intensity': rng.uniform(4, 9, size)})
+
+def refit(dfLatLon, event, signFromComponents=None):
+    """
+    Scaled features and location index fitting MinMaxScaler and PCA on the
+    database and the event (as the service did for each request). The sign
+    of the component is the one of the installed scikit-learn or the one
+    taken from its components (>= 1.5) or from its samples (< 1.5, with the
+    exact SVD).
+    """
+    df = pd.concat([dfLatLon, pd.DataFrame([event])], sort=False)
+    df = df.drop(['Country'], axis=1)
+    dfSca = pd.DataFrame(MinMaxScaler(feature_range=(0, 1)).fit_transform(df),
+                         columns=df.columns)
+    df3 = pd.concat([dfSca['Latitude'], dfSca['Longitude']], axis=1,
+                    keys=["Latitude", "Longitude"])
+    pca = PCA()
+    pca.fit(df3.T)
+    component = pca.components_[0]
+
+    if signFromComponents is True:
+        component = component * np.sign(component[np.argmax(np.abs(component))])
+    elif signFromComponents is False:
+        # Projection of the latitudes positive
+        difference = (df3['Latitude'] - df3['Longitude']).to_numpy()
+        component = component * np.sign(component @ difference)
+
+    return dfSca.iloc[-1], component[-1]
+
+@pytest.mark.parametrize("signFromComponents", [None, True, False])
+@pytest.mark.parametrize("seed", range(4))
+def test_matches_refit(seed, signFromComponents, monkeypatch):
+    if signFromComponents is None and not indexPriority.signFromComponents:
+        pytest.skip("The sign of the PCA of scikit-learn < 1.5 depends on rounding")
+    if signFromComponents is not None:
+        monkeypatch.setattr(indexPriority, "signFromComponents", signFromComponents)
+
+    rng = np.random.default_rng(seed)
+    dfLatLon = database(rng)
+    normalization = ReferenceNormalization(dfLatLon)
+
+    for i in range(50):
+        # Events inside and outside the reference ranges
+        event = {'Country': "Chile",
+                 'Latitude': rng.uniform(-80, 80),
+                 'Longitude': rng.uniform(-180, 180),
+                 'Hour': float(rng.integers(0, 24)),
+                 'Intensity': rng.uniform(3, 10)}
+        scaled, index = refit(dfLatLon, event, signFromComponents)
+
+        for column in ('Hour', 'Intensity'):
+            assert normalization.scale(column, event[column]) == \
+                   pytest.approx(scaled[column], abs=1e-12)
+
+        # Same value and sign as the refitted PCA
+        assert normalization.indexLocation(event['Latitude'], event['Longitude']) == \
+               pytest.approx(index, abs=1e-12)
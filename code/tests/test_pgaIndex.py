@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+# Tests of the spatial index of the PGA database
+# This module is part of the Smart Center Control (SSC) solution
+
+# Author:  Juan Esteban Rodríguez, Josep de la Puente
+# Contact: juan.rodriguez@bsc.es, josep.delapuente@bsc.es
+
+# ###############################################################################
+#       BSD 3-CLAUSE, aka BSD NEW, aka BSD REVISED, aka MODIFIED BSD LICENSE
+
+# Copyright 2023,2024 Josep de la Puente, Juan Esteban Rodriguez
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name(s) of the copyright holder(s) nor the name(s) of its
+# contributor(s) may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDER(S) AND CONTRIBUTOR(S) “AS
+# IS” AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER(S) OR CONTRIBUTOR(S) BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# ###############################################################################
+# Module imports
+import math
+
+import numpy as np
+import pytest
+from haversine import haversine
+
+from ucis4eq.scc.pgaIndex import PGAIndex
+
+# ###############################################################################
+# Methods and classes
+
+RADIUS = 20.
+K = 39
+
+# Near band edges, the antimeridian and the poles (and a sparse area)
+POINTS = [(10., 15.), (10.9999, 15.05), (-0.0001, -70.), (0.05, -70.1),
+          (45.3, 179.95), (45.4, -179.97), (-30.02, 180.), (88.7, 20.),
+          (89.95, -100.), (89.99, 60.), (-89.9, 0.), (30.5, 100.)]
+
+def reference(bands, latitude, longitude, k, radius):
+    """
+    Original scan: rows of the band below, the band of the point and the
+    band above (in file order) until k sites within the radius are found
+    """
+    nflag = int(math.floor(latitude))
+    values = []
+    for band in (nflag - 1, nflag, nflag + 1):
+        for lat, lon, pga in bands.get(band, []):
+            if haversine((lat, lon), (latitude, longitude)) <= radius:
+                values.append(pga)
+                if len(values) == k:
+                    return np.array(values)
+
+    return np.array(values)
+
+@pytest.fixture(scope="module")
+def database(tmp_path_factory):
+    """
+    Text bands of a PGA database with clusters of sites around the points
+    """
+    rng = np.random.default_rng(0)
+    sites = [np.column_stack([rng.uniform(-90, 90, 3000), rng.uniform(-180, 180, 3000)])]
+    for i, (lat, lon) in enumerate(POINTS):
+        size = 5 if i == len(POINTS) - 1 else 120
+        spread = 0.3 / max(math.cos(math.radians(lat)), 0.02)
+        sites.append(np.column_stack([np.clip(lat + rng.uniform(-0.3, 0.3, size), -89.9999, 89.9999),
+                                      lon + rng.uniform(-spread, spread, size)]))
+    sites = np.round(np.concatenate(sites), 4)
+    sites[:, 1] = (sites[:, 1] + 180) % 360 - 180
+
+    # Sites closer to the radius than the single precision of the store
+    # are not deterministic
+    ambiguous = np.zeros(len(sites), dtype=bool)
+    for lat, lon in POINTS:
+        ambiguous |= np.array([abs(haversine(tuple(s), (lat, lon)) - RADIUS) < 1e-3
+                               for s in sites])
+    sites = sites[~ambiguous]
+
+    pga = np.round(rng.uniform(0, 1, len(sites)), 6)
+    folder = tmp_path_factory.mktemp("pga") / "PGA"
+    folder.mkdir()
+    bands = {}
+    for band in np.unique(np.floor(sites[:, 0])).astype(int):
+        rows = np.flatnonzero(np.floor(sites[:, 0]) == band)
+        rows = rng.permutation(rows)
+        data = np.column_stack([sites[rows], pga[rows]])
+        np.savetxt(str(folder / ("1Degree-PGA_db" + str(band) + ".DAT")), data,
+                   fmt="%.4f %.4f %.6f")
+        bands[band] = np.loadtxt(str(folder / ("1Degree-PGA_db" + str(band) + ".DAT")),
+                                 ndmin=2).tolist()
+
+    return str(folder), bands
+
+@pytest.mark.parametrize("latitude, longitude", POINTS)
+def test_matches_scan(database, latitude, longitude):
+    folder, bands = database
+    index = PGAIndex(folder)
+
+    for k in (1, 10, K, 1000):
+        expected = reference(bands, latitude, longitude, k, RADIUS)
+        values = index.neighbours(latitude, longitude, k, RADIUS)
+        np.testing.assert_allclose(values, expected, rtol=1e-6)
+
+    mean, std = index.statistics(latitude, longitude, K, RADIUS)
+    expected = reference(bands, latitude, longitude, K, RADIUS)
+    assert mean == pytest.approx(np.mean(expected), rel=1e-6)
+    assert std == pytest.approx(np.std(expected), rel=1e-5, abs=1e-7)
+
+def test_fewer_sites(database):
+    # Less than k sites within the radius
+    folder, bands = database
+    latitude, longitude = POINTS[-1]
+    expected = reference(bands, latitude, longitude, K, RADIUS)
+    assert 0 < len(expected) < K
+    np.testing.assert_allclose(PGAIndex(folder).neighbours(latitude, longitude, K, RADIUS),
+                               expected, rtol=1e-6)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+# Tests of the spatial index of the simulation regions
+# This module is part of the Smart Center Control (SSC) solution
+
+# Author:  Juan Esteban Rodríguez, Josep de la Puente
+# Contact: juan.rodriguez@bsc.es, josep.delapuente@bsc.es
+
+# ###############################################################################
+#       BSD 3-CLAUSE, aka BSD NEW, aka BSD REVISED, aka MODIFIED BSD LICENSE
+
+# Copyright 2023,2024 Josep de la Puente, Juan Esteban Rodriguez
+
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are met:
+# 1. Redistributions of source code must retain the above copyright notice, this
+# list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright notice,
+# this list of conditions and the following disclaimer in the documentation
+# and/or other materials provided with the distribution.
+# 3. Neither the name(s) of the copyright holder(s) nor the name(s) of its
+# contributor(s) may be used to endorse or promote products derived from this
+# software without specific prior written permission.
+
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDER(S) AND CONTRIBUTOR(S) “AS
+# IS” AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE
+# IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE
+# DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT HOLDER(S) OR CONTRIBUTOR(S) BE
+# LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR
+# CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE
+# GOODS OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT
+# OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+# ###############################################################################
+# Module imports
+import time
+
+import numpy as np
+import pytest
+import shapely
+from shapely.geometry import shape
+
+from ucis4eq.scc.regionIndex import (RegionIndex, boxGeometry, boxArea,
+                                     containsLongitude)
+
+# ###############################################################################
+# Methods and classes
+
+def region(identifier, minLatitude, maxLatitude, minLongitude, maxLongitude):
+    return {"_id": str(identifier), "id": identifier,
+            "min_latitude": minLatitude, "max_latitude": maxLatitude,
+            "min_longitude": minLongitude, "max_longitude": maxLongitude}
+
+def pieces(geometry):
+    if geometry["type"] == "Polygon":
+        return [geometry["coordinates"]]
+    return geometry["coordinates"]
+
+def test_box_polygon():
+    geometry = boxGeometry(-10., 10., 20., 30.)
+    assert geometry["type"] == "Polygon"
+
+    ring = np.array(geometry["coordinates"][0])
+    np.testing.assert_allclose(ring.min(axis=0), [19.999, -10.001])
+    np.testing.assert_allclose(ring.max(axis=0), [30.001, 10.001])
+    assert shapely.LinearRing(ring).is_ccw
+
+@pytest.mark.parametrize("limits", [(30., 60., 170., -170.), (30., 60., 170., 190.),
+                                    (-60., 60., -100., 150.), (-80., 80., 0., 300.),
+                                    (-10., 10., -180., 180.), (-10., 10., 100., 90.)])
+def test_box_multipolygon(limits):
+    # Boxes crossing the antimeridian or wider than 180 degrees
+    geometry = boxGeometry(*limits)
+    assert geometry["type"] == "MultiPolygon"
+
+    for polygon in pieces(geometry):
+        ring = np.array(polygon[0])
+        assert ring[:, 0].min() >= -180 and ring[:, 0].max() <= 180
+        assert ring[:, 0].max() - ring[:, 0].min() < 180
+        assert shapely.LinearRing(ring).is_ccw
+
+    # Points of the box (and only them) are covered
+    rng = np.random.default_rng(0)
+    latitudes = rng.uniform(-90, 90, 5000)
+    longitudes = rng.uniform(-180, 180, 5000)
+    inside = (limits[0] <= latitudes) & (latitudes <= limits[1]) & \
+             containsLongitude(limits[2], limits[3], longitudes)
+    covered = shapely.covers(shape(geometry), shapely.points(longitudes, latitudes))
+    np.testing.assert_array_equal(covered, inside)
+
+def test_antimeridian_area():
+    np.testing.assert_allclose(boxArea(0., 10., 170., -170.), boxArea(0., 10., 0., 20.))
+    np.testing.assert_allclose(boxArea(0., 10., 170., 190.), boxArea(0., 10., 0., 20.))
+
+def test_lookup_antimeridian():
+    regions = [region(0, 30., 60., 170., -170.), region(1, 30., 60., 170., 190.),
+               region(2, -10., 10., -180., -170.), region(3, 0., 50., -20., 20.),
+               region(4, -50., 50., 0., 300.)]
+    index = RegionIndex(refresh=1e9)
+    index._build(regions)
+    index._checked = time.monotonic()
+
+    rng = np.random.default_rng(1)
+    latitudes = np.concatenate([rng.uniform(-90, 90, 2000), [45., 45., 0., 0., 45.]])
+    longitudes = np.concatenate([rng.uniform(-180, 180, 2000), [180., -180., 180., -180., 0.]])
+    results = index.lookupMany(latitudes, longitudes)
+
+    areas = [boxArea(*[r[f] for f in ("min_latitude", "max_latitude",
+                                      "min_longitude", "max_longitude")]) for r in regions]
+    for latitude, longitude, found in zip(latitudes, longitudes, results):
+        expected = [r["id"] for r in regions
+                    if r["min_latitude"] <= latitude <= r["max_latitude"] and
+                    containsLongitude(r["min_longitude"], r["max_longitude"], longitude)]
+        expected.sort(key=lambda i: (areas[i], i))
+        assert [r["id"] for r in found] == expected